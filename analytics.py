@@ -2,22 +2,36 @@
 
 from __future__ import annotations
 
+import base64
+import inspect
 import json
 import math
-from collections import defaultdict
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import date, datetime, time, timedelta, timezone
+from functools import partial, wraps
 from zoneinfo import ZoneInfo
 
 import database
 
+try:
+    import numpy as np
+except ImportError:  # dependência opcional: sem ela o cálculo fica em Python
+    np = None
+
 
 TZ_LOCAL = ZoneInfo("America/Sao_Paulo")
 
 
 @contextmanager
 def _conexao():
-    conn = database.conectar()
+    """Conexão do pool de relatórios, somente leitura (`PRAGMAS_ANALITICOS`)."""
+    conn = database.obter_conexao_analitica()
     try:
         with conn:
             yield conn
@@ -39,48 +53,229 @@ def periodo_operacional(data_str: str) -> tuple[str, str]:
     )
 
 
+class CacheAnalitico:
+    """LRU de resultados indexado pelos argumentos e pela versão dos dados.
+
+    A versão muda sempre que um pagamento, movimento, lote ou visita é gravado,
+    então um período fechado continua reaproveitado enquanto o dia corrente é
+    recalculado após cada venda. Os resultados são compartilhados entre as
+    chamadas: quem os recebe não deve alterá-los.
+    """
+
+    def __init__(self, tamanho_maximo: int = 32) -> None:
+        self.tamanho_maximo = max(int(tamanho_maximo), 0)
+        self._trava = threading.Lock()
+        self._entradas: OrderedDict = OrderedDict()
+        self._estatisticas = {"acertos": 0, "falhas": 0, "descartes": 0}
+
+    def obter(self, chave, calcular):
+        if not self.tamanho_maximo:
+            with self._trava:
+                self._estatisticas["falhas"] += 1
+            return calcular()
+        with self._trava:
+            if chave in self._entradas:
+                self._entradas.move_to_end(chave)
+                self._estatisticas["acertos"] += 1
+                return self._entradas[chave]
+            self._estatisticas["falhas"] += 1
+        resultado = calcular()
+        with self._trava:
+            self._entradas[chave] = resultado
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.tamanho_maximo:
+                self._entradas.popitem(last=False)
+                self._estatisticas["descartes"] += 1
+        return resultado
+
+    def limpar(self) -> None:
+        with self._trava:
+            self._entradas.clear()
+
+    def estatisticas(self) -> dict:
+        with self._trava:
+            consultas = self._estatisticas["acertos"] + self._estatisticas["falhas"]
+            return {
+                **self._estatisticas,
+                "taxa_acerto_pct": _percentual(
+                    self._estatisticas["acertos"], consultas
+                ),
+                "entradas": len(self._entradas),
+                "tamanho_maximo": self.tamanho_maximo,
+            }
+
+
+def _tamanho_cache_configurado() -> int:
+    try:
+        return int(os.environ.get("ESPETAO_CACHE_ANALITICO_MAX", "32"))
+    except ValueError:
+        return 32
+
+
+cache_analitico = CacheAnalitico(_tamanho_cache_configurado())
+
+
+def _versao_dados(conn):
+    """
+    Marca barata do estado do banco: os maiores ids crescem a cada gravação e
+    os campos de `operacoes` capturam encerramentos e retomadas. A geração do
+    pool muda quando o banco é trocado ou um novo ciclo zera as sequências.
+    Edições do cadastro (nome, categoria, preço, ordem) não aparecem aqui:
+    `gerenciador_db` limpa `cache_analitico` ao gravá-las.
+    """
+    row = conn.execute(
+        """
+        SELECT
+            (SELECT COALESCE(MAX(id), 0) FROM pagamentos),
+            (SELECT COALESCE(MAX(id), 0) FROM estoque_movimentacoes),
+            (SELECT COALESCE(MAX(id), 0) FROM estoque_lotes),
+            (SELECT COALESCE(MAX(id), 0) || ':'
+                    || COALESCE(MAX(encerrada_em), '') || ':'
+                    || COALESCE(SUM(status = 'aberta'), 0)
+             FROM operacoes),
+            (SELECT COUNT(*) || ':' || COALESCE(MAX(id), 0) || ':'
+                    || COALESCE(SUM(ativo), 0)
+             FROM produtos)
+        """
+    ).fetchone()
+    return (str(database.caminho_banco()), database.pool_analitico.geracao, *row)
+
+
+def _chave_argumento(valor):
+    if isinstance(valor, dict):
+        return tuple(sorted((k, _chave_argumento(v)) for k, v in valor.items()))
+    if isinstance(valor, (set, frozenset)):
+        return tuple(sorted(_chave_argumento(v) for v in valor))
+    if isinstance(valor, (list, tuple)):
+        return tuple(_chave_argumento(v) for v in valor)
+    return valor
+
+
+def _em_cache(funcao):
+    """Guarda o resultado de `funcao` em `cache_analitico`."""
+
+    assinatura = inspect.signature(funcao)
+
+    @wraps(funcao)
+    def envolvida(*args, **kwargs):
+        argumentos = assinatura.bind(*args, **kwargs)
+        argumentos.apply_defaults()
+        with _conexao() as conn:
+            versao = _versao_dados(conn)
+        chave = (
+            funcao.__name__,
+            versao,
+            _chave_argumento(argumentos.arguments),
+        )
+        return cache_analitico.obter(chave, lambda: funcao(*args, **kwargs))
+
+    return envolvida
+
+
+def estatisticas_cache():
+    return cache_analitico.estatisticas()
+
+
+def _filtro_eventos_pagamento(inicio, fim, local_id):
+    condicao = "pg.ocorrido_em >= ? AND pg.ocorrido_em < ?"
+    params = [inicio, fim]
+    if local_id not in ("todos", None):
+        condicao += " AND o.local_id = ?"
+        params.append(int(local_id))
+    return condicao, params
+
+
+METODOS_PAGAMENTO = ("pix", "cartao_credito", "cartao_debito", "dinheiro")
+TIPOS_EVENTO_PAGAMENTO = ("pagamento", "estorno")
+
+
 def _eventos_pagamento(conn, inicio, fim, local_id):
-    query = """
+    condicao, params = _filtro_eventos_pagamento(inicio, fim, local_id)
+    query = f"""
         SELECT pg.*, o.nome_cliente, o.senha_diaria, o.local_id,
                o.operacao_id, o.valor_total_centavos, l.nome AS local_nome
         FROM pagamentos pg
         JOIN pedidos o ON o.id = pg.pedido_id
         JOIN locais l ON l.id = o.local_id
-        WHERE pg.ocorrido_em >= ? AND pg.ocorrido_em < ?
+        WHERE {condicao}
+        ORDER BY pg.ocorrido_em, pg.id
     """
+    return conn.execute(query, params).fetchall()
+
+
+def _filtro_visitas(inicio, fim, local_id):
+    condicao = "o.iniciada_em >= ? AND o.iniciada_em < ?"
     params = [inicio, fim]
     if local_id not in ("todos", None):
-        query += " AND o.local_id = ?"
+        condicao += " AND o.local_id = ?"
         params.append(int(local_id))
-    query += " ORDER BY pg.ocorrido_em, pg.id"
-    return conn.execute(query, params).fetchall()
+    return condicao, params
 
 
 def _visitas_periodo(conn, inicio, fim, local_id):
-    query = """
+    condicao, params = _filtro_visitas(inicio, fim, local_id)
+    query = f"""
         SELECT o.*, l.nome AS local_nome
         FROM operacoes o
         JOIN locais l ON l.id = o.local_id
-        WHERE o.iniciada_em >= ? AND o.iniciada_em < ?
+        WHERE {condicao}
+        ORDER BY o.iniciada_em, o.id
     """
-    params = [inicio, fim]
-    if local_id not in ("todos", None):
-        query += " AND o.local_id = ?"
-        params.append(int(local_id))
-    query += " ORDER BY o.iniciada_em, o.id"
     return conn.execute(query, params).fetchall()
 
 
-def _itens_pedido(conn, pedido_id):
-    return conn.execute(
-        """
+def _itens_por_pedido(conn, pedidos_sql, params):
+    """
+    Carrega em uma consulta os itens de todos os pedidos selecionados por
+    `pedidos_sql` (um SELECT de ids), agrupados por pedido na ordem do cardápio.
+    """
+    itens = defaultdict(list)
+    for row in conn.execute(
+        f"""
         SELECT pi.*, pi.categoria_nome AS categoria
         FROM pedido_itens pi
-        WHERE pi.pedido_id = ?
-        ORDER BY pi.categoria_ordem, pi.produto_ordem, pi.id
+        WHERE pi.pedido_id IN ({pedidos_sql})
+        ORDER BY pi.pedido_id, pi.categoria_ordem, pi.produto_ordem, pi.id
         """,
-        (pedido_id,),
-    ).fetchall()
+        params,
+    ):
+        itens[int(row["pedido_id"])].append(row)
+    return itens
+
+
+def _itens_eventos_pagamento(conn, inicio, fim, local_id):
+    condicao, params = _filtro_eventos_pagamento(inicio, fim, local_id)
+    return _itens_por_pedido(
+        conn,
+        f"""
+        SELECT pg.pedido_id
+        FROM pagamentos pg
+        JOIN pedidos o ON o.id = pg.pedido_id
+        WHERE {condicao}
+        """,
+        params,
+    )
+
+
+def _itens_dos_pedidos(conn, pedido_ids):
+    """Itens de uma lista explícita de pedidos, como uma página do histórico."""
+    if not pedido_ids:
+        return {}
+    placeholders = ",".join("?" for _ in pedido_ids)
+    return _itens_por_pedido(
+        conn,
+        f"SELECT id FROM pedidos WHERE id IN ({placeholders})",
+        list(pedido_ids),
+    )
+
+
+def _itens_pedidos_operacoes(conn, operacao_ids):
+    placeholders = ",".join("?" for _ in operacao_ids)
+    return _itens_por_pedido(
+        conn,
+        f"SELECT id FROM pedidos WHERE operacao_id IN ({placeholders})",
+        list(operacao_ids),
+    )
 
 
 def _item_api(row):
@@ -246,102 +441,217 @@ def _montar_insights(
     return insights[:5]
 
 
-def _calcular_fechamento(inicio, fim, local_id="todos"):
-    with _conexao() as conn:
-        eventos = _eventos_pagamento(conn, inicio, fim, local_id)
-        faturamento_bruto = 0
-        estornos = 0
-        taxas_liquidas = 0
-        cmv_liquido = 0
-        pedidos_pagos = 0
-        pedidos_estornados = 0
-        itens_pagos = 0
-        itens_liquidos = 0
-        pagamentos_por_metodo = defaultdict(int)
-        itens_agregados = {}
-        historico = []
-        cache_itens = {}
-        visitas_por_local = defaultdict(set)
-        nomes_locais = {}
-        visitas_periodo = _visitas_periodo(conn, inicio, fim, local_id)
-        frequencias_produtos = defaultdict(
-            lambda: {"visitas_disponivel": 0, "visitas_com_venda": 0}
+def _movimentacao_estoque_produtos(conn, inicio, fim):
+    """
+    Saldo inicial, entradas e saídas de todo o catálogo em uma consulta.
+
+    Cada lote entra pela quantidade recebida já somada aos ajustes neutros
+    (`impacta_relatorio = 0`) feitos até o fim do período, de modo que a
+    zeragem operacional nunca aparece como saída. As demais movimentações com
+    lote contam pelo próprio sinal: positivas são entradas, negativas são saídas.
+    """
+    return conn.execute(
+        """
+        WITH neutros AS (
+            SELECT lote_id, SUM(quantidade) AS quantidade
+            FROM estoque_movimentacoes
+            WHERE impacta_relatorio = 0 AND lote_id IS NOT NULL
+              AND created_at < :fim
+            GROUP BY lote_id
+        ),
+        linhas AS (
+            SELECT l.produto_id,
+                   l.quantidade_inicial + COALESCE(n.quantidade, 0) AS quantidade,
+                   l.recebido_em AS ocorrido_em
+            FROM estoque_lotes l
+            LEFT JOIN neutros n ON n.lote_id = l.id
+            WHERE l.recebido_em < :fim
+            UNION ALL
+            SELECT produto_id, quantidade, created_at AS ocorrido_em
+            FROM estoque_movimentacoes
+            WHERE lote_id IS NOT NULL AND impacta_relatorio = 1
+              AND created_at < :fim
         )
-        for visita in visitas_periodo:
-            visita_local_id = int(visita["local_id"])
-            visitas_por_local[visita_local_id].add(int(visita["id"]))
-            nomes_locais[visita_local_id] = visita["local_nome"]
-            dados_visita = _analisar_operacao_local(conn, visita)
-            for produto_id, produto in dados_visita["produtos"].items():
-                frequencia = frequencias_produtos[int(produto_id)]
-                frequencia["visitas_disponivel"] += 1
-                if int(produto["vendidas"]) > 0:
-                    frequencia["visitas_com_venda"] += 1
-
-        inicio_local = datetime.fromisoformat(inicio).astimezone(TZ_LOCAL)
-        duracao = datetime.fromisoformat(fim) - datetime.fromisoformat(inicio)
-        total_buckets = max(math.ceil(duracao.total_seconds() / 900), 1)
-        labels = [
-            (inicio_local + timedelta(minutes=15 * indice)).strftime("%H:%M")
-            for indice in range(total_buckets)
-        ]
-        vendas_periodo = [0] * total_buckets
-        pedidos_periodo = [0] * total_buckets
-        estornos_periodo = [0] * total_buckets
-
-        for evento in eventos:
-            sinal = 1 if evento["tipo"] == "pagamento" else -1
-            if evento["tipo"] == "pagamento":
-                faturamento_bruto += evento["valor_centavos"]
-                pedidos_pagos += 1
-            else:
-                estornos += evento["valor_centavos"]
-                pedidos_estornados += 1
-            taxas_liquidas += sinal * evento["taxa_centavos"]
-            pagamentos_por_metodo[evento["metodo"]] += sinal * evento["valor_centavos"]
-
-            pedido_id = evento["pedido_id"]
-            local_evento_id = int(evento["local_id"])
-            nomes_locais[local_evento_id] = evento["local_nome"]
-            if pedido_id not in cache_itens:
-                cache_itens[pedido_id] = _itens_pedido(conn, pedido_id)
-            itens = cache_itens[pedido_id]
-            custo_pedido = sum(item["custo_total_centavos"] for item in itens)
-            cmv_liquido += sinal * custo_pedido
-            if sinal > 0:
-                itens_pagos += sum(item["quantidade"] for item in itens)
-            itens_liquidos += sinal * sum(item["quantidade"] for item in itens)
+        SELECT p.id, p.nome, p.ativo,
+               COALESCE(c.nome, 'Sem categoria') AS categoria,
+               COALESCE(SUM(
+                   CASE WHEN li.ocorrido_em < :inicio THEN li.quantidade END
+               ), 0) AS inicial,
+               COALESCE(SUM(
+                   CASE WHEN li.ocorrido_em >= :inicio AND li.quantidade > 0
+                        THEN li.quantidade END
+               ), 0) AS entradas,
+               COALESCE(SUM(
+                   CASE WHEN li.ocorrido_em >= :inicio AND li.quantidade < 0
+                        THEN -li.quantidade END
+               ), 0) AS saidas
+        FROM produtos p
+        LEFT JOIN categorias c ON c.id = p.categoria_id
+        LEFT JOIN linhas li ON li.produto_id = p.id
+        GROUP BY p.id
+        ORDER BY p.nome
+        """,
+        {"inicio": inicio, "fim": fim},
+    ).fetchall()
 
-            for item in itens:
-                chave = item["produto_id"]
-                agregado = itens_agregados.setdefault(
-                    chave,
-                    {
-                        "produto_id": item["produto_id"],
-                        "nome": item["nome_produto"],
-                        "categoria": item["categoria"],
-                        "quantidade": 0,
-                        "receita_centavos": 0,
-                        "custo_centavos": 0,
-                    },
-                )
-                agregado["quantidade"] += sinal * item["quantidade"]
-                agregado["receita_centavos"] += (
-                    sinal * item["preco_unitario_centavos"] * item["quantidade"]
-                )
-                agregado["custo_centavos"] += sinal * item["custo_total_centavos"]
 
-            horario = datetime.fromisoformat(evento["ocorrido_em"])
-            indice = int(
-                (horario - datetime.fromisoformat(inicio)).total_seconds() // 900
+def _limites_resumo(inicio, fim):
+    """
+    Normaliza o intervalo para o formato de `vendas_resumo_periodo` quando os
+    dois limites caem exatamente no início de um intervalo de 15 minutos.
+    """
+    limites = []
+    for valor in (inicio, fim):
+        try:
+            instante = datetime.fromisoformat(valor)
+        except (TypeError, ValueError):
+            return None
+        if instante.tzinfo is None:
+            return None
+        instante = instante.astimezone(timezone.utc)
+        if (
+            instante.second
+            or instante.microsecond
+            or instante.minute % database.RESUMO_VENDAS_MINUTOS
+        ):
+            return None
+        limites.append(instante.isoformat())
+    return tuple(limites)
+
+
+def _filtro_resumo(inicio, fim, local_id):
+    condicao = "bucket_inicio >= ? AND bucket_inicio < ?"
+    params = [inicio, fim]
+    if local_id not in ("todos", None):
+        condicao += " AND local_id = ?"
+        params.append(int(local_id))
+    return condicao, params
+
+
+# Granularidade da série de vendas pela duração do período: (duração máxima em
+# segundos, chave, rótulo, largura do intervalo em segundos, formato do rótulo).
+GRANULARIDADES_SERIE = (
+    (86400, "15_minutos", "Intervalos de 15 minutos", 900, "%H:%M"),
+    (2 * 86400, "hora", "Por hora", 3600, "%d/%m %H:%M"),
+    (
+        92 * 86400,
+        "dia_operacional",
+        "Consolidado por dia operacional",
+        86400,
+        "%d/%m",
+    ),
+    (None, "semana", "Consolidado por semana", 7 * 86400, "%d/%m"),
+)
+
+
+def _grade_serie(inicio, fim):
+    """
+    Escolhe a granularidade da série antes de somar. O período é coberto por
+    intervalos inteiros de 15 minutos contados a partir de `inicio`; o
+    `alcance` é essa cobertura em segundos e `pontos` o tamanho da série.
+    """
+    duracao = datetime.fromisoformat(fim) - datetime.fromisoformat(inicio)
+    alcance = max(math.ceil(duracao.total_seconds() / 900), 1) * 900
+    for limite, chave, rotulo, largura, formato in GRANULARIDADES_SERIE:
+        if limite is None or alcance <= limite:
+            break
+    return {
+        "chave": chave,
+        "rotulo": rotulo,
+        "largura": largura,
+        "formato": formato,
+        "alcance": alcance,
+        "pontos": math.ceil(alcance / largura),
+    }
+
+
+def _vendas_vazias(grade):
+    return {
+        "faturamento_bruto": 0,
+        "estornos": 0,
+        "taxas": 0,
+        "cmv": 0,
+        "pedidos_pagos": 0,
+        "pedidos_estornados": 0,
+        "itens_pagos": 0,
+        "itens_liquidos": 0,
+        "por_metodo": defaultdict(int),
+        "itens": {},
+        "vendas_periodo": [0] * grade["pontos"],
+        "faturamento_hora": [0] * 24,
+        "pedidos_hora": [0] * 24,
+        "estornos_hora": [0] * 24,
+    }
+
+
+def _acumular_na_grade(vendas, grade, decorrido, valor, pedidos, estornos):
+    """
+    Soma um evento ou resumo na série e na hora do período em que caiu.
+    `decorrido` são os segundos desde o início do período.
+    """
+    if not 0 <= decorrido < grade["alcance"]:
+        return
+    vendas["vendas_periodo"][decorrido // grade["largura"]] += valor
+    hora = decorrido // 3600 % 24
+    vendas["faturamento_hora"][hora] += valor
+    vendas["pedidos_hora"][hora] += pedidos
+    vendas["estornos_hora"][hora] += estornos
+
+
+def _vendas_eventos(conn, inicio, fim, local_id, grade, historico):
+    """Agrega as vendas lendo cada pagamento e estorno com seus itens."""
+    vendas = _vendas_vazias(grade)
+    eventos = _eventos_pagamento(conn, inicio, fim, local_id)
+    itens_por_pedido = _itens_eventos_pagamento(conn, inicio, fim, local_id)
+    # `ocorrido_epoch` já vem gravado; só o início do período é convertido.
+    inicio_epoch = math.floor(datetime.fromisoformat(inicio).timestamp())
+    for evento in eventos:
+        sinal = 1 if evento["tipo"] == "pagamento" else -1
+        if evento["tipo"] == "pagamento":
+            vendas["faturamento_bruto"] += evento["valor_centavos"]
+            vendas["pedidos_pagos"] += 1
+        else:
+            vendas["estornos"] += evento["valor_centavos"]
+            vendas["pedidos_estornados"] += 1
+        vendas["taxas"] += sinal * evento["taxa_centavos"]
+        vendas["por_metodo"][evento["metodo"]] += sinal * evento["valor_centavos"]
+
+        pedido_id = evento["pedido_id"]
+        itens = itens_por_pedido.get(pedido_id, [])
+        custo_pedido = sum(item["custo_total_centavos"] for item in itens)
+        vendas["cmv"] += sinal * custo_pedido
+        if sinal > 0:
+            vendas["itens_pagos"] += sum(item["quantidade"] for item in itens)
+        vendas["itens_liquidos"] += sinal * sum(item["quantidade"] for item in itens)
+
+        for item in itens:
+            agregado = vendas["itens"].setdefault(
+                item["produto_id"],
+                {
+                    "produto_id": item["produto_id"],
+                    "nome": item["nome_produto"],
+                    "categoria": item["categoria"],
+                    "quantidade": 0,
+                    "receita_centavos": 0,
+                    "custo_centavos": 0,
+                },
+            )
+            agregado["quantidade"] += sinal * item["quantidade"]
+            agregado["receita_centavos"] += (
+                sinal * item["preco_unitario_centavos"] * item["quantidade"]
             )
-            if 0 <= indice < total_buckets:
-                vendas_periodo[indice] += sinal * evento["valor_centavos"]
-                if sinal > 0:
-                    pedidos_periodo[indice] += 1
-                else:
-                    estornos_periodo[indice] += 1
+            agregado["custo_centavos"] += sinal * item["custo_total_centavos"]
+
+        _acumular_na_grade(
+            vendas,
+            grade,
+            evento["ocorrido_epoch"] - inicio_epoch,
+            sinal * evento["valor_centavos"],
+            int(sinal > 0),
+            int(sinal < 0),
+        )
 
+        if historico is not None:
             itens_api = [_item_api(item) for item in itens]
             historico.append(
                 {
@@ -355,46 +665,363 @@ def _calcular_fechamento(inicio, fim, local_id="todos"):
                     "itens_json": json.dumps(itens_api, ensure_ascii=False),
                 }
             )
+    return vendas
 
-        faturamento_liquido = faturamento_bruto - estornos
-        lucro_bruto = faturamento_liquido - cmv_liquido
-
-        perdas_centavos = int(
-            conn.execute(
-                """
-                SELECT COALESCE(SUM(ABS(quantidade) * custo_unitario_centavos), 0)
-                FROM estoque_movimentacoes
-                WHERE impacta_relatorio = 1
-                  AND (
-                    tipo = 'perda'
-                    OR (tipo = 'ajuste' AND quantidade < 0)
-                )
-                  AND created_at >= ? AND created_at < ?
-                """,
-                (inicio, fim),
-            ).fetchone()[0]
+
+# A partir deste alcance em segundos (uma semana) o fechamento usa o motor
+# colunar, quando o NumPy está instalado. Em períodos curtos o custo de montar
+# os vetores não compensa.
+ALCANCE_MOTOR_COLUNAR = 7 * 86400
+
+
+def _motor_colunar_ativo(grade):
+    if np is None or os.environ.get("ESPETAO_MOTOR_COLUNAR", "1") == "0":
+        return False
+    return grade["alcance"] >= ALCANCE_MOTOR_COLUNAR
+
+
+def _vendas_colunar(conn, inicio, fim, local_id, grade):
+    """
+    Mesmo resultado de `_vendas_eventos` sem o histórico, com os eventos e os
+    itens carregados em vetores NumPy e somados por `bincount`. Exige o NumPy.
+    """
+    vendas = _vendas_vazias(grade)
+    condicao, params = _filtro_eventos_pagamento(inicio, fim, local_id)
+    # Tuplas simples: montar um `sqlite3.Row` por linha custaria mais que a soma.
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    eventos = cursor.execute(
+        f"""
+        SELECT CASE pg.tipo WHEN 'pagamento' THEN 1 ELSE -1 END,
+               pg.valor_centavos, pg.taxa_centavos, pg.ocorrido_epoch,
+               pg.metodo
+        FROM pagamentos pg
+        JOIN pedidos o ON o.id = pg.pedido_id
+        WHERE {condicao}
+        """,
+        params,
+    ).fetchall()
+    if eventos:
+        sinais, valores, taxas, epochs, metodos = zip(*eventos)
+        sinais = np.array(sinais, dtype=np.int64)
+        valores = np.array(valores, dtype=np.int64)
+        pagos = sinais > 0
+        vendas["faturamento_bruto"] = int(valores[pagos].sum())
+        vendas["estornos"] = int(valores[~pagos].sum())
+        vendas["pedidos_pagos"] = int(pagos.sum())
+        vendas["pedidos_estornados"] = len(eventos) - vendas["pedidos_pagos"]
+        vendas["taxas"] = int((sinais * np.array(taxas, dtype=np.int64)).sum())
+
+        liquidos = sinais * valores
+        nomes_metodo, codigos_metodo = np.unique(
+            np.array(metodos, dtype=object), return_inverse=True
+        )
+        for metodo, total in zip(
+            nomes_metodo.tolist(),
+            np.bincount(
+                codigos_metodo, weights=liquidos, minlength=len(nomes_metodo)
+            ).astype(np.int64).tolist(),
+        ):
+            vendas["por_metodo"][metodo] += total
+
+        inicio_epoch = math.floor(datetime.fromisoformat(inicio).timestamp())
+        decorridos = np.array(epochs, dtype=np.int64) - inicio_epoch
+        dentro = (decorridos >= 0) & (decorridos < grade["alcance"])
+        decorridos = decorridos[dentro]
+        intervalos = decorridos // grade["largura"]
+        horas = decorridos // 3600 % 24
+        for chave, indices, pesos, tamanho in (
+            ("vendas_periodo", intervalos, liquidos[dentro], grade["pontos"]),
+            ("faturamento_hora", horas, liquidos[dentro], 24),
+            ("pedidos_hora", horas, pagos[dentro], 24),
+            ("estornos_hora", horas, ~pagos[dentro], 24),
+        ):
+            vendas[chave] = (
+                np.bincount(indices, weights=pesos, minlength=tamanho)
+                .astype(np.int64)
+                .tolist()
+            )
+
+    # Uma linha por item de cada evento; a ordem é a de `_vendas_eventos`, para
+    # que nome e categoria venham da primeira ocorrência do produto.
+    itens = cursor.execute(
+        f"""
+        SELECT CASE pg.tipo WHEN 'pagamento' THEN 1 ELSE -1 END,
+               pi.produto_id, pi.quantidade, pi.preco_unitario_centavos,
+               pi.custo_total_centavos, pi.nome_produto, pi.categoria_nome
+        FROM pagamentos pg
+        JOIN pedidos o ON o.id = pg.pedido_id
+        JOIN pedido_itens pi ON pi.pedido_id = pg.pedido_id
+        WHERE {condicao}
+        ORDER BY pg.ocorrido_em, pg.id, pi.categoria_ordem, pi.produto_ordem,
+                 pi.id
+        """,
+        params,
+    ).fetchall()
+    if not itens:
+        return vendas
+    sinais, produtos, quantidades, precos, custos, nomes, categorias = zip(*itens)
+    sinais = np.array(sinais, dtype=np.int64)
+    quantidades = np.array(quantidades, dtype=np.int64)
+    custos = sinais * np.array(custos, dtype=np.int64)
+    unidades = sinais * quantidades
+    vendas["cmv"] = int(custos.sum())
+    vendas["itens_pagos"] = int(quantidades[sinais > 0].sum())
+    vendas["itens_liquidos"] = int(unidades.sum())
+
+    ids_produto, primeiras, codigos = np.unique(
+        np.array(produtos, dtype=np.int64), return_index=True, return_inverse=True
+    )
+    total_produtos = len(ids_produto)
+    somas = [
+        np.bincount(codigos, weights=pesos, minlength=total_produtos)
+        .astype(np.int64)
+        .tolist()
+        for pesos in (
+            unidades,
+            unidades * np.array(precos, dtype=np.int64),
+            custos,
         )
-        resultado_operacional = lucro_bruto - taxas_liquidas - perdas_centavos
-        ticket_medio = (
-            _reais(faturamento_bruto) / pedidos_pagos if pedidos_pagos else 0
+    ]
+    for codigo in np.argsort(primeiras, kind="stable").tolist():
+        primeira = int(primeiras[codigo])
+        produto_id = int(ids_produto[codigo])
+        vendas["itens"][produto_id] = {
+            "produto_id": produto_id,
+            "nome": nomes[primeira],
+            "categoria": categorias[primeira],
+            "quantidade": somas[0][codigo],
+            "receita_centavos": somas[1][codigo],
+            "custo_centavos": somas[2][codigo],
+        }
+    return vendas
+
+
+def _vendas_resumidas(conn, inicio, fim, local_id, grade):
+    """
+    Agrega as vendas a partir dos resumos de 15 minutos. Só vale para limites
+    normalizados por `_limites_resumo`; o resultado é o mesmo de
+    `_vendas_eventos`, sem o histórico pedido a pedido.
+    """
+    vendas = _vendas_vazias(grade)
+    condicao, params = _filtro_resumo(inicio, fim, local_id)
+    inicio_dt = datetime.fromisoformat(inicio)
+    for row in conn.execute(
+        f"""
+        SELECT bucket_inicio, metodo,
+               SUM(pagamentos) AS pagamentos,
+               SUM(estornos) AS estornos,
+               SUM(valor_pago_centavos) AS valor_pago,
+               SUM(valor_estornado_centavos) AS valor_estornado,
+               SUM(taxa_centavos) AS taxas,
+               SUM(custo_centavos) AS custo,
+               SUM(unidades_pagas) AS unidades_pagas,
+               SUM(unidades_liquidas) AS unidades_liquidas
+        FROM vendas_resumo_periodo
+        WHERE {condicao}
+        GROUP BY bucket_inicio, metodo
+        """,
+        params,
+    ):
+        liquido = row["valor_pago"] - row["valor_estornado"]
+        vendas["faturamento_bruto"] += row["valor_pago"]
+        vendas["estornos"] += row["valor_estornado"]
+        vendas["taxas"] += row["taxas"]
+        vendas["cmv"] += row["custo"]
+        vendas["pedidos_pagos"] += row["pagamentos"]
+        vendas["pedidos_estornados"] += row["estornos"]
+        vendas["itens_pagos"] += row["unidades_pagas"]
+        vendas["itens_liquidos"] += row["unidades_liquidas"]
+        vendas["por_metodo"][row["metodo"]] += liquido
+        horario = datetime.fromisoformat(row["bucket_inicio"])
+        _acumular_na_grade(
+            vendas,
+            grade,
+            int((horario - inicio_dt).total_seconds()),
+            liquido,
+            row["pagamentos"],
+            row["estornos"],
         )
-        media_itens = itens_pagos / pedidos_pagos if pedidos_pagos else 0
-        margem_bruta_pct = _percentual(lucro_bruto, faturamento_liquido)
-        margem_operacional_pct = _percentual(resultado_operacional, faturamento_liquido)
-        taxa_estorno_pct = _percentual(estornos, faturamento_bruto)
-        cmv_pct = _percentual(cmv_liquido, faturamento_liquido)
-        taxas_pct = _percentual(taxas_liquidas, faturamento_liquido)
-        duracao_dias = max(duracao.total_seconds() / 86400, 1)
-
-        produtos = conn.execute(
+
+    # Nome e categoria vêm do primeiro intervalo em que o produto aparece,
+    # como no primeiro evento lido por `_vendas_eventos`.
+    for row in conn.execute(
+        f"""
+        SELECT produto_id, MIN(bucket_inicio) AS primeiro_bucket,
+               nome_produto, categoria_nome,
+               SUM(quantidade) AS quantidade,
+               SUM(receita_centavos) AS receita,
+               SUM(custo_centavos) AS custo
+        FROM vendas_resumo_produto
+        WHERE {condicao}
+        GROUP BY produto_id
+        ORDER BY primeiro_bucket, produto_id
+        """,
+        params,
+    ):
+        vendas["itens"][row["produto_id"]] = {
+            "produto_id": row["produto_id"],
+            "nome": row["nome_produto"],
+            "categoria": row["categoria_nome"],
+            "quantidade": row["quantidade"],
+            "receita_centavos": row["receita"],
+            "custo_centavos": row["custo"],
+        }
+    return vendas
+
+
+# Seções do fechamento e as chaves da resposta que cada uma preenche.
+SECOES_FECHAMENTO = {
+    "kpis": (
+        "kpis",
+        "composicaoResultado",
+        "vendasPorPeriodo",
+        "vendasPorPagamento",
+        "desempenhoPorHora",
+        "contextoAmostra",
+    ),
+    "itens": ("itens", "categorias"),
+    "analiseProdutos": ("analiseProdutos",),
+    "estoque": ("estoque",),
+    "resumoExecutivo": ("resumoExecutivo",),
+    "historico": ("historico",),
+}
+
+
+def normalizar_secoes(secoes):
+    """Valida os nomes pedidos; `None` ou vazio significa todas as seções."""
+    if isinstance(secoes, str):
+        secoes = secoes.split(",")
+    nomes = frozenset(
+        str(secao).strip() for secao in secoes or () if str(secao).strip()
+    )
+    desconhecidas = sorted(nomes - set(SECOES_FECHAMENTO))
+    if desconhecidas:
+        raise ValueError(f"Seção desconhecida: {', '.join(desconhecidas)}.")
+    return nomes or frozenset(SECOES_FECHAMENTO)
+
+
+def _catalogo_produtos(conn):
+    return {
+        int(row["id"]): {"nome": row["nome"], "categoria": row["categoria"]}
+        for row in conn.execute(
             """
-            SELECT p.id, p.nome, p.ativo,
-                   COALESCE(c.nome, 'Sem categoria') AS categoria
+            SELECT p.id, p.nome, COALESCE(c.nome, 'Sem categoria') AS categoria
             FROM produtos p
             LEFT JOIN categorias c ON c.id = p.categoria_id
-            ORDER BY p.nome
             """
-        ).fetchall()
+        )
+    }
+
+
+@_em_cache
+def _calcular_fechamento(inicio, fim, local_id="todos", secoes=None):
+    with _conexao() as conn:
+        return _montar_fechamento(conn, inicio, fim, local_id, secoes)
+
+
+def _montar_fechamento(
+    conn,
+    inicio,
+    fim,
+    local_id="todos",
+    secoes=None,
+    resumos_visitas=None,
+    catalogo=None,
+):
+    """
+    Consolida o período calculando apenas o necessário para `secoes` (veja
+    `SECOES_FECHAMENTO`). Sem o histórico pedido a pedido, um intervalo
+    alinhado aos resumos de 15 minutos é lido de `vendas_resumo_*` em vez dos
+    eventos. `resumos_visitas` e `catalogo` podem vir prontos de quem consolida
+    vários períodos de uma vez; assim `conn` só precisa ler.
+    """
+    secoes = normalizar_secoes(secoes)
+    precisa_frequencia = bool(secoes & {"analiseProdutos", "resumoExecutivo"})
+    precisa_estoque = bool(secoes & {"estoque", "resumoExecutivo"})
+    historico = [] if "historico" in secoes else None
+    visitas_por_local = defaultdict(set)
+    nomes_locais = {}
+    visitas_periodo = _visitas_periodo(conn, inicio, fim, local_id)
+    if not precisa_frequencia:
+        resumos_visitas = {}
+    elif resumos_visitas is None:
+        resumos_visitas = _resumos_operacoes(conn, visitas_periodo)
+    frequencias_produtos = defaultdict(
+        lambda: {"visitas_disponivel": 0, "visitas_com_venda": 0}
+    )
+    for visita in visitas_periodo:
+        visita_local_id = int(visita["local_id"])
+        visitas_por_local[visita_local_id].add(int(visita["id"]))
+        nomes_locais[visita_local_id] = visita["local_nome"]
+        dados_visita = resumos_visitas.get(int(visita["id"]))
+        if dados_visita is None:
+            continue
+        for produto_id, produto in dados_visita["produtos"].items():
+            frequencia = frequencias_produtos[int(produto_id)]
+            frequencia["visitas_disponivel"] += 1
+            if int(produto["vendidas"]) > 0:
+                frequencia["visitas_com_venda"] += 1
+
+    inicio_local = datetime.fromisoformat(inicio).astimezone(TZ_LOCAL)
+    duracao = datetime.fromisoformat(fim) - datetime.fromisoformat(inicio)
+    grade = _grade_serie(inicio, fim)
+    limites_resumo = (
+        None if historico is not None else _limites_resumo(inicio, fim)
+    )
+    if limites_resumo:
+        vendas = _vendas_resumidas(conn, *limites_resumo, local_id, grade)
+    elif historico is None and _motor_colunar_ativo(grade):
+        vendas = _vendas_colunar(conn, inicio, fim, local_id, grade)
+    else:
+        vendas = _vendas_eventos(conn, inicio, fim, local_id, grade, historico)
+    faturamento_bruto = vendas["faturamento_bruto"]
+    estornos = vendas["estornos"]
+    taxas_liquidas = vendas["taxas"]
+    cmv_liquido = vendas["cmv"]
+    pedidos_pagos = vendas["pedidos_pagos"]
+    pedidos_estornados = vendas["pedidos_estornados"]
+    itens_pagos = vendas["itens_pagos"]
+    itens_liquidos = vendas["itens_liquidos"]
+    pagamentos_por_metodo = vendas["por_metodo"]
+    itens_agregados = vendas["itens"]
+
+    faturamento_liquido = faturamento_bruto - estornos
+    lucro_bruto = faturamento_liquido - cmv_liquido
+
+    perdas_centavos = int(
+        conn.execute(
+            """
+            SELECT COALESCE(SUM(ABS(quantidade) * custo_unitario_centavos), 0)
+            FROM estoque_movimentacoes
+            WHERE impacta_relatorio = 1
+              AND (
+                tipo = 'perda'
+                OR (tipo = 'ajuste' AND quantidade < 0)
+            )
+              AND created_at >= ? AND created_at < ?
+            """,
+            (inicio, fim),
+        ).fetchone()[0]
+    )
+    resultado_operacional = lucro_bruto - taxas_liquidas - perdas_centavos
+    ticket_medio = (
+        _reais(faturamento_bruto) / pedidos_pagos if pedidos_pagos else 0
+    )
+    media_itens = itens_pagos / pedidos_pagos if pedidos_pagos else 0
+    margem_bruta_pct = _percentual(lucro_bruto, faturamento_liquido)
+    margem_operacional_pct = _percentual(resultado_operacional, faturamento_liquido)
+    taxa_estorno_pct = _percentual(estornos, faturamento_bruto)
+    cmv_pct = _percentual(cmv_liquido, faturamento_liquido)
+    taxas_pct = _percentual(taxas_liquidas, faturamento_liquido)
+    duracao_dias = max(duracao.total_seconds() / 86400, 1)
+
+    produtos = (
+        _movimentacao_estoque_produtos(conn, inicio, fim)
+        if precisa_estoque
+        else []
+    )
+    if precisa_estoque:
         catalogo_produtos = {
             int(produto["id"]): {
                 "nome": produto["nome"],
@@ -402,72 +1029,31 @@ def _calcular_fechamento(inicio, fim, local_id="todos"):
             }
             for produto in produtos
         }
-        estoque = []
-        for produto in produtos:
-            anterior = int(
-                conn.execute(
-                    """
-                    SELECT COALESCE(SUM(quantidade), 0)
-                    FROM (
-                        SELECT l.quantidade_inicial + COALESCE((
-                                   SELECT SUM(neutro.quantidade)
-                                   FROM estoque_movimentacoes neutro
-                                   WHERE neutro.lote_id = l.id
-                                     AND neutro.impacta_relatorio = 0
-                                     AND neutro.created_at < ?
-                               ), 0) AS quantidade
-                        FROM estoque_lotes l
-                        WHERE l.produto_id = ? AND l.recebido_em < ?
-                        UNION ALL
-                        SELECT quantidade
-                        FROM estoque_movimentacoes
-                        WHERE produto_id = ? AND lote_id IS NOT NULL
-                          AND impacta_relatorio = 1 AND created_at < ?
-                    )
-                    """,
-                    (fim, produto["id"], inicio, produto["id"], inicio),
-                ).fetchone()[0]
+    elif precisa_frequencia:
+        catalogo_produtos = (
+            catalogo if catalogo is not None else _catalogo_produtos(conn)
+        )
+    else:
+        catalogo_produtos = {}
+    estoque = []
+    for produto in produtos:
+        anterior = int(produto["inicial"])
+        entradas = int(produto["entradas"])
+        saidas = int(produto["saidas"])
+        final = anterior + entradas - saidas
+        ativo = bool(produto["ativo"])
+        if anterior or entradas or saidas or final:
+            estoque.append(
+                {
+                    "produtoId": produto["id"],
+                    "nome": produto["nome"],
+                    "ativo": ativo,
+                    "inicial": anterior,
+                    "entradas": entradas,
+                    "saidas": saidas,
+                    "final": final,
+                }
             )
-            movimentos = conn.execute(
-                """
-                SELECT quantidade
-                FROM (
-                    SELECT l.quantidade_inicial + COALESCE((
-                               SELECT SUM(neutro.quantidade)
-                               FROM estoque_movimentacoes neutro
-                               WHERE neutro.lote_id = l.id
-                                 AND neutro.impacta_relatorio = 0
-                                 AND neutro.created_at < ?
-                           ), 0) AS quantidade,
-                           l.recebido_em AS ocorrido_em
-                    FROM estoque_lotes l
-                    WHERE l.produto_id = ?
-                    UNION ALL
-                    SELECT quantidade, created_at AS ocorrido_em
-                    FROM estoque_movimentacoes
-                    WHERE produto_id = ? AND lote_id IS NOT NULL
-                      AND impacta_relatorio = 1
-                )
-                WHERE ocorrido_em >= ? AND ocorrido_em < ?
-                """,
-                (fim, produto["id"], produto["id"], inicio, fim),
-            ).fetchall()
-            entradas = sum(max(int(row["quantidade"]), 0) for row in movimentos)
-            saidas = sum(abs(min(int(row["quantidade"]), 0)) for row in movimentos)
-            final = anterior + entradas - saidas
-            ativo = bool(produto["ativo"])
-            if anterior or entradas or saidas or final:
-                estoque.append(
-                    {
-                        "produtoId": produto["id"],
-                        "nome": produto["nome"],
-                        "ativo": ativo,
-                        "inicial": anterior,
-                        "entradas": entradas,
-                        "saidas": saidas,
-                        "final": final,
-                    }
-                )
 
     itens_formatados = [
         {
@@ -494,7 +1080,7 @@ def _calcular_fechamento(inicio, fim, local_id="todos"):
         for dados in itens_agregados.values()
         if dados["quantidade"] or dados["receita_centavos"]
     ]
-    itens_formatados.sort(key=lambda item: item["quantidade"], reverse=True)
+    itens_formatados.sort(key=lambda item: (-item["quantidade"], item["nome"]))
     analise_produtos_por_id = {
         int(item["produtoId"]): dict(item)
         for item in itens_formatados
@@ -627,25 +1213,19 @@ def _calcular_fechamento(inicio, fim, local_id="todos"):
         )
     estoque.sort(key=lambda item: (ordem_status[item["status"]], item["final"], item["nome"]))
 
-    desempenho_hora = []
-    for posicao_hora in range(24):
-        receita = 0
-        pedidos_hora = 0
-        estornos_hora = 0
-        for indice_hora in range(posicao_hora * 4, total_buckets, 24 * 4):
-            receita += sum(vendas_periodo[indice_hora : indice_hora + 4])
-            pedidos_hora += sum(pedidos_periodo[indice_hora : indice_hora + 4])
-            estornos_hora += sum(estornos_periodo[indice_hora : indice_hora + 4])
-        desempenho_hora.append(
-            {
-                "label": labels[posicao_hora * 4]
-                if posicao_hora * 4 < len(labels)
-                else f"{posicao_hora:02d}:00",
-                "faturamento": _reais(receita),
-                "pedidos": pedidos_hora,
-                "estornos": estornos_hora,
-            }
-        )
+    # A hora é contada a partir do início do período, que no dia operacional
+    # começa às 05:00.
+    desempenho_hora = [
+        {
+            "label": (inicio_local + timedelta(hours=posicao_hora)).strftime("%H:%M")
+            if posicao_hora * 3600 < grade["alcance"]
+            else f"{posicao_hora:02d}:00",
+            "faturamento": _reais(vendas["faturamento_hora"][posicao_hora]),
+            "pedidos": vendas["pedidos_hora"][posicao_hora],
+            "estornos": vendas["estornos_hora"][posicao_hora],
+        }
+        for posicao_hora in range(24)
+    ]
 
     receita_positiva = sum(max(item["receita"], 0) for item in itens_formatados)
     concentracao_top3 = _percentual(
@@ -655,7 +1235,7 @@ def _calcular_fechamento(inicio, fim, local_id="todos"):
         receita_positiva,
     )
 
-    metodos = ["pix", "cartao_credito", "cartao_debito", "dinheiro"]
+    metodos = list(METODOS_PAGAMENTO)
     kpis = {
         "faturamentoBruto": _reais(faturamento_bruto),
         "estornos": _reais(estornos),
@@ -684,25 +1264,14 @@ def _calcular_fechamento(inicio, fim, local_id="todos"):
     insights = _montar_insights(
         kpis, analise_produtos, estoque, desempenho_hora, concentracao_top3
     )
-    if total_buckets <= 24 * 4:
-        serie_labels = labels
-        serie_valores = vendas_periodo
-        granularidade = "15_minutos"
-        granularidade_label = "Intervalos de 15 minutos"
-    else:
-        quantidade_dias = (total_buckets + (24 * 4) - 1) // (24 * 4)
-        serie_labels = [
-            (inicio_local + timedelta(days=indice)).strftime("%d/%m")
-            for indice in range(quantidade_dias)
-        ]
-        serie_valores = [
-            sum(vendas_periodo[indice * 24 * 4 : (indice + 1) * 24 * 4])
-            for indice in range(quantidade_dias)
-        ]
-        granularidade = "dia_operacional"
-        granularidade_label = "Consolidado por dia operacional"
+    serie_labels = [
+        (inicio_local + timedelta(seconds=grade["largura"] * indice)).strftime(
+            grade["formato"]
+        )
+        for indice in range(grade["pontos"])
+    ]
 
-    return {
+    resultado = {
         "kpis": kpis,
         "itens": itens_formatados,
         "analiseProdutos": analise_produtos,
@@ -728,9 +1297,9 @@ def _calcular_fechamento(inicio, fim, local_id="todos"):
         "estoque": estoque,
         "vendasPorPeriodo": {
             "labels": serie_labels,
-            "data": [_reais(valor) for valor in serie_valores],
-            "granularidade": granularidade,
-            "granularidadeLabel": granularidade_label,
+            "data": [_reais(valor) for valor in vendas["vendas_periodo"]],
+            "granularidade": grade["chave"],
+            "granularidadeLabel": grade["rotulo"],
         },
         "vendasPorPagamento": {
             "labels": metodos,
@@ -752,23 +1321,166 @@ def _calcular_fechamento(inicio, fim, local_id="todos"):
             "tipoValores": "totais",
         },
     }
+    chaves = {"periodo", "estoqueGlobal"}
+    for secao in secoes:
+        chaves.update(SECOES_FECHAMENTO[secao])
+    return {chave: valor for chave, valor in resultado.items() if chave in chaves}
+
+
+def _indices_lttb(valores, pontos):
+    """
+    Escolhe os índices mantidos ao reduzir a série a `pontos` pelo
+    Largest-Triangle-Three-Buckets. O primeiro e o último ponto ficam; em cada
+    faixa intermediária fica o ponto que forma o maior triângulo com o escolhido
+    antes e a média da faixa seguinte, o que preserva picos e vales.
+    """
+    total = len(valores)
+    pontos = max(int(pontos), 3)
+    if total <= pontos:
+        return list(range(total))
+    passo = (total - 2) / (pontos - 2)
+    indices = [0]
+    anterior = 0
+    for faixa in range(pontos - 2):
+        inicio_faixa = int(faixa * passo) + 1
+        fim_faixa = int((faixa + 1) * passo) + 1
+        inicio_media = fim_faixa
+        fim_media = min(int((faixa + 2) * passo) + 1, total)
+        media_x = (inicio_media + fim_media - 1) / 2
+        media_y = sum(valores[inicio_media:fim_media]) / (fim_media - inicio_media)
+        escolhido = max(
+            range(inicio_faixa, fim_faixa),
+            key=lambda indice: abs(
+                (anterior - media_x) * (valores[indice] - valores[anterior])
+                - (anterior - indice) * (media_y - valores[anterior])
+            ),
+        )
+        indices.append(escolhido)
+        anterior = escolhido
+    indices.append(total - 1)
+    return indices
 
 
-def fechamento_operacional_v2(inicio, fim, local_id, page, limit):
-    dados = _calcular_fechamento(inicio, fim, local_id)
-    page = max(int(page or 1), 1)
+def fechamento_operacional_v2(
+    inicio, fim, local_id, page, limit, secoes=None, pontos=None
+):
+    """
+    Fechamento da tela. Com `pontos`, a série de vendas por período é reduzida
+    por LTTB a no máximo esse número de pontos, depois do cache.
+    """
+    secoes = normalizar_secoes(secoes)
+    dados = dict(_calcular_fechamento(inicio, fim, local_id, secoes))
+    serie = dados.get("vendasPorPeriodo")
+    if pontos and serie and len(serie["data"]) > max(int(pontos), 3):
+        indices = _indices_lttb(serie["data"], pontos)
+        dados["vendasPorPeriodo"] = {
+            **serie,
+            "labels": [serie["labels"][indice] for indice in indices],
+            "data": [serie["data"][indice] for indice in indices],
+            "pontosOriginais": len(serie["data"]),
+        }
+    if "itens" in dados:
+        dados["itens_top"] = dados.pop("itens")[:10]
+    if "historico" in dados:
+        page = max(int(page or 1), 1)
+        limit = min(max(int(limit or 50), 1), 100)
+        inicio_slice = (page - 1) * limit
+        historico = dados.pop("historico")
+        dados["historico_pedidos"] = {
+            "items": historico[inicio_slice : inicio_slice + limit],
+            "page": page,
+            "limit": limit,
+            "total": len(historico),
+        }
+    dados["secoes"] = sorted(secoes)
+    return dados
+
+
+def _codificar_cursor(ocorrido_em, pagamento_id):
+    bruto = f"{ocorrido_em}|{pagamento_id}".encode()
+    return base64.urlsafe_b64encode(bruto).decode().rstrip("=")
+
+
+def _decodificar_cursor(cursor):
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ocorrido_em, pagamento_id = bruto.decode().rsplit("|", 1)
+        datetime.fromisoformat(ocorrido_em)
+        return ocorrido_em, int(pagamento_id)
+    except ValueError:
+        raise ValueError("Cursor de histórico inválido.") from None
+
+
+def historico_eventos(
+    inicio, fim, local_id="todos", metodo=None, tipo=None, cursor=None, limit=50
+):
+    """
+    Uma página de pagamentos e estornos em ordem de ocorrência. A página seguinte
+    começa depois de (`ocorrido_em`, `id`) do último evento, informado em
+    `cursor`, então o custo por página não cresce com o período. Os itens são
+    lidos só para os pedidos da página.
+    """
+    if metodo and metodo not in METODOS_PAGAMENTO:
+        raise ValueError(f"Método de pagamento inválido: {metodo}.")
+    if tipo and tipo not in TIPOS_EVENTO_PAGAMENTO:
+        raise ValueError(f"Tipo de evento inválido: {tipo}.")
     limit = min(max(int(limit or 50), 1), 100)
-    inicio_slice = (page - 1) * limit
-    historico = dados.pop("historico")
-    itens = dados.pop("itens")
-    dados["itens_top"] = itens[:10]
-    dados["historico_pedidos"] = {
-        "items": historico[inicio_slice : inicio_slice + limit],
-        "page": page,
+    condicao, params = _filtro_eventos_pagamento(inicio, fim, local_id)
+    if metodo:
+        condicao += " AND pg.metodo = ?"
+        params.append(metodo)
+    if tipo:
+        condicao += " AND pg.tipo = ?"
+        params.append(tipo)
+    if cursor:
+        condicao += " AND (pg.ocorrido_em, pg.id) > (?, ?)"
+        params.extend(_decodificar_cursor(cursor))
+
+    with _conexao() as conn:
+        eventos = conn.execute(
+            f"""
+            SELECT pg.id, pg.pedido_id, pg.tipo, pg.metodo, pg.valor_centavos,
+                   pg.ocorrido_em, o.nome_cliente, o.senha_diaria, o.local_id
+            FROM pagamentos pg
+            JOIN pedidos o ON o.id = pg.pedido_id
+            WHERE {condicao}
+            ORDER BY pg.ocorrido_em, pg.id
+            LIMIT ?
+            """,
+            (*params, limit + 1),
+        ).fetchall()
+        pagina = eventos[:limit]
+        pedido_ids = sorted({int(evento["pedido_id"]) for evento in pagina})
+        itens_por_pedido = _itens_dos_pedidos(conn, pedido_ids)
+
+    items = []
+    for evento in pagina:
+        sinal = 1 if evento["tipo"] == "pagamento" else -1
+        items.append(
+            {
+                "pagamento_id": evento["id"],
+                "id": evento["pedido_id"],
+                "nome_cliente": evento["nome_cliente"],
+                "horario": evento["ocorrido_em"],
+                "valor_total": sinal * _reais(evento["valor_centavos"]),
+                "metodo_pagamento": evento["metodo"],
+                "tipo": evento["tipo"],
+                "senha_diaria": evento["senha_diaria"],
+                "local_id": evento["local_id"],
+                "itens": [
+                    _item_api(item)
+                    for item in itens_por_pedido.get(int(evento["pedido_id"]), [])
+                ],
+            }
+        )
+    ultimo = pagina[-1] if pagina else None
+    return {
+        "items": items,
         "limit": limit,
-        "total": len(historico),
+        "proximo": _codificar_cursor(ultimo["ocorrido_em"], ultimo["id"])
+        if len(eventos) > limit
+        else None,
     }
-    return dados
 
 
 def _delta(valor_a, valor_b):
@@ -784,12 +1496,67 @@ def _delta(valor_a, valor_b):
     }
 
 
+@contextmanager
+def _conexao_leitura():
+    """Conexão analítica própria, fora do pool, para uma thread de cálculo."""
+    conn = database.conectar(pragmas=database.PRAGMAS_ANALITICOS)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _em_paralelo(*tarefas):
+    """
+    Executa as funções em threads do sistema e devolve os resultados na ordem.
+    O sqlite3 libera o GIL durante as consultas. Com o eventlet ativo, as
+    threads vêm do `tpool` para não bloquear o hub.
+    """
+    patcher = sys.modules.get("eventlet.patcher")
+    if patcher is not None and patcher.is_monkey_patched("thread"):
+        from eventlet import spawn, tpool
+
+        threads = [spawn(tpool.execute, tarefa) for tarefa in tarefas]
+        return [thread.wait() for thread in threads]
+    with ThreadPoolExecutor(max_workers=len(tarefas)) as executor:
+        futuros = [executor.submit(tarefa) for tarefa in tarefas]
+        return [futuro.result() for futuro in futuros]
+
+
+def _fechamentos_comparados(periodos, local_id, secoes):
+    """
+    Consolida vários períodos ao mesmo tempo, um por conexão de leitura. Os
+    resumos das visitas e o catálogo são carregados uma vez, antes, e
+    compartilhados entre os períodos.
+    """
+    with _conexao() as conn:
+        visitas = {}
+        for inicio, fim in periodos:
+            for visita in _visitas_periodo(conn, inicio, fim, local_id):
+                visitas[int(visita["id"])] = visita
+        resumos_visitas = _resumos_operacoes(conn, list(visitas.values()))
+        catalogo = _catalogo_produtos(conn)
+
+    def calcular(inicio, fim):
+        with _conexao_leitura() as leitura:
+            return _montar_fechamento(
+                leitura, inicio, fim, local_id, secoes, resumos_visitas, catalogo
+            )
+
+    return _em_paralelo(*(partial(calcular, inicio, fim) for inicio, fim in periodos))
+
+
+@_em_cache
 def insights_comparativos_v2(
     periodoA_inicio, periodoA_fim, periodoB_inicio, periodoB_fim, filtros
 ):
     local_id = filtros.get("local_id", "todos")
-    dados_a = _calcular_fechamento(periodoA_inicio, periodoA_fim, local_id)
-    dados_b = _calcular_fechamento(periodoB_inicio, periodoB_fim, local_id)
+    dados_a, dados_b = _fechamentos_comparados(
+        ((periodoA_inicio, periodoA_fim), (periodoB_inicio, periodoB_fim)),
+        local_id,
+        ("kpis", "analiseProdutos"),
+    )
     a = dados_a["kpis"]
     b = dados_b["kpis"]
     kpis = {
@@ -864,16 +1631,69 @@ def insights_comparativos_v2(
     }
 
 
+def _heatmap_resumos(conn, inicio, fim, local_id):
+    """
+    Agrupa os resumos de 15 minutos por dia da semana e hora locais no SQLite.
+    Os fusos de São Paulo têm deslocamento em horas cheias, então cada intervalo
+    cai inteiro em uma única hora local; o deslocamento de cada intervalo vem
+    de `fuso_local`, com o horário de verão histórico.
+    """
+    condicao, params = _filtro_resumo(inicio, fim, local_id)
+    epoch_local = database.sql_epoch_local(database.sql_epoch("bucket_inicio"))
+    return conn.execute(
+        f"""
+        SELECT {database.sql_tempo_local("dia_semana_local", "local_epoch")}
+                   AS dia_semana,
+               {database.sql_tempo_local("hora_local", "local_epoch")} AS hora,
+               SUM(qtd) AS qtd, SUM(faturamento) AS faturamento
+        FROM (
+            SELECT {epoch_local} AS local_epoch,
+                   SUM(pagamentos - estornos) AS qtd,
+                   SUM(valor_pago_centavos - valor_estornado_centavos)
+                       AS faturamento
+            FROM vendas_resumo_periodo
+            WHERE {condicao}
+            GROUP BY bucket_inicio
+        )
+        GROUP BY dia_semana, hora
+        """,
+        params,
+    ).fetchall()
+
+
+def _heatmap_eventos(conn, inicio, fim, local_id):
+    """Agrupa os eventos pelas colunas locais gravadas em `pagamentos`."""
+    condicao, params = _filtro_eventos_pagamento(inicio, fim, local_id)
+    return conn.execute(
+        f"""
+        SELECT pg.dia_semana_local AS dia_semana, pg.hora_local AS hora,
+               SUM(CASE pg.tipo WHEN 'pagamento' THEN 1 ELSE -1 END) AS qtd,
+               SUM(
+                   CASE pg.tipo WHEN 'pagamento' THEN 1 ELSE -1 END
+                   * pg.valor_centavos
+               ) AS faturamento
+        FROM pagamentos pg
+        JOIN pedidos o ON o.id = pg.pedido_id
+        WHERE {condicao}
+        GROUP BY pg.dia_semana_local, pg.hora_local
+        """,
+        params,
+    ).fetchall()
+
+
+@_em_cache
 def insights_heatmap(inicio, fim, filtros):
+    """Grade dia da semana × hora local, agregada inteiramente no SQLite."""
     local_id = filtros.get("local_id", "todos")
-    buckets = defaultdict(lambda: {"qtd": 0, "faturamento": 0})
+    limites_resumo = _limites_resumo(inicio, fim)
     with _conexao() as conn:
-        for evento in _eventos_pagamento(conn, inicio, fim, local_id):
-            sinal = 1 if evento["tipo"] == "pagamento" else -1
-            local = datetime.fromisoformat(evento["ocorrido_em"]).astimezone(TZ_LOCAL)
-            bucket = buckets[(local.weekday(), local.hour)]
-            bucket["qtd"] += sinal
-            bucket["faturamento"] += sinal * evento["valor_centavos"]
+        if limites_resumo:
+            linhas = _heatmap_resumos(conn, *limites_resumo, local_id)
+        else:
+            linhas = _heatmap_eventos(conn, inicio, fim, local_id)
+    buckets = {
+        (int(row["dia_semana"]), int(row["hora"])): row for row in linhas
+    }
     return {
         "inicio": inicio,
         "fim": fim,
@@ -889,6 +1709,11 @@ def insights_heatmap(inicio, fim, filtros):
     }
 
 
+# Visitas por local no modo "últimas". Os resumos de todas as visitas são
+# lidos por conjunto, então o teto só protege a resposta de crescer demais.
+LIMITE_VISITAS_LOCAL = 500
+
+
 def _selecionar_operacoes_local(
     conn,
     local_id,
@@ -912,36 +1737,94 @@ def _selecionar_operacoes_local(
     return list(reversed(conn.execute(query, params).fetchall()))
 
 
-def _saldo_atual_produto(conn, produto_id):
-    return int(
-        conn.execute(
+def _saldos_atuais(conn):
+    return {
+        int(row["produto_id"]): int(row["saldo"])
+        for row in conn.execute(
+            f"""
+            SELECT produto_id, SUM(quantidade_disponivel) AS saldo
+            FROM estoque_lotes_saldo
+            WHERE {database.SALDO_LOTE_NAO_ZERO}
+            GROUP BY produto_id
             """
-            SELECT COALESCE(SUM(
-                l.quantidade_inicial + COALESCE((
-                    SELECT SUM(m.quantidade)
-                    FROM estoque_movimentacoes m
-                    WHERE m.lote_id = l.id
-                ), 0)
-            ), 0)
-            FROM estoque_lotes l
-            WHERE l.produto_id = ?
-            """,
-            (produto_id,),
-        ).fetchone()[0]
-    )
+        )
+    }
 
 
-def _analisar_operacao_local(conn, operacao):
-    eventos = conn.execute(
-        """
-        SELECT pg.*, p.id AS pedido_id
+def _dados_operacoes(conn, operacoes):
+    """
+    Lê, para todas as visitas de uma vez, o que o resumo de cada uma precisa:
+    eventos, fotografias de estoque, produtos com lote recebido e o último
+    movimento de cada produto durante a visita. São poucas consultas por
+    conjunto, indexadas por `operacao_id`, qualquer que seja o número de
+    visitas.
+    """
+    ids = [int(operacao["id"]) for operacao in operacoes]
+    dados = {
+        operacao_id: {
+            "eventos": [],
+            "snapshots": {},
+            "entradas": set(),
+            "ultimo_movimento": {},
+        }
+        for operacao_id in ids
+    }
+    if not ids:
+        return dados
+    placeholders = ",".join("?" for _ in ids)
+    agora = datetime.now(timezone.utc).isoformat()
+
+    for row in conn.execute(
+        f"""
+        SELECT pg.*, p.id AS pedido_id, p.operacao_id AS visita_id
         FROM pagamentos pg
         JOIN pedidos p ON p.id = pg.pedido_id
-        WHERE p.operacao_id = ?
+        WHERE p.operacao_id IN ({placeholders})
         ORDER BY pg.ocorrido_em, pg.id
         """,
-        (operacao["id"],),
-    ).fetchall()
+        ids,
+    ):
+        dados[int(row["visita_id"])]["eventos"].append(row)
+    for row in conn.execute(
+        f"SELECT * FROM operacao_estoque WHERE operacao_id IN ({placeholders})",
+        ids,
+    ):
+        dados[int(row["operacao_id"])]["snapshots"][int(row["produto_id"])] = row
+
+    # Lotes e movimentos entram pela janela de cada visita; uma visita aberta
+    # vai até agora.
+    for row in conn.execute(
+        f"""
+        SELECT DISTINCT o.id AS operacao_id, l.produto_id
+        FROM operacoes o
+        JOIN estoque_lotes l
+            ON l.recebido_em >= o.iniciada_em
+           AND l.recebido_em <= COALESCE(o.encerrada_em, ?)
+        WHERE o.id IN ({placeholders}) AND o.origem = 'real'
+        """,
+        [agora, *ids],
+    ):
+        dados[int(row["operacao_id"])]["entradas"].add(int(row["produto_id"]))
+    for row in conn.execute(
+        f"""
+        SELECT o.id AS operacao_id, m.produto_id, m.tipo
+        FROM operacoes o
+        JOIN estoque_movimentacoes m
+            ON m.created_at >= o.iniciada_em
+           AND m.created_at <= COALESCE(o.encerrada_em, ?)
+        WHERE o.id IN ({placeholders})
+        ORDER BY o.id, m.created_at, m.id
+        """,
+        [agora, *ids],
+    ):
+        dados[int(row["operacao_id"])]["ultimo_movimento"][
+            int(row["produto_id"])
+        ] = row["tipo"]
+    return dados
+
+
+def _resumir_operacao(operacao, dados, itens_por_pedido, saldos, produtos_ativos):
+    """Resume uma visita em memória a partir de `_dados_operacoes`."""
     receita = 0
     taxas = 0
     custo = 0
@@ -950,14 +1833,11 @@ def _analisar_operacao_local(conn, operacao):
     itens_liquidos = defaultdict(int)
     itens_brutos = defaultdict(int)
     horas = defaultdict(lambda: {"faturamento": 0, "pedidos": 0, "unidades": 0})
-    cache_itens = {}
 
-    for evento in eventos:
+    for evento in dados["eventos"]:
         sinal = 1 if evento["tipo"] == "pagamento" else -1
         pedido_id = int(evento["pedido_id"])
-        if pedido_id not in cache_itens:
-            cache_itens[pedido_id] = _itens_pedido(conn, pedido_id)
-        itens = cache_itens[pedido_id]
+        itens = itens_por_pedido.get(pedido_id, [])
         receita += sinal * int(evento["valor_centavos"])
         taxas += sinal * int(evento["taxa_centavos"])
         custo += sinal * sum(int(item["custo_total_centavos"]) for item in itens)
@@ -972,61 +1852,25 @@ def _analisar_operacao_local(conn, operacao):
                 itens_brutos[produto_id] += quantidade
 
         if sinal > 0:
-            hora = datetime.fromisoformat(evento["ocorrido_em"]).astimezone(
-                TZ_LOCAL
-            ).hour
+            hora = int(evento["hora_local"])
             horas[hora]["faturamento"] += int(evento["valor_centavos"])
             horas[hora]["pedidos"] += 1
             horas[hora]["unidades"] += sum(
                 int(item["quantidade"]) for item in itens
             )
 
-    snapshots = {
-        int(row["produto_id"]): row
-        for row in conn.execute(
-            """
-            SELECT * FROM operacao_estoque
-            WHERE operacao_id = ?
-            """,
-            (operacao["id"],),
-        )
-    }
+    snapshots = dict(dados["snapshots"])
     if not snapshots and operacao["status"] == "aberta":
-        for produto in conn.execute("SELECT id, ativo FROM produtos"):
-            produto_id = int(produto["id"])
-            saldo = max(_saldo_atual_produto(conn, produto_id), 0)
+        for produto_id, ativo in produtos_ativos.items():
+            saldo = max(saldos.get(produto_id, 0), 0)
             snapshots[produto_id] = {
                 "produto_id": produto_id,
                 "quantidade_inicial": saldo,
                 "quantidade_final": saldo,
-                "ativo_no_inicio": int(bool(produto["ativo"])),
+                "ativo_no_inicio": int(bool(ativo)),
             }
-    fim_operacao = operacao["encerrada_em"] or datetime.now(timezone.utc).isoformat()
-    entradas_durante = set()
-    if operacao["origem"] == "real":
-        entradas_durante = {
-            int(row["produto_id"])
-            for row in conn.execute(
-                """
-                SELECT DISTINCT produto_id
-                FROM estoque_lotes
-                WHERE recebido_em >= ? AND recebido_em <= ?
-                """,
-                (operacao["iniciada_em"], fim_operacao),
-            )
-        }
-    ultimo_movimento = {}
-    for movimento in conn.execute(
-        """
-        SELECT produto_id, tipo
-        FROM estoque_movimentacoes
-        WHERE created_at >= ? AND created_at <= ?
-        ORDER BY created_at, id
-        """,
-        (operacao["iniciada_em"], fim_operacao),
-    ):
-        ultimo_movimento[int(movimento["produto_id"])] = movimento["tipo"]
-    disponiveis = set(itens_brutos) | entradas_durante
+    ultimo_movimento = dados["ultimo_movimento"]
+    disponiveis = set(itens_brutos) | dados["entradas"]
     for produto_id, snapshot in snapshots.items():
         final = snapshot["quantidade_final"]
         if bool(snapshot["ativo_no_inicio"]) and (
@@ -1040,7 +1884,7 @@ def _analisar_operacao_local(conn, operacao):
         snapshot = snapshots.get(produto_id)
         final = snapshot["quantidade_final"] if snapshot else None
         if final is None and operacao["status"] == "aberta":
-            final = max(_saldo_atual_produto(conn, produto_id), 0)
+            final = max(saldos.get(produto_id, 0), 0)
         produtos[produto_id] = {
             "vendidas": int(itens_liquidos.get(produto_id, 0)),
             "levadas": (
@@ -1070,6 +1914,205 @@ def _analisar_operacao_local(conn, operacao):
     }
 
 
+def _analisar_operacoes_locais(conn, operacoes):
+    """
+    Resume várias visitas com um número fixo de consultas: os dados de todas
+    são lidos por conjunto e cada resumo é montado em memória.
+    """
+    if not operacoes:
+        return {}
+    ids = [int(operacao["id"]) for operacao in operacoes]
+    dados = _dados_operacoes(conn, operacoes)
+    itens_por_pedido = (
+        _itens_pedidos_operacoes(conn, ids)
+        if any(dados[operacao_id]["eventos"] for operacao_id in ids)
+        else {}
+    )
+    saldos = {}
+    produtos_ativos = {}
+    if any(operacao["status"] == "aberta" for operacao in operacoes):
+        saldos = _saldos_atuais(conn)
+        produtos_ativos = {
+            int(row["id"]): row["ativo"]
+            for row in conn.execute("SELECT id, ativo FROM produtos")
+        }
+    return {
+        int(operacao["id"]): _resumir_operacao(
+            operacao,
+            dados[int(operacao["id"])],
+            itens_por_pedido,
+            saldos,
+            produtos_ativos,
+        )
+        for operacao in operacoes
+    }
+
+
+def _analisar_operacao_local(conn, operacao):
+    """Resume uma única visita."""
+    return _analisar_operacoes_locais(conn, [operacao])[int(operacao["id"])]
+
+
+def _carregar_resumos_operacoes(conn, operacao_ids):
+    placeholders = ",".join("?" for _ in operacao_ids)
+    params = list(operacao_ids)
+    resumos = {}
+    for row in conn.execute(
+        f"SELECT * FROM operacao_resumo WHERE operacao_id IN ({placeholders})",
+        params,
+    ):
+        resumos[int(row["operacao_id"])] = {
+            "receita_centavos": row["receita_centavos"],
+            "taxas_centavos": row["taxas_centavos"],
+            "custo_centavos": row["custo_centavos"],
+            "resultado_centavos": (
+                row["receita_centavos"] - row["custo_centavos"] - row["taxas_centavos"]
+            ),
+            "pedidos": row["pedidos"],
+            "estornos_centavos": row["estornos_centavos"],
+            "unidades": row["unidades"],
+            "horas": {},
+            "produtos": {},
+        }
+    if not resumos:
+        return resumos
+    for row in conn.execute(
+        f"""
+        SELECT * FROM operacao_resumo_horas
+        WHERE operacao_id IN ({placeholders})
+        ORDER BY operacao_id, hora
+        """,
+        params,
+    ):
+        resumo = resumos.get(int(row["operacao_id"]))
+        if resumo is not None:
+            resumo["horas"][int(row["hora"])] = {
+                "faturamento": row["faturamento_centavos"],
+                "pedidos": row["pedidos"],
+                "unidades": row["unidades"],
+            }
+    for row in conn.execute(
+        f"""
+        SELECT * FROM operacao_resumo_produtos
+        WHERE operacao_id IN ({placeholders})
+        ORDER BY operacao_id, produto_id
+        """,
+        params,
+    ):
+        resumo = resumos.get(int(row["operacao_id"]))
+        if resumo is not None:
+            resumo["produtos"][int(row["produto_id"])] = {
+                "vendidas": row["vendidas"],
+                "levadas": row["levadas"],
+                "restantes": row["restantes"],
+                "esgotou": bool(row["esgotou"]) if row["esgotou"] is not None else None,
+            }
+    return resumos
+
+
+def _gravar_resumo_operacao(conn, operacao_id, dados):
+    conn.execute("DELETE FROM operacao_resumo WHERE operacao_id = ?", (operacao_id,))
+    conn.execute(
+        """
+        INSERT INTO operacao_resumo(
+            operacao_id, receita_centavos, taxas_centavos, custo_centavos,
+            pedidos, estornos_centavos, unidades, calculado_em
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            operacao_id,
+            dados["receita_centavos"],
+            dados["taxas_centavos"],
+            dados["custo_centavos"],
+            dados["pedidos"],
+            dados["estornos_centavos"],
+            dados["unidades"],
+            datetime.now(timezone.utc).isoformat(),
+        ),
+    )
+    conn.executemany(
+        """
+        INSERT INTO operacao_resumo_horas(
+            operacao_id, hora, faturamento_centavos, pedidos, unidades
+        ) VALUES (?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                operacao_id,
+                hora,
+                valores["faturamento"],
+                valores["pedidos"],
+                valores["unidades"],
+            )
+            for hora, valores in dados["horas"].items()
+        ],
+    )
+    conn.executemany(
+        """
+        INSERT INTO operacao_resumo_produtos(
+            operacao_id, produto_id, vendidas, levadas, restantes, esgotou
+        ) VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                operacao_id,
+                produto_id,
+                produto["vendidas"],
+                produto["levadas"],
+                produto["restantes"],
+                int(produto["esgotou"]) if produto["esgotou"] is not None else None,
+            )
+            for produto_id, produto in dados["produtos"].items()
+        ],
+    )
+
+
+def gravar_resumos_visitas(conn, operacao_ids):
+    """
+    Calcula e grava o resumo das visitas encerradas de `operacao_ids` dentro
+    da transação de escrita de `conn`. `gerenciador_db` chama ao encerrar uma
+    visita e ao registrar pagamento ou estorno tardio de um pedido dela; a
+    migração para o schema v9 chama para todo o histórico, em lotes.
+    """
+    ids = [int(operacao_id) for operacao_id in operacao_ids]
+    for inicio in range(0, len(ids), LIMITE_VISITAS_LOCAL):
+        lote = ids[inicio:inicio + LIMITE_VISITAS_LOCAL]
+        placeholders = ",".join("?" for _ in lote)
+        operacoes = conn.execute(
+            f"""
+            SELECT * FROM operacoes
+            WHERE id IN ({placeholders}) AND status = 'encerrada'
+            """,
+            lote,
+        ).fetchall()
+        if not operacoes:
+            continue
+        resumos = _analisar_operacoes_locais(conn, operacoes)
+        for operacao_id, resumo in resumos.items():
+            _gravar_resumo_operacao(conn, operacao_id, resumo)
+
+
+def _resumos_operacoes(conn, operacoes):
+    """
+    Resume várias visitas pelo id. Uma visita encerrada é lida de
+    `operacao_resumo`, gravado no encerramento. Visitas abertas, e encerradas
+    antes desse resumo existir, são calculadas só para esta leitura.
+    """
+    encerradas = [
+        int(operacao["id"])
+        for operacao in operacoes
+        if operacao["status"] == "encerrada"
+    ]
+    resumos = _carregar_resumos_operacoes(conn, encerradas) if encerradas else {}
+    pendentes = [
+        operacao for operacao in operacoes if int(operacao["id"]) not in resumos
+    ]
+    if pendentes:
+        resumos.update(_analisar_operacoes_locais(conn, pendentes))
+    return resumos
+
+
+@_em_cache
 def desempenho_locais(
     local_ids,
     modo="historico",
@@ -1087,7 +2130,7 @@ def desempenho_locais(
         raise ValueError("Selecione entre um e três locais.")
     if modo not in {"historico", "ultimas", "periodo"}:
         raise ValueError("Amostra inválida.")
-    limite = min(max(int(limite or 1), 1), 100)
+    limite = min(max(int(limite or 1), 1), LIMITE_VISITAS_LOCAL)
     if modo == "periodo" and (not inicio or not fim):
         raise ValueError("O período da análise é obrigatório.")
 
@@ -1110,11 +2153,24 @@ def desempenho_locais(
         ).fetchall()
         catalogo = {int(row["id"]): row for row in produtos_rows}
 
-        resultado_locais = []
-        for local_id in ids:
-            operacoes = _selecionar_operacoes_local(
+        operacoes_por_local = {
+            local_id: _selecionar_operacoes_local(
                 conn, local_id, modo, limite, inicio, fim
             )
+            for local_id in ids
+        }
+        resumos = _resumos_operacoes(
+            conn,
+            [
+                operacao
+                for operacoes in operacoes_por_local.values()
+                for operacao in operacoes
+            ],
+        )
+
+        resultado_locais = []
+        for local_id in ids:
+            operacoes = operacoes_por_local[local_id]
             agregados_produtos = defaultdict(
                 lambda: {
                     "total": 0,
@@ -1140,7 +2196,7 @@ def desempenho_locais(
             }
 
             for operacao in operacoes:
-                dados = _analisar_operacao_local(conn, operacao)
+                dados = resumos[int(operacao["id"])]
                 totais["receita"] += dados["receita_centavos"]
                 totais["taxas"] += dados["taxas_centavos"]
                 totais["custo"] += dados["custo_centavos"]
@@ -1290,8 +2346,9 @@ def desempenho_locais(
 
 def relatorio_impressao(data_str):
     inicio, fim = periodo_operacional(data_str)
-    dados = _calcular_fechamento(inicio, fim, "todos")
-    if not dados["historico"]:
+    dados = _calcular_fechamento(inicio, fim, "todos", ("kpis", "itens"))
+    kpis = dados["kpis"]
+    if not kpis["pedidosPagos"] and not kpis["pedidosEstornados"]:
         return None
     por_categoria = defaultdict(list)
     for item in dados["itens"]:
@@ -1302,18 +2359,25 @@ def relatorio_impressao(data_str):
                 "valor": item["receita"],
             }
         )
-    horarios = [
-        datetime.fromisoformat(evento["horario"])
-        for evento in dados["historico"]
-        if evento["tipo"] == "pagamento"
-    ]
+    with _conexao() as conn:
+        primeiro, ultimo = conn.execute(
+            """
+            SELECT MIN(ocorrido_em), MAX(ocorrido_em)
+            FROM pagamentos
+            WHERE tipo = 'pagamento' AND ocorrido_em >= ? AND ocorrido_em < ?
+            """,
+            (inicio, fim),
+        ).fetchone()
     duracao = "N/A"
-    if horarios:
-        segundos = int((max(horarios) - min(horarios)).total_seconds())
+    if primeiro:
+        segundos = int(
+            (
+                datetime.fromisoformat(ultimo) - datetime.fromisoformat(primeiro)
+            ).total_seconds()
+        )
         horas, resto = divmod(max(segundos, 0), 3600)
         minutos = resto // 60
         duracao = f"{horas}h {minutos}min"
-    kpis = dados["kpis"]
     return {
         "sumario": {
             "total_pedidos": kpis["pedidosPagos"],
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, render_template, request, redirect, url_for, jsonify, Response
 import gerenciador_db
 from flask_socketio import SocketIO, join_room
 import os
@@ -8,6 +8,7 @@ import sys
 import threading
 import time
 import analytics
+import exportacao
 import pytz
 import json
 import re
@@ -93,21 +94,224 @@ OPERACAO_SESSAO_ATUAL = None
 
 
 
+# --- SALAS POR PAPEL DE TELA ---
+# Cada evento vai apenas para as salas das telas que o consomem.
+PAPEIS_SOCKET = ('cliente', 'cozinha', 'monitor', 'gestao')
+SALAS_POR_EVENTO = {
+    'atualizacao_disponibilidade': ('cliente', 'gestao'),
+    'pedido_delta': ('cozinha', 'monitor'),
+}
+_conexoes_socket = {}
+_conexoes_socket_lock = threading.Lock()
+
+
+def emitir_para_consumidores(evento, payload):
+    socketio.emit(evento, payload, to=list(SALAS_POR_EVENTO[evento]))
+
+
+def estatisticas_salas_socket():
+    """Conexões por sala e quantos clientes recebem cada tipo de evento."""
+    with _conexoes_socket_lock:
+        conexoes = list(_conexoes_socket.values())
+    return {
+        'conexoes': len(conexoes),
+        'salas': {
+            sala: sum(1 for salas in conexoes if sala in salas)
+            for sala in PAPEIS_SOCKET
+        },
+        'destinatarios_por_evento': {
+            evento: sum(
+                1 for salas in conexoes if any(sala in salas for sala in destinos)
+            )
+            for evento, destinos in SALAS_POR_EVENTO.items()
+        },
+    }
+
+
+def _janela_estoque_configurada():
+    """Janela de agrupamento em ms; ESPETAO_JANELA_ESTOQUE_MS=0 emite na hora."""
+    try:
+        return max(float(os.environ.get("ESPETAO_JANELA_ESTOQUE_MS", "75")), 0.0)
+    except ValueError:
+        return 75.0
+
+
+class AgregadorDisponibilidade:
+    """
+    Junta as atualizações de disponibilidade que chegam dentro de uma janela
+    curta e emite um único lote, mantendo apenas o valor mais recente de cada
+    produto.
+    """
+
+    def __init__(self, janela_ms):
+        self.janela_ms = janela_ms
+        self._lock = threading.Lock()
+        self._pendentes = {}
+        self._origens = []
+        self._agendado = False
+        self._versao = 0
+        self._chamadas = 0
+        self._lotes = 0
+        self._chamadas_pendentes = 0
+        self._economizadas = 0
+        self._valores_substituidos = 0
+
+    def adicionar(self, updates, origem):
+        with self._lock:
+            self._chamadas += 1
+            self._chamadas_pendentes += 1
+            for update in updates:
+                chave = str(update.get("produto_id"))
+                if chave in self._pendentes:
+                    self._valores_substituidos += 1
+                self._pendentes[chave] = update
+            if origem not in self._origens:
+                self._origens.append(origem)
+            agendar = self.janela_ms > 0 and not self._agendado
+            if agendar:
+                self._agendado = True
+
+        if self.janela_ms <= 0:
+            self.descarregar()
+        elif agendar:
+            socketio.start_background_task(self._aguardar_e_descarregar)
+
+    def _aguardar_e_descarregar(self):
+        socketio.sleep(self.janela_ms / 1000)
+        try:
+            self.descarregar()
+        except Exception as e:
+            print(f"AVISO: Falha ao emitir o lote de disponibilidade: {e}")
+
+    def descarregar(self):
+        """Emite imediatamente o lote pendente, se houver; devolve o payload."""
+        with self._lock:
+            self._agendado = False
+            if not self._pendentes:
+                return None
+            updates = list(self._pendentes.values())
+            origens = self._origens
+            self._pendentes = {}
+            self._origens = []
+            # A versão é o instante em ms, mas nunca repete nem retrocede.
+            self._versao = max(self._versao + 1, int(time.time() * 1000))
+            self._lotes += 1
+            self._economizadas += self._chamadas_pendentes - 1
+            self._chamadas_pendentes = 0
+            payload = {
+                "origem": origens[0] if len(origens) == 1 else "agrupado",
+                "origens": origens,
+                "version": self._versao,
+                "updates": updates,
+            }
+
+        emitir_para_consumidores('atualizacao_disponibilidade', payload)
+        print(f"Emitido 'atualizacao_disponibilidade' para totens e gestão: {len(updates)} updates.")
+        return payload
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                "janela_ms": self.janela_ms,
+                "atualizacoes_recebidas": self._chamadas,
+                "lotes_emitidos": self._lotes,
+                "mensagens_economizadas": self._economizadas,
+                "valores_substituidos": self._valores_substituidos,
+                "produtos_pendentes": len(self._pendentes),
+            }
+
+
+agregador_disponibilidade = AgregadorDisponibilidade(_janela_estoque_configurada())
+
+
 def emit_estoque_atualizado(updates, origem="desconhecida"):
     """
-    Agrega e emite atualizações de disponibilidade de estoque globalmente para todos os clientes.
+    Entrega as atualizações de disponibilidade ao `agregador_disponibilidade`,
+    que as junta na janela curta e emite um lote só para as salas que consomem
+    'atualizacao_disponibilidade' (totens e gestão).
     """
     if not updates:
         return
 
+    agregador_disponibilidade.adicionar(updates, origem)
+
+# --- EVENTOS INCREMENTAIS DE PEDIDOS ---
+# Cozinha e monitor mantêm a lista de pedidos ativos localmente e aplicam um
+# delta por alteração. A versão cresce a cada evento; a sessão muda quando o
+# servidor reinicia. Uma lacuna de versão ou uma sessão nova obriga o cliente a
+# recarregar /api/pedidos_ativos.
+SESSAO_EVENTOS_PEDIDOS = uuid.uuid4().hex
+_versao_pedidos = 0
+_versao_pedidos_lock = threading.Lock()
+
+
+def versao_atual_pedidos():
+    with _versao_pedidos_lock:
+        return _versao_pedidos
+
+
+def emitir_delta_pedido(id_do_pedido, tipo='status_alterado'):
+    """
+    Emite 'pedido_delta' com o estado completo do pedido alterado. Um pedido que
+    saiu dos status ativos é sempre anunciado como 'pedido_removido'.
+    """
+    global _versao_pedidos
+    # O pedido é lido sob a mesma trava que numera o delta: uma versão maior
+    # nunca carrega um estado mais antigo que o de uma versão menor.
+    with _versao_pedidos_lock:
+        pedido = gerenciador_db.obter_pedido_por_id(id_do_pedido)
+        _versao_pedidos += 1
+        versao = _versao_pedidos
+    if not pedido or pedido['status'] not in gerenciador_db.STATUS_PEDIDOS_ATIVOS:
+        tipo = 'pedido_removido'
+        pedido = None
+
     payload = {
-        "origem": origem,
-        "version": int(time.time() * 1000),
-        "updates": updates
+        'tipo': tipo,
+        'versao': versao,
+        'sessao': SESSAO_EVENTOS_PEDIDOS,
+        'pedido_id': id_do_pedido,
+        'pedido': pedido,
     }
-    # A ausência do parâmetro 'to' ou 'room' faz com que o emit seja um broadcast global
-    socketio.emit('atualizacao_disponibilidade', payload)
-    print(f"Emitido 'atualizacao_disponibilidade' globalmente: {len(updates)} updates.")
+    emitir_para_consumidores('pedido_delta', payload)
+    return payload
+
+# --- VARREDURA DE RESERVAS EXPIRADAS ---
+# As reservas valem 120 s; a varredura devolve o estoque aos totens assim que
+# elas vencem, sem esperar a próxima consulta completa de disponibilidade.
+INTERVALO_VARREDURA_RESERVAS = 5
+_varredura_reservas = None
+_varredura_reservas_lock = threading.Lock()
+
+
+def varrer_reservas_expiradas():
+    """Executa uma varredura e emite, em um único lote, os produtos liberados."""
+    resultado = gerenciador_db.expirar_reservas_vencidas()
+    if resultado.get('sucesso') and resultado.get('produtos_afetados'):
+        emit_estoque_atualizado(
+            updates=resultado['produtos_afetados'],
+            origem='reserva_expirada'
+        )
+    return resultado
+
+
+def _laco_varredura_reservas():
+    while True:
+        socketio.sleep(INTERVALO_VARREDURA_RESERVAS)
+        try:
+            varrer_reservas_expiradas()
+        except Exception as e:
+            print(f"AVISO: Falha na varredura de reservas expiradas: {e}")
+
+
+def iniciar_varredura_reservas():
+    """Inicia a tarefa de fundo uma única vez, no hub do servidor Socket.IO."""
+    global _varredura_reservas
+    with _varredura_reservas_lock:
+        if _varredura_reservas is None:
+            _varredura_reservas = socketio.start_background_task(
+                _laco_varredura_reservas
+            )
 
 # --- CONFIGURAÇÃO DA IMPRESSORA ---
 
@@ -160,12 +364,25 @@ def _salvar_config_impressora(data):
 
 
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
     """
-    Quando um cliente se conecta, apenas registramos o evento.
-    Não há mais necessidade de salas por local.
+    Coloca o cliente na sala do seu papel ('cliente', 'cozinha', 'monitor' ou
+    'gestao'), informado em auth.papel. Clientes antigos, sem papel, entram em
+    todas as salas e continuam recebendo todos os eventos.
     """
-    print(f"Cliente conectado ao Socket.IO.")
+    iniciar_varredura_reservas()
+    papel = auth.get('papel') if isinstance(auth, dict) else None
+    salas = (papel,) if papel in PAPEIS_SOCKET else PAPEIS_SOCKET
+    for sala in salas:
+        join_room(sala)
+    with _conexoes_socket_lock:
+        _conexoes_socket[request.sid] = salas
+    print(f"Cliente conectado ao Socket.IO ({papel or 'sem papel'}).")
+
+@socketio.on('disconnect')
+def handle_disconnect(*args):
+    with _conexoes_socket_lock:
+        _conexoes_socket.pop(request.sid, None)
 
 @app.route('/api/definir_local_sessao', methods=['POST'])
 def definir_local_sessao_view():
@@ -766,7 +983,7 @@ def salvar_pedido():
         except Exception as e:
             print(f"AVISO: A transação do pedido foi bem-sucedida, mas a emissão do socket falhou: {e}")
 
-    socketio.emit('novo_pedido', {'msg': 'Um novo pedido chegou!'})
+    emitir_delta_pedido(resultado_salvo['id'], 'pedido_criado')
     return jsonify({
         "status": "sucesso",
         "mensagem": "Pedido recebido, em preparação!",
@@ -781,7 +998,7 @@ def rota_iniciar_preparo(id_do_pedido):
     sucesso = gerenciador_db.iniciar_preparo_pedido(id_do_pedido)
     if sucesso:
         # Emite o evento para notificar todos os clientes (inclusive a cozinha) que o estado mudou
-        socketio.emit('novo_pedido', {'msg': f'Pedido {id_do_pedido} começou a ser preparado!'})
+        emitir_delta_pedido(id_do_pedido)
         return jsonify({"status": "sucesso", "mensagem": "Pedido iniciado com sucesso."})
     else:
         return jsonify({"status": "erro", "mensagem": "Pedido não pôde ser iniciado."}), 400
@@ -793,7 +1010,7 @@ def rota_entregar_pedido(id_do_pedido):
     """
     sucesso = gerenciador_db.entregar_pedido(id_do_pedido)
     if sucesso:
-        socketio.emit('novo_pedido', {'msg': f'Pedido {id_do_pedido} foi entregue!'})
+        emitir_delta_pedido(id_do_pedido)
         return jsonify({"status": "sucesso"})
     else:
         return jsonify({"status": "erro"}), 400
@@ -831,7 +1048,7 @@ def rota_cancelar_pedido(id_do_pedido):
                 except Exception as e:
                     print(f"AVISO: O cancelamento do pedido foi bem-sucedido, mas a emissão do socket falhou: {e}")
 
-        socketio.emit('novo_pedido', {'msg': f'Pedido {id_do_pedido} foi cancelado!'})
+        emitir_delta_pedido(id_do_pedido)
         return jsonify({"status": "sucesso"})
     else:
         return jsonify({"status": "erro"}), 400
@@ -866,14 +1083,12 @@ def rota_confirmar_pagamento(pedido_id):
     if pedido['fluxo_simples'] == 1:
         # Se for simples, usamos nossa nova função para pular para a retirada.
         sucesso = gerenciador_db.pular_pedido_para_retirada(pedido_id)
-        mensagem_socket = f'Pedido simples {pedido_id} está pronto para retirada!'
     else:
         # Se for complexo, o trabalho aqui está feito. O pedido aguarda preparo.
         sucesso = True
-        mensagem_socket = f'Pagamento do pedido {pedido_id} confirmado, aguardando preparo.'
 
     if sucesso:
-        socketio.emit('novo_pedido', {'msg': mensagem_socket})
+        emitir_delta_pedido(pedido_id)
         return jsonify({
             "status": "sucesso",
             "metodo_pagamento": metodo_confirmado,
@@ -887,11 +1102,30 @@ def api_pedidos_ativos():
     Fornece a lista de todos os pedidos ativos em formato JSON.
     Esta API é consumida pela nova tela da cozinha para renderização dinâmica.
     """
-    # 1. Chama nosso especialista em banco de dados, que já sabe como buscar e ordenar os pedidos.
+    # 1. A versão é lida antes da consulta: deltas posteriores a ela são
+    # reaplicados pelo cliente, e cada delta traz o estado completo do pedido.
+    versao = versao_atual_pedidos()
+
+    # 2. Chama nosso especialista em banco de dados, que já sabe como buscar e ordenar os pedidos.
     pedidos_ativos = gerenciador_db.obter_pedidos_ativos()
 
-    # 2. Usa a função 'jsonify' do Flask para converter nossa lista Python em uma resposta JSON.
-    return jsonify(pedidos_ativos)
+    # 3. Usa a função 'jsonify' do Flask para converter nossa lista Python em uma resposta JSON.
+    resposta = jsonify(pedidos_ativos)
+    resposta.headers['X-Pedidos-Versao'] = str(versao)
+    resposta.headers['X-Pedidos-Sessao'] = SESSAO_EVENTOS_PEDIDOS
+    return resposta
+
+@app.route('/api/pedidos_ativos/versao')
+def api_pedidos_ativos_versao():
+    """
+    Versão e sessão dos deltas de pedidos, sem consultar o banco. Telas que
+    dependem dos deltas comparam com a própria versão para notar um delta perdido.
+    """
+    versao = versao_atual_pedidos()
+    resposta = jsonify({"versao": versao, "sessao": SESSAO_EVENTOS_PEDIDOS})
+    resposta.headers['X-Pedidos-Versao'] = str(versao)
+    resposta.headers['X-Pedidos-Sessao'] = SESSAO_EVENTOS_PEDIDOS
+    return resposta
 
 @app.route('/pedido/chamar/<int:id_do_pedido>', methods=['POST'])
 def rota_chamar_cliente(id_do_pedido):
@@ -901,7 +1135,7 @@ def rota_chamar_cliente(id_do_pedido):
     sucesso = gerenciador_db.chamar_cliente_pedido(id_do_pedido)
     if sucesso:
         # Emite o evento para notificar cozinha e monitor que o pedido está pronto
-        socketio.emit('novo_pedido', {'msg': f'Pedido {id_do_pedido} está pronto para retirada!'})
+        emitir_delta_pedido(id_do_pedido)
         return jsonify({"status": "sucesso", "mensagem": "Cliente chamado com sucesso."})
     else:
         return jsonify({"status": "erro", "mensagem": "Pedido não pôde ser atualizado."}), 400
@@ -925,7 +1159,7 @@ def rota_entregar_direto(id_do_pedido):
     # baixa o estoque e marca o pedido como 'finalizado'.
     sucesso = gerenciador_db.entregar_pedido(id_do_pedido)
     if sucesso:
-        socketio.emit('novo_pedido', {'msg': f'Pedido {id_do_pedido} (simples) foi entregue!'})
+        emitir_delta_pedido(id_do_pedido)
         return jsonify({"status": "sucesso"})
     else:
         return jsonify({"status": "erro"}), 400
@@ -969,8 +1203,8 @@ def rota_reiniciar_item(pedido_id, produto_id):
 
     sucesso = gerenciador_db.reiniciar_preparo_item(pedido_id, produto_id, k_posicao)
     if sucesso:
-        # Emite um evento para que a cozinha recarregue e recalcule os timers
-        socketio.emit('novo_pedido', {'msg': f'Item {produto_id} do pedido {pedido_id} reiniciado!'})
+        # Emite o pedido atualizado para que a cozinha recalcule os timers
+        emitir_delta_pedido(pedido_id)
         return jsonify({"status": "sucesso", "mensagem": "Item reiniciado."})
     else:
         return jsonify({"status": "erro", "mensagem": "Item não pôde ser reiniciado."}), 400
@@ -1094,6 +1328,38 @@ def api_insights_locais():
         return jsonify({"erro": "Não foi possível analisar os locais."}), 500
 
 
+def _periodo_da_requisicao():
+    """
+    Lê 'data' (um dia operacional) ou 'inicio' e 'fim' da query e devolve os
+    limites em UTC. Levanta ValueError com a mensagem para o cliente.
+    """
+    date_str = request.args.get('data')
+    inicio_str = request.args.get('inicio')
+    fim_str = request.args.get('fim')
+
+    if date_str:
+        # Prioridade para o parâmetro 'data'
+        try:
+            tz_sp = pytz.timezone('America/Sao_Paulo')
+            dia_selecionado = datetime.strptime(date_str, '%Y-%m-%d')
+        except (ValueError, TypeError):
+            raise ValueError("Formato de data inválido. Use AAAA-MM-DD.") from None
+
+        # O dia de trabalho começa às 05:00 do dia D
+        inicio_local = tz_sp.localize(dia_selecionado.replace(hour=5, minute=0, second=0, microsecond=0))
+        # O fim é exclusivo: 05:00 do dia seguinte.
+        fim_local = inicio_local + timedelta(days=1)
+
+        # Converte para UTC para as queries no banco
+        return (
+            inicio_local.astimezone(pytz.utc).isoformat(),
+            fim_local.astimezone(pytz.utc).isoformat(),
+        )
+    if not inicio_str or not fim_str:
+        raise ValueError("Os parâmetros 'inicio' e 'fim' (ou 'data') são obrigatórios.")
+    return inicio_str, fim_str
+
+
 @app.route('/api/fechamento_dia_v2')
 def api_fechamento_dia_v2():
     """
@@ -1101,33 +1367,23 @@ def api_fechamento_dia_v2():
     """
     try:
         # 1. Validação e normalização dos parâmetros da query
-        date_str = request.args.get('data')
-        inicio_str = request.args.get('inicio')
-        fim_str = request.args.get('fim')
+        try:
+            inicio_str, fim_str = _periodo_da_requisicao()
+        except ValueError as e:
+            return jsonify({"erro": str(e)}), 400
 
-        if date_str:
-            # Prioridade para o parâmetro 'data'
-            try:
-                tz_sp = pytz.timezone('America/Sao_Paulo')
-                dia_selecionado = datetime.strptime(date_str, '%Y-%m-%d')
-
-                # O dia de trabalho começa às 05:00 do dia D
-                inicio_local = tz_sp.localize(dia_selecionado.replace(hour=5, minute=0, second=0, microsecond=0))
-                # O fim é exclusivo: 05:00 do dia seguinte.
-                fim_local = inicio_local + timedelta(days=1)
-
-                # Converte para UTC para as queries no banco
-                inicio_str = inicio_local.astimezone(pytz.utc).isoformat()
-                fim_str = fim_local.astimezone(pytz.utc).isoformat()
-            except (ValueError, TypeError):
-                return jsonify({"erro": "Formato de data inválido. Use AAAA-MM-DD."}), 400
-        elif not inicio_str or not fim_str:
-            return jsonify({"erro": "Os parâmetros 'inicio' e 'fim' (ou 'data') são obrigatórios."}), 400
-        
         # Leitura dos outros parâmetros
         page = request.args.get('page', default=1, type=int)
         limit = request.args.get('limit', default=50, type=int)
         local_id = request.args.get('local_id', default='todos')
+        # Máximo de pontos do gráfico de vendas; sem o parâmetro, série inteira.
+        pontos = request.args.get('pontos', type=int)
+        # Seções opcionais (ex.: secoes=kpis,estoque); sem o parâmetro, todas.
+        secoes = request.args.get('secoes') or request.args.get('campos')
+        try:
+            secoes = analytics.normalizar_secoes(secoes)
+        except ValueError as e:
+            return jsonify({"erro": str(e)}), 400
 
         # Garante que page e limit sejam sensatos
         if page < 1: page = 1
@@ -1140,7 +1396,9 @@ def api_fechamento_dia_v2():
             fim=fim_str,
             page=page,
             limit=limit,
-            local_id=local_id
+            local_id=local_id,
+            secoes=secoes,
+            pontos=pontos
         )
 
         # 3. Retorna os dados já serializados no formato correto
@@ -1152,6 +1410,65 @@ def api_fechamento_dia_v2():
         return jsonify(serializers.FechamentoSerializer.to_api_v2({}, {})), 500
 
 
+@app.route('/api/historico_eventos')
+def api_historico_eventos():
+    """
+    Histórico de pagamentos e estornos paginado por cursor. Filtros opcionais:
+    local_id, metodo e tipo ('pagamento' ou 'estorno').
+    """
+    try:
+        inicio_str, fim_str = _periodo_da_requisicao()
+        dados = analytics.historico_eventos(
+            inicio_str,
+            fim_str,
+            local_id=request.args.get('local_id', default='todos'),
+            metodo=request.args.get('metodo') or None,
+            tipo=request.args.get('tipo') or None,
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', default=50, type=int),
+        )
+        return jsonify(dados)
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+    except Exception as e:
+        print(f"ERRO em /api/historico_eventos: {e}")
+        return jsonify({"erro": "Não foi possível carregar o histórico."}), 500
+
+
+@app.route('/api/exportar/<tipo>')
+def api_exportar(tipo):
+    """
+    Exporta pagamentos, itens ou o ledger de estoque do período como CSV ou
+    NDJSON (formato=ndjson), em streaming. Com gzip=1 o arquivo sai comprimido.
+    """
+    try:
+        inicio_str, fim_str = _periodo_da_requisicao()
+        formato = request.args.get('formato', default='csv')
+        partes = exportacao.exportar(
+            tipo,
+            formato,
+            inicio_str,
+            fim_str,
+            local_id=request.args.get('local_id', default='todos'),
+        )
+    except ValueError as e:
+        return jsonify({"erro": str(e)}), 400
+
+    nome_arquivo = f"espetao-{tipo}-{inicio_str[:10]}-{fim_str[:10]}.{formato}"
+    mimetype = 'text/csv' if formato == 'csv' else 'application/x-ndjson'
+    if request.args.get('gzip') in ('1', 'true'):
+        partes = exportacao.comprimir_gzip(partes)
+        nome_arquivo += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        partes = (parte.encode('utf-8') for parte in partes)
+    return Response(
+        partes,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{nome_arquivo}"'},
+    )
+
+
 @app.route('/api/insights/comparativos_v2')
 def api_insights_comparativos_v2():
     """
@@ -1221,6 +1538,26 @@ def api_gerenciar_reserva_item():
 
     return jsonify(resultado)
 
+@app.route('/api/carrinho/itens', methods=['POST'])
+def api_definir_reservas_itens():
+    """Define as reservas de vários produtos de uma vez, com um único aviso."""
+    dados = request.get_json(silent=True) or {}
+    carrinho_id = dados.get('carrinho_id')
+    quantidades = dados.get('itens')
+
+    if not carrinho_id or not isinstance(quantidades, dict) or not quantidades:
+        return jsonify({"sucesso": False, "mensagem": "Dados incompletos."}), 400
+
+    resultado = gerenciador_db.definir_reservas(carrinho_id, quantidades)
+
+    if resultado.get('produtos_afetados'):
+        emit_estoque_atualizado(
+            updates=resultado.get('produtos_afetados', []),
+            origem='reserva_itens'
+        )
+
+    return jsonify(resultado)
+
 @app.route('/api/carrinho/renovar', methods=['POST'])
 def api_renovar_carrinho():
     """ Endpoint para estender a validade das reservas do carrinho. """
@@ -1282,6 +1619,19 @@ def api_salvar_config_impressora():
     else:
         return jsonify({'mensagem': 'Erro interno ao salvar o arquivo de configuração.'}), 500
 
+@app.route('/api/diagnostico/tempo_real', methods=['GET'])
+def api_diagnostico_tempo_real():
+    """Contadores do agrupamento de avisos de estoque e conexões por sala."""
+    return jsonify({
+        'disponibilidade': agregador_disponibilidade.estatisticas(),
+        'socket': estatisticas_salas_socket(),
+    })
+
+@app.route('/api/diagnostico/analytics', methods=['GET'])
+def api_diagnostico_analytics():
+    """Acertos, falhas e descartes do cache de relatórios."""
+    return jsonify(analytics.estatisticas_cache())
+
 @app.route('/api/diagnostico_impressora', methods=['GET'])
 def api_diagnostico_impressora():
     """Diagnóstico completo da impressora com testes detalhados."""
@@ -6,12 +6,14 @@ import os
 import shutil
 import sqlite3
 import sys
+import threading
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from pathlib import Path
 from zoneinfo import ZoneInfo
 
 
-SCHEMA_VERSION = 5
+SCHEMA_VERSION = 9
 TIMEZONE_LOCAL = ZoneInfo("America/Sao_Paulo")
 
 
@@ -45,20 +47,228 @@ def _banco_embutido() -> Path | None:
 NOME_BANCO_DADOS = str(caminho_banco())
 
 
-def conectar(db_path: str | os.PathLike[str] | None = None) -> sqlite3.Connection:
-    """Abre uma conexão sempre com as mesmas garantias de integridade."""
-    path = str(db_path or caminho_banco())
-    if path != ":memory:":
-        Path(path).parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(path, timeout=15)
+# Perfil das exportações em streaming: só recusam escrita. Tabelas temporárias
+# continuam no padrão do SQLite, que pode usar disco em vez de memória.
+PRAGMAS_EXPORTACAO = ("PRAGMA query_only = ON",)
+
+# Perfil das conexões de relatório: recusam escrita, leem o arquivo por mmap e
+# guardam mais páginas e tabelas temporárias em memória, sem disputar o cache
+# das conexões que gravam vendas. Relatórios agregam resultados pequenos; o
+# `temp_store` em memória não serve para leituras em massa.
+PRAGMAS_ANALITICOS = (
+    *PRAGMAS_EXPORTACAO,
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -16384",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+def _configurar_conexao(
+    conn: sqlite3.Connection, path: str, pragmas: tuple[str, ...] = ()
+) -> sqlite3.Connection:
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA foreign_keys = ON")
     conn.execute("PRAGMA busy_timeout = 15000")
     if path != ":memory:":
         conn.execute("PRAGMA journal_mode = WAL")
+    for pragma in pragmas:
+        conn.execute(pragma)
     return conn
 
 
+def conectar(
+    db_path: str | os.PathLike[str] | None = None, pragmas: tuple[str, ...] = ()
+) -> sqlite3.Connection:
+    """
+    Abre uma conexão sempre com as mesmas garantias de integridade. `pragmas`
+    aplica um perfil extra, como `PRAGMAS_ANALITICOS` ou `PRAGMAS_EXPORTACAO`.
+    """
+    path = str(db_path or caminho_banco())
+    if path != ":memory:":
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+    return _configurar_conexao(sqlite3.connect(path, timeout=15), path, pragmas)
+
+
+class ConexaoReutilizavel(sqlite3.Connection):
+    """Conexão cujo `close()` a devolve ao pool em vez de encerrá-la."""
+
+    pool: PoolConexoes | None = None
+    geracao = 0
+    inode = 0
+
+    def close(self) -> None:
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.devolver(self)
+
+    def encerrar(self) -> None:
+        self.pool = None
+        super().close()
+
+
+class PoolConexoes:
+    """Mantém conexões já configuradas para reutilização entre requisições.
+
+    Cada conexão é entregue a um único chamador por vez, seja thread ou
+    greenlet, e volta ao pool quando o chamador a fecha. `maximo_ociosas`
+    limita só as conexões ociosas guardadas; acima dele, a conexão devolvida
+    é encerrada. Não há teto para as emprestadas: com todas em uso, `obter`
+    abre uma conexão nova em vez de esperar. A aplicação usa um banco por vez,
+    então trocar de caminho drena as conexões do banco anterior. `pragmas` é o
+    perfil aplicado a cada conexão nova, como `PRAGMAS_ANALITICOS`.
+    """
+
+    def __init__(
+        self, maximo_ociosas: int = 8, pragmas: tuple[str, ...] = ()
+    ) -> None:
+        self.maximo_ociosas = max(int(maximo_ociosas), 0)
+        self.pragmas = pragmas
+        self._trava = threading.Lock()
+        self._livres: list[ConexaoReutilizavel] = []
+        self._caminho: str | None = None
+        self._geracao = 0
+        self._estatisticas = {
+            "criadas": 0,
+            "reutilizadas": 0,
+            "descartadas": 0,
+            "em_uso": 0,
+        }
+
+    def _inode(self, path: str) -> int:
+        try:
+            return os.stat(path).st_ino
+        except OSError:
+            return 0
+
+    def _conexao_saudavel(self, conn: ConexaoReutilizavel, path: str) -> bool:
+        # Um banco substituído no disco (migração ou restauração) invalida a
+        # conexão antiga, que continuaria apontando para o arquivo anterior.
+        if conn.geracao != self._geracao or conn.inode != self._inode(path):
+            return False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def obter(
+        self, db_path: str | os.PathLike[str] | None = None
+    ) -> sqlite3.Connection:
+        path = str(db_path or caminho_banco())
+        if path == ":memory:" or not self.maximo_ociosas:
+            return conectar(path, self.pragmas)
+        while True:
+            with self._trava:
+                if path != self._caminho:
+                    self._drenar_livres()
+                    self._caminho = path
+                conn = self._livres.pop() if self._livres else None
+            if conn is None:
+                break
+            if self._conexao_saudavel(conn, path):
+                with self._trava:
+                    self._estatisticas["reutilizadas"] += 1
+                    self._estatisticas["em_uso"] += 1
+                conn.pool = self
+                return conn
+            with self._trava:
+                self._estatisticas["descartadas"] += 1
+            conn.encerrar()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(
+            path,
+            timeout=15,
+            factory=ConexaoReutilizavel,
+            check_same_thread=False,
+        )
+        _configurar_conexao(conn, path, self.pragmas)
+        with self._trava:
+            conn.geracao = self._geracao
+            self._estatisticas["criadas"] += 1
+            self._estatisticas["em_uso"] += 1
+        conn.inode = self._inode(path)
+        conn.pool = self
+        return conn
+
+    def devolver(self, conn: ConexaoReutilizavel) -> None:
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.geracao = -1
+        with self._trava:
+            self._estatisticas["em_uso"] = max(self._estatisticas["em_uso"] - 1, 0)
+            guardar = (
+                conn.geracao == self._geracao
+                and len(self._livres) < self.maximo_ociosas
+            )
+            if guardar:
+                conn.pool = None
+                self._livres.append(conn)
+            else:
+                self._estatisticas["descartadas"] += 1
+        if not guardar:
+            conn.encerrar()
+
+    def _drenar_livres(self) -> int:
+        livres, self._livres = self._livres, []
+        self._geracao += 1
+        self._estatisticas["descartadas"] += len(livres)
+        for conn in livres:
+            conn.encerrar()
+        return len(livres)
+
+    def drenar(self) -> int:
+        """Encerra as conexões ociosas e descarta as emprestadas ao voltarem."""
+        with self._trava:
+            return self._drenar_livres()
+
+    @property
+    def geracao(self) -> int:
+        """Muda a cada drenagem, inclusive quando o banco é trocado ou recriado."""
+        with self._trava:
+            return self._geracao
+
+    def estatisticas(self) -> dict:
+        with self._trava:
+            return {
+                **self._estatisticas,
+                "livres": len(self._livres),
+                "maximo_ociosas": self.maximo_ociosas,
+            }
+
+
+def _maximo_ociosas_configurado() -> int:
+    try:
+        return int(os.environ.get("ESPETAO_DB_POOL_MAX", "8"))
+    except ValueError:
+        return 8
+
+
+pool_conexoes = PoolConexoes(_maximo_ociosas_configurado())
+pool_analitico = PoolConexoes(_maximo_ociosas_configurado(), PRAGMAS_ANALITICOS)
+
+
+def obter_conexao(db_path: str | os.PathLike[str] | None = None) -> sqlite3.Connection:
+    """Empresta uma conexão configurada do pool; `close()` a devolve."""
+    return pool_conexoes.obter(db_path)
+
+
+def obter_conexao_analitica(
+    db_path: str | os.PathLike[str] | None = None,
+) -> sqlite3.Connection:
+    """Empresta uma conexão somente leitura do pool de relatórios."""
+    return pool_analitico.obter(db_path)
+
+
+def drenar_pool() -> int:
+    return pool_conexoes.drenar() + pool_analitico.drenar()
+
+
 SCHEMA_SQL = """
 CREATE TABLE IF NOT EXISTS schema_version (
     version INTEGER PRIMARY KEY,
@@ -159,6 +369,8 @@ CREATE TABLE IF NOT EXISTS pedidos (
     fluxo_simples INTEGER NOT NULL DEFAULT 0 CHECK (fluxo_simples IN (0, 1)),
     local_id INTEGER NOT NULL,
     operacao_id INTEGER,
+    criado_epoch INTEGER,
+    dia_operacional TEXT,
     FOREIGN KEY (local_id) REFERENCES locais(id) ON DELETE RESTRICT,
     FOREIGN KEY (operacao_id) REFERENCES operacoes(id) ON DELETE RESTRICT
 );
@@ -193,6 +405,10 @@ CREATE TABLE IF NOT EXISTS pagamentos (
     valor_centavos INTEGER NOT NULL CHECK (valor_centavos > 0),
     taxa_centavos INTEGER NOT NULL DEFAULT 0 CHECK (taxa_centavos >= 0),
     ocorrido_em TEXT NOT NULL,
+    ocorrido_epoch INTEGER,
+    dia_operacional TEXT,
+    hora_local INTEGER,
+    dia_semana_local INTEGER,
     FOREIGN KEY (pedido_id) REFERENCES pedidos(id) ON DELETE RESTRICT,
     UNIQUE (pedido_id, tipo)
 );
@@ -224,6 +440,8 @@ CREATE TABLE IF NOT EXISTS estoque_movimentacoes (
         CHECK (impacta_relatorio IN (0, 1)),
     observacao TEXT,
     created_at TEXT NOT NULL,
+    created_epoch INTEGER,
+    dia_operacional TEXT,
     FOREIGN KEY (produto_id) REFERENCES produtos(id) ON DELETE RESTRICT,
     FOREIGN KEY (pedido_id) REFERENCES pedidos(id) ON DELETE RESTRICT,
     FOREIGN KEY (pedido_item_id) REFERENCES pedido_itens(id) ON DELETE RESTRICT,
@@ -289,9 +507,430 @@ CREATE INDEX IF NOT EXISTS idx_reservas_expires
 ON reservas_carrinho(expires_at);
 """
 
+# Saldo derivado por lote. A fonte continua sendo `estoque_lotes` mais suas
+# movimentações; os gatilhos mantêm a tabela na mesma transação de cada escrita.
+# Lotes esgotados saem do índice parcial, e saldos negativos herdados de bancos
+# v2 continuam somados porque o filtro é `<> 0`.
+#
+# O SQLite só usa um índice parcial quando o WHERE da consulta contém o mesmo
+# termo do índice, por isso índice e consultas montam o filtro a partir destas
+# constantes. Lotes com saldo positivo repetem `<> 0` antes de `> 0`: o segundo
+# termo sozinho não casa com o índice.
+SALDO_LOTE_NAO_ZERO = "quantidade_disponivel <> 0"
+SALDO_LOTE_POSITIVO = f"{SALDO_LOTE_NAO_ZERO} AND quantidade_disponivel > 0"
+
+SALDO_LOTES_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS estoque_lotes_saldo (
+        lote_id INTEGER PRIMARY KEY,
+        produto_id INTEGER NOT NULL,
+        custo_unitario_centavos INTEGER NOT NULL,
+        recebido_em TEXT NOT NULL,
+        quantidade_disponivel INTEGER NOT NULL
+    )
+    """,
+    f"""
+    CREATE INDEX IF NOT EXISTS idx_lotes_saldo_ativos
+    ON estoque_lotes_saldo(produto_id, recebido_em, lote_id)
+    WHERE {SALDO_LOTE_NAO_ZERO}
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_lotes_saldo_inserir
+    AFTER INSERT ON estoque_lotes
+    BEGIN
+        INSERT INTO estoque_lotes_saldo(
+            lote_id, produto_id, custo_unitario_centavos,
+            recebido_em, quantidade_disponivel
+        ) VALUES (
+            NEW.id, NEW.produto_id, NEW.custo_unitario_centavos,
+            NEW.recebido_em, NEW.quantidade_inicial
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_lotes_saldo_atualizar
+    AFTER UPDATE OF produto_id, quantidade_inicial, custo_unitario_centavos,
+        recebido_em ON estoque_lotes
+    BEGIN
+        UPDATE estoque_lotes_saldo
+        SET produto_id = NEW.produto_id,
+            custo_unitario_centavos = NEW.custo_unitario_centavos,
+            recebido_em = NEW.recebido_em,
+            quantidade_disponivel = quantidade_disponivel
+                + NEW.quantidade_inicial - OLD.quantidade_inicial
+        WHERE lote_id = NEW.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_lotes_saldo_remover
+    AFTER DELETE ON estoque_lotes
+    BEGIN
+        DELETE FROM estoque_lotes_saldo WHERE lote_id = OLD.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_saldo_inserir
+    AFTER INSERT ON estoque_movimentacoes
+    WHEN NEW.lote_id IS NOT NULL
+    BEGIN
+        UPDATE estoque_lotes_saldo
+        SET quantidade_disponivel = quantidade_disponivel + NEW.quantidade
+        WHERE lote_id = NEW.lote_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_saldo_atualizar
+    AFTER UPDATE OF lote_id, quantidade ON estoque_movimentacoes
+    BEGIN
+        UPDATE estoque_lotes_saldo
+        SET quantidade_disponivel = quantidade_disponivel - OLD.quantidade
+        WHERE lote_id = OLD.lote_id;
+        UPDATE estoque_lotes_saldo
+        SET quantidade_disponivel = quantidade_disponivel + NEW.quantidade
+        WHERE lote_id = NEW.lote_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_movimentacoes_saldo_remover
+    AFTER DELETE ON estoque_movimentacoes
+    WHEN OLD.lote_id IS NOT NULL
+    BEGIN
+        UPDATE estoque_lotes_saldo
+        SET quantidade_disponivel = quantidade_disponivel - OLD.quantidade
+        WHERE lote_id = OLD.lote_id;
+    END
+    """,
+)
+
+SCHEMA_SQL += "".join(f"{ddl.strip()};\n" for ddl in SALDO_LOTES_DDL)
+
+# Resumos de venda por intervalo de 15 minutos (início em UTC). A fonte continua
+# sendo `pagamentos` mais os itens fotografados; cada pagamento ou estorno soma
+# sua parcela na mesma transação em que é gravado, com sinal negativo no estorno.
+# Não há chave estrangeira para que o resumo sobreviva à edição de cadastros.
+RESUMO_VENDAS_MINUTOS = 15
+RESUMO_VENDAS_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS vendas_resumo_periodo (
+        bucket_inicio TEXT NOT NULL,
+        dia_operacional TEXT NOT NULL,
+        local_id INTEGER NOT NULL,
+        metodo TEXT NOT NULL,
+        pagamentos INTEGER NOT NULL DEFAULT 0,
+        estornos INTEGER NOT NULL DEFAULT 0,
+        valor_pago_centavos INTEGER NOT NULL DEFAULT 0,
+        valor_estornado_centavos INTEGER NOT NULL DEFAULT 0,
+        taxa_centavos INTEGER NOT NULL DEFAULT 0,
+        custo_centavos INTEGER NOT NULL DEFAULT 0,
+        unidades_pagas INTEGER NOT NULL DEFAULT 0,
+        unidades_liquidas INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket_inicio, local_id, metodo)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_vendas_resumo_periodo_dia
+    ON vendas_resumo_periodo(dia_operacional, local_id)
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS vendas_resumo_produto (
+        bucket_inicio TEXT NOT NULL,
+        dia_operacional TEXT NOT NULL,
+        local_id INTEGER NOT NULL,
+        produto_id INTEGER NOT NULL,
+        nome_produto TEXT NOT NULL,
+        categoria_nome TEXT NOT NULL,
+        quantidade INTEGER NOT NULL DEFAULT 0,
+        receita_centavos INTEGER NOT NULL DEFAULT 0,
+        custo_centavos INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket_inicio, local_id, produto_id)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_vendas_resumo_produto_dia
+    ON vendas_resumo_produto(dia_operacional, local_id)
+    """,
+)
+
+SCHEMA_SQL += "".join(f"{ddl.strip()};\n" for ddl in RESUMO_VENDAS_DDL)
+
+# Resumo gravado de uma visita encerrada, preenchido por `gerenciador_db` no
+# encerramento e regravado por pagamento ou estorno tardio; a migração para o v9
+# resume o histórico. Qualquer escrita que possa mudar o resultado (pagamento ou
+# estorno, retomada da visita, nova fotografia do estoque, pedido trocado de
+# visita) apaga o resumo, e quem a faz numa visita encerrada o regrava na mesma
+# transação. Se ainda assim faltar, `analytics` calcula a visita só para a
+# leitura, sem gravar.
+RESUMO_OPERACAO_DDL = (
+    """
+    CREATE TABLE IF NOT EXISTS operacao_resumo (
+        operacao_id INTEGER PRIMARY KEY,
+        receita_centavos INTEGER NOT NULL,
+        taxas_centavos INTEGER NOT NULL,
+        custo_centavos INTEGER NOT NULL,
+        pedidos INTEGER NOT NULL,
+        estornos_centavos INTEGER NOT NULL,
+        unidades INTEGER NOT NULL,
+        calculado_em TEXT NOT NULL,
+        FOREIGN KEY (operacao_id) REFERENCES operacoes(id) ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS operacao_resumo_horas (
+        operacao_id INTEGER NOT NULL,
+        hora INTEGER NOT NULL CHECK (hora BETWEEN 0 AND 23),
+        faturamento_centavos INTEGER NOT NULL,
+        pedidos INTEGER NOT NULL,
+        unidades INTEGER NOT NULL,
+        PRIMARY KEY (operacao_id, hora),
+        FOREIGN KEY (operacao_id) REFERENCES operacao_resumo(operacao_id)
+            ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS operacao_resumo_produtos (
+        operacao_id INTEGER NOT NULL,
+        produto_id INTEGER NOT NULL,
+        vendidas INTEGER NOT NULL,
+        levadas INTEGER,
+        restantes INTEGER,
+        esgotou INTEGER CHECK (esgotou IN (0, 1)),
+        PRIMARY KEY (operacao_id, produto_id),
+        FOREIGN KEY (operacao_id) REFERENCES operacao_resumo(operacao_id)
+            ON DELETE CASCADE
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_resumo_operacao_pagamento_inserir
+    AFTER INSERT ON pagamentos
+    BEGIN
+        DELETE FROM operacao_resumo
+        WHERE operacao_id = (
+            SELECT operacao_id FROM pedidos WHERE id = NEW.pedido_id
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_resumo_operacao_pagamento_atualizar
+    AFTER UPDATE ON pagamentos
+    BEGIN
+        DELETE FROM operacao_resumo
+        WHERE operacao_id IN (
+            SELECT operacao_id FROM pedidos
+            WHERE id IN (OLD.pedido_id, NEW.pedido_id)
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_resumo_operacao_pedido_visita
+    AFTER UPDATE OF operacao_id ON pedidos
+    BEGIN
+        DELETE FROM operacao_resumo
+        WHERE operacao_id IN (OLD.operacao_id, NEW.operacao_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_resumo_operacao_alterada
+    AFTER UPDATE ON operacoes
+    BEGIN
+        DELETE FROM operacao_resumo WHERE operacao_id = OLD.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_resumo_operacao_estoque_inserir
+    AFTER INSERT ON operacao_estoque
+    BEGIN
+        DELETE FROM operacao_resumo WHERE operacao_id = NEW.operacao_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_resumo_operacao_estoque_atualizar
+    AFTER UPDATE ON operacao_estoque
+    BEGIN
+        DELETE FROM operacao_resumo
+        WHERE operacao_id IN (OLD.operacao_id, NEW.operacao_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_resumo_operacao_estoque_remover
+    AFTER DELETE ON operacao_estoque
+    BEGIN
+        DELETE FROM operacao_resumo WHERE operacao_id = OLD.operacao_id;
+    END
+    """,
+)
+
+SCHEMA_SQL += "".join(f"{ddl.strip()};\n" for ddl in RESUMO_OPERACAO_DDL)
+
+
+# Colunas de tempo derivadas dos timestamps ISO: segundos desde a época em UTC,
+# dia operacional (virada às 05:00 de São Paulo) e, para pagamentos, hora e dia
+# da semana locais (0 = segunda, como `datetime.weekday`). Gatilhos em SQL puro
+# as preenchem em qualquer INSERT; o deslocamento local vem de `fuso_local`,
+# que guarda as transições de horário de verão do tzdata. A fração de segundo é
+# descartada antes da conversão porque o SQLite arredonda milissegundos.
+HORA_VIRADA_DIA_OPERACIONAL = 5
+COLUNAS_TEMPO = {
+    # tabela: (coluna ISO, coluna epoch, colunas locais)
+    "pedidos": ("timestamp_criacao", "criado_epoch", ("dia_operacional",)),
+    "pagamentos": (
+        "ocorrido_em",
+        "ocorrido_epoch",
+        ("dia_operacional", "hora_local", "dia_semana_local"),
+    ),
+    "estoque_movimentacoes": ("created_at", "created_epoch", ("dia_operacional",)),
+}
+
+
+def sql_epoch(coluna: str) -> str:
+    """Expressão SQL com os segundos UTC de uma coluna ISO-8601."""
+    return f"""(
+        CAST(strftime('%s', substr({coluna}, 1, 19)) AS INTEGER)
+        - CASE substr({coluna}, -6, 1) WHEN '+' THEN 1 WHEN '-' THEN -1 ELSE 0 END
+          * (CAST(substr({coluna}, -5, 2) AS INTEGER) * 3600
+             + CAST(substr({coluna}, -2, 2) AS INTEGER) * 60)
+    )"""
+
+
+def sql_epoch_local(epoch: str) -> str:
+    """Expressão SQL que desloca um epoch UTC para o relógio de São Paulo."""
+    return f"""({epoch} + (
+        SELECT deslocamento_segundos FROM fuso_local
+        WHERE inicio_epoch <= {epoch}
+        ORDER BY inicio_epoch DESC LIMIT 1
+    ))"""
+
+
+_SQL_TEMPO_LOCAL = {
+    "dia_operacional": "date({local} - {virada}, 'unixepoch')",
+    "hora_local": "CAST(strftime('%H', {local}, 'unixepoch') AS INTEGER)",
+    "dia_semana_local": (
+        "(CAST(strftime('%w', {local}, 'unixepoch') AS INTEGER) + 6) % 7"
+    ),
+}
+
+
+def sql_tempo_local(nome: str, epoch_local: str) -> str:
+    """`dia_operacional`, `hora_local` ou `dia_semana_local` de um epoch local."""
+    return _SQL_TEMPO_LOCAL[nome].format(
+        local=epoch_local, virada=HORA_VIRADA_DIA_OPERACIONAL * 3600
+    )
+
+
+def _sql_atualizar_tempo(tabela: str, condicao: str) -> list[str]:
+    """Dois UPDATEs: o segundo lê o epoch gravado pelo primeiro."""
+    origem, coluna_epoch, locais = COLUNAS_TEMPO[tabela]
+    local = sql_epoch_local(coluna_epoch)
+    atribuicoes = ",\n".join(
+        f"{coluna} = {sql_tempo_local(coluna, local)}" for coluna in locais
+    )
+    return [
+        f"UPDATE {tabela} SET {coluna_epoch} = {sql_epoch(origem)} WHERE {condicao}",
+        f"UPDATE {tabela} SET {atribuicoes} WHERE {condicao}",
+    ]
+
+
+def _ddl_tempo_local() -> tuple[str, ...]:
+    ddl = [
+        """
+        CREATE TABLE IF NOT EXISTS fuso_local (
+            inicio_epoch INTEGER PRIMARY KEY,
+            deslocamento_segundos INTEGER NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_pedidos_criado_epoch ON pedidos(criado_epoch)",
+        """
+        CREATE INDEX IF NOT EXISTS idx_pagamentos_epoch
+        ON pagamentos(ocorrido_epoch, tipo)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_pagamentos_dia_operacional
+        ON pagamentos(dia_operacional)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_movimentacoes_epoch
+        ON estoque_movimentacoes(created_epoch)
+        """,
+    ]
+    for tabela, (origem, _epoch, _locais) in COLUNAS_TEMPO.items():
+        corpo = "".join(
+            f"{comando};\n" for comando in _sql_atualizar_tempo(tabela, "id = NEW.id")
+        )
+        ddl.append(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_tempo_{tabela}_inserir
+            AFTER INSERT ON {tabela}
+            BEGIN
+            {corpo}END
+            """
+        )
+        ddl.append(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_tempo_{tabela}_atualizar
+            AFTER UPDATE OF {origem} ON {tabela}
+            BEGIN
+            {corpo}END
+            """
+        )
+    return tuple(ddl)
+
+
+TEMPO_LOCAL_DDL = _ddl_tempo_local()
+
+SCHEMA_SQL += "".join(f"{ddl.strip()};\n" for ddl in TEMPO_LOCAL_DDL)
+
+
+@lru_cache(maxsize=1)
+def _transicoes_fuso(
+    inicio_ano: int = 1970, fim_ano: int = 2070
+) -> tuple[tuple[int, int], ...]:
+    """(início em epoch, deslocamento em segundos) a cada mudança do fuso local."""
+    def deslocamento(epoch: int) -> int:
+        instante = datetime.fromtimestamp(epoch, timezone.utc)
+        return int(instante.astimezone(TIMEZONE_LOCAL).utcoffset().total_seconds())
+
+    epoch = int(datetime(inicio_ano, 1, 1, tzinfo=timezone.utc).timestamp())
+    fim = int(datetime(fim_ano, 1, 1, tzinfo=timezone.utc).timestamp())
+    atual = deslocamento(epoch)
+    # A primeira faixa cobre também qualquer instante anterior a `inicio_ano`.
+    transicoes = [(-(2**62), atual)]
+    while epoch < fim:
+        proximo = epoch + 86400
+        if deslocamento(proximo) != atual:
+            baixo, alto = epoch, proximo
+            while alto - baixo > 1:
+                meio = (baixo + alto) // 2
+                if deslocamento(meio) == atual:
+                    baixo = meio
+                else:
+                    alto = meio
+            atual = deslocamento(alto)
+            transicoes.append((alto, atual))
+        epoch = proximo
+    return tuple(transicoes)
+
+
+def preencher_fuso_local(conn: sqlite3.Connection) -> None:
+    """Regrava as transições do fuso a partir do tzdata instalado."""
+    conn.execute("DELETE FROM fuso_local")
+    conn.executemany(
+        "INSERT INTO fuso_local(inicio_epoch, deslocamento_segundos) VALUES (?, ?)",
+        _transicoes_fuso(),
+    )
+
+
+def recalcular_colunas_tempo(conn: sqlite3.Connection) -> None:
+    """Preenche as colunas de tempo de todas as linhas já gravadas."""
+    tabelas = _tabelas(conn)
+    for tabela in COLUNAS_TEMPO:
+        if tabela in tabelas:
+            for comando in _sql_atualizar_tempo(tabela, "1"):
+                conn.execute(comando)
+
 
 def _criar_schema(conn: sqlite3.Connection) -> None:
     conn.executescript(SCHEMA_SQL)
+    if not conn.execute("SELECT 1 FROM fuso_local LIMIT 1").fetchone():
+        preencher_fuso_local(conn)
     colunas_produtos = {
         row["name"] for row in conn.execute("PRAGMA table_info(produtos)")
     }
@@ -317,6 +956,196 @@ def _criar_schema(conn: sqlite3.Connection) -> None:
     conn.commit()
 
 
+def reconstruir_saldos_lotes(conn: sqlite3.Connection) -> int:
+    """Recalcula o saldo derivado de todos os lotes a partir do razão FIFO."""
+    conn.execute("DELETE FROM estoque_lotes_saldo")
+    cursor = conn.execute(
+        """
+        INSERT INTO estoque_lotes_saldo(
+            lote_id, produto_id, custo_unitario_centavos,
+            recebido_em, quantidade_disponivel
+        )
+        SELECT l.id, l.produto_id, l.custo_unitario_centavos, l.recebido_em,
+               l.quantidade_inicial + COALESCE(SUM(m.quantidade), 0)
+        FROM estoque_lotes l
+        LEFT JOIN estoque_movimentacoes m ON m.lote_id = l.id
+        GROUP BY l.id
+        """
+    )
+    return int(cursor.rowcount)
+
+
+def divergencias_saldos_lotes(conn: sqlite3.Connection) -> list[dict]:
+    """Compara o saldo derivado com o razão sem alterar nenhum dado."""
+    rows = conn.execute(
+        """
+        SELECT razao.lote_id, razao.produto_id,
+               razao.quantidade AS esperado,
+               s.quantidade_disponivel AS registrado
+        FROM (
+            SELECT l.id AS lote_id, l.produto_id, l.custo_unitario_centavos,
+                   l.recebido_em,
+                   l.quantidade_inicial + COALESCE(SUM(m.quantidade), 0)
+                       AS quantidade
+            FROM estoque_lotes l
+            LEFT JOIN estoque_movimentacoes m ON m.lote_id = l.id
+            GROUP BY l.id
+        ) razao
+        LEFT JOIN estoque_lotes_saldo s ON s.lote_id = razao.lote_id
+        WHERE s.lote_id IS NULL
+           OR s.quantidade_disponivel <> razao.quantidade
+           OR s.produto_id <> razao.produto_id
+           OR s.custo_unitario_centavos <> razao.custo_unitario_centavos
+           OR s.recebido_em <> razao.recebido_em
+        UNION ALL
+        SELECT s.lote_id, s.produto_id, NULL, s.quantidade_disponivel
+        FROM estoque_lotes_saldo s
+        WHERE NOT EXISTS (SELECT 1 FROM estoque_lotes l WHERE l.id = s.lote_id)
+        ORDER BY 1
+        """
+    ).fetchall()
+    return [
+        {
+            "lote_id": int(row["lote_id"]),
+            "produto_id": int(row["produto_id"]),
+            "esperado": row["esperado"],
+            "registrado": row["registrado"],
+        }
+        for row in rows
+    ]
+
+
+def bucket_resumo_vendas(timestamp: str) -> str:
+    """Início UTC do intervalo de 15 minutos que contém o instante."""
+    instante = datetime.fromisoformat(timestamp).astimezone(timezone.utc)
+    return instante.replace(
+        minute=instante.minute - instante.minute % RESUMO_VENDAS_MINUTOS,
+        second=0,
+        microsecond=0,
+    ).isoformat()
+
+
+def _somar_resumo_vendas(
+    conn: sqlite3.Connection, evento: sqlite3.Row, itens: list[sqlite3.Row]
+) -> None:
+    sinal = 1 if evento["tipo"] == "pagamento" else -1
+    bucket = bucket_resumo_vendas(evento["ocorrido_em"])
+    dia = _dia_operacional(evento["ocorrido_em"])
+    local_id = int(evento["local_id"])
+    unidades = sum(int(item["quantidade"]) for item in itens)
+    conn.execute(
+        """
+        INSERT INTO vendas_resumo_periodo(
+            bucket_inicio, dia_operacional, local_id, metodo,
+            pagamentos, estornos, valor_pago_centavos, valor_estornado_centavos,
+            taxa_centavos, custo_centavos, unidades_pagas, unidades_liquidas
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(bucket_inicio, local_id, metodo) DO UPDATE SET
+            pagamentos = pagamentos + excluded.pagamentos,
+            estornos = estornos + excluded.estornos,
+            valor_pago_centavos = valor_pago_centavos + excluded.valor_pago_centavos,
+            valor_estornado_centavos =
+                valor_estornado_centavos + excluded.valor_estornado_centavos,
+            taxa_centavos = taxa_centavos + excluded.taxa_centavos,
+            custo_centavos = custo_centavos + excluded.custo_centavos,
+            unidades_pagas = unidades_pagas + excluded.unidades_pagas,
+            unidades_liquidas = unidades_liquidas + excluded.unidades_liquidas
+        """,
+        (
+            bucket,
+            dia,
+            local_id,
+            evento["metodo"],
+            1 if sinal > 0 else 0,
+            0 if sinal > 0 else 1,
+            int(evento["valor_centavos"]) if sinal > 0 else 0,
+            0 if sinal > 0 else int(evento["valor_centavos"]),
+            sinal * int(evento["taxa_centavos"]),
+            sinal * sum(int(item["custo_total_centavos"]) for item in itens),
+            unidades if sinal > 0 else 0,
+            sinal * unidades,
+        ),
+    )
+    conn.executemany(
+        """
+        INSERT INTO vendas_resumo_produto(
+            bucket_inicio, dia_operacional, local_id, produto_id,
+            nome_produto, categoria_nome, quantidade,
+            receita_centavos, custo_centavos
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(bucket_inicio, local_id, produto_id) DO UPDATE SET
+            quantidade = quantidade + excluded.quantidade,
+            receita_centavos = receita_centavos + excluded.receita_centavos,
+            custo_centavos = custo_centavos + excluded.custo_centavos
+        """,
+        [
+            (
+                bucket,
+                dia,
+                local_id,
+                int(item["produto_id"]),
+                item["nome_produto"],
+                item["categoria_nome"],
+                sinal * int(item["quantidade"]),
+                sinal
+                * int(item["preco_unitario_centavos"])
+                * int(item["quantidade"]),
+                sinal * int(item["custo_total_centavos"]),
+            )
+            for item in itens
+        ],
+    )
+
+
+_CONSULTA_EVENTO_RESUMO = """
+    SELECT pg.id, pg.pedido_id, pg.tipo, pg.metodo, pg.valor_centavos,
+           pg.taxa_centavos, pg.ocorrido_em, o.local_id
+    FROM pagamentos pg
+    JOIN pedidos o ON o.id = pg.pedido_id
+"""
+
+_CONSULTA_ITENS_RESUMO = """
+    SELECT pedido_id, produto_id, nome_produto, categoria_nome, quantidade,
+           preco_unitario_centavos, custo_total_centavos
+    FROM pedido_itens
+"""
+
+
+def acumular_resumo_vendas(conn: sqlite3.Connection, pagamento_id: int) -> None:
+    """Soma um pagamento ou estorno aos resumos dentro da transação do chamador."""
+    evento = conn.execute(
+        f"{_CONSULTA_EVENTO_RESUMO} WHERE pg.id = ?", (pagamento_id,)
+    ).fetchone()
+    if not evento:
+        return
+    itens = conn.execute(
+        f"{_CONSULTA_ITENS_RESUMO} WHERE pedido_id = ? "
+        "ORDER BY categoria_ordem, produto_ordem, id",
+        (evento["pedido_id"],),
+    ).fetchall()
+    _somar_resumo_vendas(conn, evento, itens)
+
+
+def reconstruir_resumos_vendas(conn: sqlite3.Connection) -> int:
+    """Refaz os resumos de venda a partir de todos os pagamentos e estornos."""
+    conn.execute("DELETE FROM vendas_resumo_periodo")
+    conn.execute("DELETE FROM vendas_resumo_produto")
+    itens_por_pedido: dict[int, list[sqlite3.Row]] = {}
+    for item in conn.execute(
+        f"{_CONSULTA_ITENS_RESUMO} "
+        "ORDER BY pedido_id, categoria_ordem, produto_ordem, id"
+    ):
+        itens_por_pedido.setdefault(int(item["pedido_id"]), []).append(item)
+    eventos = conn.execute(
+        f"{_CONSULTA_EVENTO_RESUMO} ORDER BY pg.ocorrido_em, pg.id"
+    ).fetchall()
+    for evento in eventos:
+        _somar_resumo_vendas(
+            conn, evento, itens_por_pedido.get(int(evento["pedido_id"]), [])
+        )
+    return len(eventos)
+
+
 def _tabelas(conn: sqlite3.Connection) -> set[str]:
     return {
         row["name"]
@@ -773,6 +1602,208 @@ def migrar_v4_para_v5(db_path: str | os.PathLike[str] | None = None) -> Path:
     return backup
 
 
+def migrar_v5_para_v6(db_path: str | os.PathLike[str] | None = None) -> Path:
+    """Materializa o saldo por lote sem alterar o razão FIFO."""
+    path = Path(db_path or caminho_banco()).resolve()
+    backup = _backup_path(path, "pre-v6")
+    _criar_backup_sqlite(path, backup)
+
+    conn = conectar(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        tabelas = _tabelas(conn)
+        colunas_movimento = (
+            {
+                row["name"]
+                for row in conn.execute("PRAGMA table_info(estoque_movimentacoes)")
+            }
+            if "estoque_movimentacoes" in tabelas
+            else set()
+        )
+        if "estoque_lotes" in tabelas and "lote_id" in colunas_movimento:
+            for ddl in SALDO_LOTES_DDL:
+                conn.execute(ddl)
+            reconstruir_saldos_lotes(conn)
+        else:
+            conn.execute(SALDO_LOTES_DDL[0])
+        conn.execute(
+            "INSERT OR REPLACE INTO schema_version(version, applied_at) VALUES (?, ?)",
+            (6, datetime.now(timezone.utc).isoformat()),
+        )
+        if conn.execute("PRAGMA foreign_key_check").fetchone():
+            raise sqlite3.IntegrityError(
+                "A migração de saldos por lote criou referências inválidas"
+            )
+        if conn.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+            raise sqlite3.IntegrityError(
+                "Falha de integridade após materializar os saldos por lote"
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return backup
+
+
+def migrar_v6_para_v7(db_path: str | os.PathLike[str] | None = None) -> Path:
+    """Cria os resumos de venda por intervalo e os preenche com o histórico."""
+    path = Path(db_path or caminho_banco()).resolve()
+    backup = _backup_path(path, "pre-v7")
+    _criar_backup_sqlite(path, backup)
+
+    conn = conectar(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for ddl in RESUMO_VENDAS_DDL:
+            conn.execute(ddl)
+        if {"pagamentos", "pedidos", "pedido_itens"} <= _tabelas(conn):
+            reconstruir_resumos_vendas(conn)
+        conn.execute(
+            "INSERT OR REPLACE INTO schema_version(version, applied_at) VALUES (?, ?)",
+            (7, datetime.now(timezone.utc).isoformat()),
+        )
+        if conn.execute("PRAGMA foreign_key_check").fetchone():
+            raise sqlite3.IntegrityError(
+                "A migração dos resumos de venda criou referências inválidas"
+            )
+        if conn.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+            raise sqlite3.IntegrityError(
+                "Falha de integridade após preencher os resumos de venda"
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return backup
+
+
+def migrar_v7_para_v8(db_path: str | os.PathLike[str] | None = None) -> Path:
+    """
+    Cria os resumos gravados de visitas. O histórico é resumido em
+    `migrar_v8_para_v9`, depois das colunas de tempo que o cálculo usa.
+    """
+    path = Path(db_path or caminho_banco()).resolve()
+    backup = _backup_path(path, "pre-v8")
+    _criar_backup_sqlite(path, backup)
+
+    conn = conectar(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        origens = {"pagamentos", "pedidos", "operacoes", "operacao_estoque"}
+        if origens <= _tabelas(conn):
+            for ddl in RESUMO_OPERACAO_DDL:
+                conn.execute(ddl)
+        else:
+            for ddl in RESUMO_OPERACAO_DDL[:3]:
+                conn.execute(ddl)
+        conn.execute(
+            "INSERT OR REPLACE INTO schema_version(version, applied_at) VALUES (?, ?)",
+            (8, datetime.now(timezone.utc).isoformat()),
+        )
+        if conn.execute("PRAGMA foreign_key_check").fetchone():
+            raise sqlite3.IntegrityError(
+                "A migração dos resumos de visita criou referências inválidas"
+            )
+        if conn.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+            raise sqlite3.IntegrityError(
+                "Falha de integridade após criar os resumos de visita"
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return backup
+
+
+# Tabelas lidas pelo cálculo do resumo de uma visita.
+TABELAS_RESUMO_OPERACAO = {
+    "operacoes",
+    "operacao_estoque",
+    "operacao_resumo",
+    "pedidos",
+    "pedido_itens",
+    "produtos",
+    "estoque_lotes",
+    "estoque_lotes_saldo",
+}
+
+
+def preencher_resumos_operacoes(conn: sqlite3.Connection) -> int:
+    """Grava, na transação de `conn`, o resumo das visitas encerradas sem um."""
+    import analytics
+
+    ids = [
+        int(row[0])
+        for row in conn.execute(
+            """
+            SELECT o.id
+            FROM operacoes o
+            LEFT JOIN operacao_resumo r ON r.operacao_id = o.id
+            WHERE o.status = 'encerrada' AND r.operacao_id IS NULL
+            ORDER BY o.id
+            """
+        )
+    ]
+    analytics.gravar_resumos_visitas(conn, ids)
+    return len(ids)
+
+
+def migrar_v8_para_v9(db_path: str | os.PathLike[str] | None = None) -> Path:
+    """
+    Acrescenta as colunas de tempo derivadas e as preenche com o histórico.
+    Com elas prontas, grava o resumo de toda visita encerrada que ainda não
+    tem um.
+    """
+    path = Path(db_path or caminho_banco()).resolve()
+    backup = _backup_path(path, "pre-v9")
+    _criar_backup_sqlite(path, backup)
+
+    conn = conectar(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        tabelas = _tabelas(conn)
+        for tabela, (_origem, coluna_epoch, locais) in COLUNAS_TEMPO.items():
+            if tabela not in tabelas:
+                continue
+            _adicionar_coluna_se_ausente(conn, tabela, coluna_epoch, "INTEGER")
+            for coluna in locais:
+                tipo = "TEXT" if coluna == "dia_operacional" else "INTEGER"
+                _adicionar_coluna_se_ausente(conn, tabela, coluna, tipo)
+        conn.execute(TEMPO_LOCAL_DDL[0])
+        preencher_fuso_local(conn)
+        if set(COLUNAS_TEMPO) <= tabelas:
+            for ddl in TEMPO_LOCAL_DDL[1:]:
+                conn.execute(ddl)
+        recalcular_colunas_tempo(conn)
+        if TABELAS_RESUMO_OPERACAO | set(COLUNAS_TEMPO) <= tabelas:
+            preencher_resumos_operacoes(conn)
+        conn.execute(
+            "INSERT OR REPLACE INTO schema_version(version, applied_at) VALUES (?, ?)",
+            (9, datetime.now(timezone.utc).isoformat()),
+        )
+        if conn.execute("PRAGMA foreign_key_check").fetchone():
+            raise sqlite3.IntegrityError(
+                "A migração das colunas de tempo criou referências inválidas"
+            )
+        if conn.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+            raise sqlite3.IntegrityError(
+                "Falha de integridade após preencher as colunas de tempo"
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return backup
+
+
 def _extrair_legado(conn: sqlite3.Connection) -> dict:
     """Extrai apenas cadastros e saldo operacional; pedidos antigos não migram."""
     tabelas = _tabelas(conn)
@@ -938,6 +1969,8 @@ def migrar_banco_legado(db_path: str | os.PathLike[str] | None = None) -> Path:
 
 
 def inicializar_banco(db_path: str | os.PathLike[str] | None = None) -> None:
+    # Migrações podem substituir o arquivo; nenhuma conexão antiga é reaproveitada.
+    drenar_pool()
     path = Path(db_path or caminho_banco())
     if not path.exists() and db_path is None:
         embutido = _banco_embutido()
@@ -961,6 +1994,18 @@ def inicializar_banco(db_path: str | os.PathLike[str] | None = None) -> None:
             if versao == 4:
                 migrar_v4_para_v5(path)
                 continue
+            if versao == 5:
+                migrar_v5_para_v6(path)
+                continue
+            if versao == 6:
+                migrar_v6_para_v7(path)
+                continue
+            if versao == 7:
+                migrar_v7_para_v8(path)
+                continue
+            if versao == 8:
+                migrar_v8_para_v9(path)
+                continue
             if versao != SCHEMA_VERSION:
                 migrar_banco_legado(path)
             return
@@ -0,0 +1,192 @@
+"""Exportações brutas em CSV ou NDJSON, lidas e escritas aos poucos."""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+import math
+import zlib
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timezone
+
+import database
+
+FORMATOS = ("csv", "ndjson")
+# Linhas lidas por `fetchmany`; cada lote vira um pedaço da resposta.
+LINHAS_POR_LOTE = 500
+
+
+# Cada consulta ordena exatamente pela chave do índice que percorre o período,
+# para que o SQLite entregue as linhas na ordem sem montar uma B-tree
+# temporária com o período inteiro. O `+` na frente de uma coluna impede que o
+# planejador troque esse índice por outro (o do local ou o do tipo) e volte a
+# ordenar tudo antes da primeira linha.
+
+
+def _filtro_local(coluna: str, local_id) -> tuple[str, list]:
+    if local_id in ("todos", None):
+        return "", []
+    return f" AND +{coluna} = ?", [int(local_id)]
+
+
+def _consulta_pagamentos(inicio, fim, local_id):
+    filtro, params = _filtro_local("o.local_id", local_id)
+    return (
+        f"""
+        SELECT pg.id AS pagamento_id, pg.tipo, pg.metodo, pg.valor_centavos,
+               pg.taxa_centavos, pg.ocorrido_em, o.id AS pedido_id,
+               o.senha_diaria, o.nome_cliente, o.modalidade, o.status,
+               o.valor_total_centavos AS pedido_valor_centavos,
+               o.timestamp_criacao AS pedido_criado_em, o.local_id,
+               l.nome AS local_nome, o.operacao_id
+        FROM pagamentos pg
+        JOIN pedidos o ON o.id = pg.pedido_id
+        JOIN locais l ON l.id = o.local_id
+        WHERE pg.ocorrido_em >= ? AND pg.ocorrido_em < ?{filtro}
+        ORDER BY pg.ocorrido_em, pg.tipo, pg.id
+        """,
+        [inicio, fim, *params],
+    )
+
+
+def _consulta_itens(inicio, fim, local_id):
+    filtro, params = _filtro_local("o.local_id", local_id)
+    return (
+        f"""
+        SELECT pi.id AS item_id, pi.pedido_id, pg.ocorrido_em AS pago_em,
+               est.ocorrido_em AS estornado_em, o.local_id,
+               l.nome AS local_nome, pi.produto_id, pi.nome_produto,
+               pi.categoria_nome, pi.quantidade, pi.preco_unitario_centavos,
+               pi.custo_unitario_centavos, pi.custo_total_centavos
+        FROM pagamentos pg
+        JOIN pedidos o ON o.id = pg.pedido_id
+        JOIN locais l ON l.id = o.local_id
+        JOIN pedido_itens pi ON pi.pedido_id = o.id
+        LEFT JOIN pagamentos est
+            ON est.pedido_id = o.id AND est.tipo = 'estorno'
+        WHERE +pg.tipo = 'pagamento'
+          AND pg.ocorrido_em >= ? AND pg.ocorrido_em < ?{filtro}
+        ORDER BY pg.ocorrido_em, pg.tipo, pg.id, pi.id
+        """,
+        [inicio, fim, *params],
+    )
+
+
+def _instante_utc(instante) -> str:
+    """
+    Converte um limite do período para ISO em UTC, o formato gravado no banco.
+    Um horário sem fuso é lido como UTC; sem isso, `created_epoch` seguiria o
+    fuso da máquina e discordaria do limite em texto.
+    """
+    try:
+        horario = datetime.fromisoformat(str(instante))
+    except ValueError:
+        raise ValueError(f"Horário inválido: {instante}.") from None
+    if horario.tzinfo is None:
+        horario = horario.replace(tzinfo=timezone.utc)
+    return horario.astimezone(timezone.utc).isoformat()
+
+
+def _segundo(instante: str) -> int:
+    return math.floor(datetime.fromisoformat(instante).timestamp())
+
+
+def _consulta_estoque(inicio, fim, local_id):
+    filtro, params = _filtro_local("o.local_id", local_id)
+    # `created_epoch` delimita o período pelo índice; `created_at` mantém os
+    # limites exatos dentro do primeiro e do último segundo.
+    return (
+        f"""
+        SELECT m.id AS movimentacao_id, m.created_at, m.tipo, m.produto_id,
+               p.nome AS produto_nome, m.quantidade, m.custo_unitario_centavos,
+               m.impacta_relatorio, m.pedido_id, m.pedido_item_id,
+               o.local_id, m.lote_id, lt.tipo AS lote_tipo,
+               lt.recebido_em AS lote_recebido_em,
+               lt.quantidade_inicial AS lote_quantidade_inicial,
+               lt.custo_unitario_centavos AS lote_custo_unitario_centavos,
+               m.movimento_origem_id, m.observacao
+        FROM estoque_movimentacoes m
+        JOIN produtos p ON p.id = m.produto_id
+        LEFT JOIN pedidos o ON o.id = m.pedido_id
+        LEFT JOIN estoque_lotes lt ON lt.id = m.lote_id
+        WHERE m.created_epoch >= ? AND m.created_epoch <= ?
+          AND m.created_at >= ? AND m.created_at < ?{filtro}
+        ORDER BY m.created_epoch, m.id
+        """,
+        [_segundo(inicio), _segundo(fim), inicio, fim, *params],
+    )
+
+
+# Com filtro de local, o ledger de estoque traz só movimentos ligados a pedidos
+# daquele local: compras, perdas e ajustes não pertencem a um ponto de venda.
+EXPORTACOES = {
+    "pagamentos": _consulta_pagamentos,
+    "itens": _consulta_itens,
+    "estoque": _consulta_estoque,
+}
+
+
+def _lotes(query: str, params: list) -> Iterator[list]:
+    """Produz primeiro os nomes das colunas e depois lotes de linhas."""
+    conn = database.conectar(pragmas=database.PRAGMAS_EXPORTACAO)
+    try:
+        cursor = conn.execute(query, params)
+        yield [descricao[0] for descricao in cursor.description]
+        while True:
+            linhas = cursor.fetchmany(LINHAS_POR_LOTE)
+            if not linhas:
+                break
+            yield linhas
+    finally:
+        conn.close()
+
+
+def _csv(query: str, params: list) -> Iterator[str]:
+    lotes = _lotes(query, params)
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, lineterminator="\n")
+    escritor.writerow(next(lotes))
+    yield buffer.getvalue()
+    for linhas in lotes:
+        buffer.seek(0)
+        buffer.truncate()
+        escritor.writerows(linhas)
+        yield buffer.getvalue()
+
+
+def _ndjson(query: str, params: list) -> Iterator[str]:
+    lotes = _lotes(query, params)
+    colunas = next(lotes)
+    for linhas in lotes:
+        yield "".join(
+            json.dumps(dict(zip(colunas, linha)), ensure_ascii=False) + "\n"
+            for linha in linhas
+        )
+
+
+def exportar(tipo, formato, inicio, fim, local_id="todos") -> Iterator[str]:
+    """
+    Valida o pedido e devolve um gerador com o conteúdo em pedaços. Cada pedaço
+    corresponde a um lote de `LINHAS_POR_LOTE` linhas, então a memória usada
+    não depende do tamanho do período. Os limites sem fuso valem como UTC.
+    Levanta ValueError antes de abrir a conexão se o tipo, o formato, os
+    limites ou o local forem inválidos.
+    """
+    if tipo not in EXPORTACOES:
+        raise ValueError(f"Exportação desconhecida: {tipo}.")
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato inválido: {formato}. Use csv ou ndjson.")
+    inicio, fim = _instante_utc(inicio), _instante_utc(fim)
+    query, params = EXPORTACOES[tipo](inicio, fim, local_id)
+    return _csv(query, params) if formato == "csv" else _ndjson(query, params)
+
+
+def comprimir_gzip(partes: Iterable[str]) -> Iterator[bytes]:
+    """Comprime os pedaços em gzip conforme chegam, sem juntar o conteúdo."""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for parte in partes:
+        comprimido = compressor.compress(parte.encode("utf-8"))
+        if comprimido:
+            yield comprimido
+    yield compressor.flush()
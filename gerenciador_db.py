@@ -1,4 +1,4 @@
-"""Operações transacionais do PDV sobre o esquema canônico v5 com FIFO."""
+"""Operações transacionais do PDV sobre o esquema canônico v9 com FIFO."""
 
 from __future__ import annotations
 
@@ -18,10 +18,16 @@ NOME_BANCO_DADOS = database.NOME_BANCO_DADOS
 TIMEZONE_LOCAL = ZoneInfo("America/Sao_Paulo")
 METODOS_PAGAMENTO = {"pix", "cartao_credito", "cartao_debito", "dinheiro"}
 MODALIDADES = {"local", "viagem"}
+STATUS_PEDIDOS_ATIVOS = (
+    "aguardando_pagamento",
+    "aguardando_producao",
+    "em_producao",
+    "aguardando_retirada",
+)
 
 
 def _conectar() -> sqlite3.Connection:
-    return database.conectar()
+    return database.obter_conexao()
 
 
 @contextmanager
@@ -34,6 +40,28 @@ def _conexao():
         conn.close()
 
 
+def _gravar_resumo_visita(conn, operacao_id) -> None:
+    """
+    Regrava o resumo de uma visita encerrada na transação em curso, para que
+    os relatórios só leiam. Não faz nada se a visita estiver aberta.
+    """
+    if operacao_id is None:
+        return
+    import analytics
+
+    analytics.gravar_resumos_visitas(conn, [operacao_id])
+
+
+def _cadastro_alterado() -> None:
+    """
+    Descarta os relatórios em cache. Nomes, categorias, preços e ordem do
+    cadastro não mudam a versão barata de `analytics._versao_dados`.
+    """
+    import analytics
+
+    analytics.cache_analitico.limpar()
+
+
 def _agora() -> str:
     return datetime.now(timezone.utc).isoformat()
 
@@ -57,16 +85,10 @@ def _limpar_reservas(cursor: sqlite3.Cursor) -> None:
 def _saldo_produto(cursor: sqlite3.Cursor, produto_id: int) -> int:
     return int(
         cursor.execute(
-            """
-            SELECT COALESCE(SUM(
-                l.quantidade_inicial + COALESCE((
-                    SELECT SUM(m.quantidade)
-                    FROM estoque_movimentacoes m
-                    WHERE m.lote_id = l.id
-                ), 0)
-            ), 0)
-            FROM estoque_lotes l
-            WHERE l.produto_id = ?
+            f"""
+            SELECT COALESCE(SUM(quantidade_disponivel), 0)
+            FROM estoque_lotes_saldo
+            WHERE produto_id = ? AND {database.SALDO_LOTE_NAO_ZERO}
             """,
             (produto_id,),
         ).fetchone()[0]
@@ -112,19 +134,13 @@ def _fotografar_estoque_operacao(
 
 def _custo_medio_centavos(cursor: sqlite3.Cursor, produto_id: int) -> int:
     row = cursor.execute(
-        """
-        SELECT COALESCE(SUM(disponivel), 0) AS quantidade,
-               COALESCE(SUM(disponivel * custo_unitario_centavos), 0) AS valor
-        FROM (
-            SELECT l.custo_unitario_centavos,
-                   l.quantidade_inicial + COALESCE((
-                       SELECT SUM(m.quantidade)
-                       FROM estoque_movimentacoes m
-                       WHERE m.lote_id = l.id
-                   ), 0) AS disponivel
-            FROM estoque_lotes l
-            WHERE l.produto_id = ?
-        )
+        f"""
+        SELECT COALESCE(SUM(quantidade_disponivel), 0) AS quantidade,
+               COALESCE(SUM(
+                   quantidade_disponivel * custo_unitario_centavos
+               ), 0) AS valor
+        FROM estoque_lotes_saldo
+        WHERE produto_id = ? AND {database.SALDO_LOTE_NAO_ZERO}
         """,
         (produto_id,),
     ).fetchone()
@@ -180,25 +196,130 @@ def _lotes_fifo_disponiveis(
     produto_id: int,
 ) -> list[sqlite3.Row]:
     return cursor.execute(
-        """
-        SELECT *
-        FROM (
-            SELECT l.*,
-                   l.quantidade_inicial + COALESCE((
-                       SELECT SUM(m.quantidade)
-                       FROM estoque_movimentacoes m
-                       WHERE m.lote_id = l.id
-                   ), 0) AS disponivel
-            FROM estoque_lotes l
-            WHERE l.produto_id = ?
-        )
-        WHERE disponivel > 0
-        ORDER BY recebido_em, id
+        f"""
+        SELECT l.*, s.quantidade_disponivel AS disponivel
+        FROM estoque_lotes_saldo s
+        JOIN estoque_lotes l ON l.id = s.lote_id
+        WHERE s.produto_id = ?
+          AND {database.SALDO_LOTE_POSITIVO}
+        ORDER BY s.recebido_em, s.lote_id
         """,
         (produto_id,),
     ).fetchall()
 
 
+SQL_INSERIR_MOVIMENTACAO = """
+    INSERT INTO estoque_movimentacoes(
+        produto_id, pedido_id, pedido_item_id, lote_id,
+        tipo, quantidade, custo_unitario_centavos,
+        impacta_relatorio, observacao, created_at
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Limite de parâmetros por instrução em builds antigos do SQLite.
+MAXIMO_PARAMETROS_SQL = 999
+
+
+def _inserir_retornando_ids(
+    cursor: sqlite3.Cursor, sql: str, linhas: list[tuple]
+) -> list[int]:
+    """
+    Grava `linhas` com o INSERT de uma linha `sql`, repetindo a tupla de
+    `VALUES` num único INSERT por lote, e devolve os ids na ordem das linhas.
+    O SQLite não garante a ordem do RETURNING, mas ids AUTOINCREMENT só crescem
+    dentro da instrução, então ordená-los reproduz a ordem das tuplas.
+    """
+    if not linhas:
+        return []
+    prefixo, tupla = sql.rstrip().rsplit("VALUES", 1)
+    tupla = tupla.strip()
+    por_lote = max(MAXIMO_PARAMETROS_SQL // len(linhas[0]), 1)
+    ids = []
+    for inicio in range(0, len(linhas), por_lote):
+        lote = linhas[inicio:inicio + por_lote]
+        cursor.execute(
+            f"{prefixo} VALUES {', '.join([tupla] * len(lote))} RETURNING id",
+            [valor for linha in lote for valor in linha],
+        )
+        ids.extend(sorted(int(row[0]) for row in cursor.fetchall()))
+    return ids
+
+
+def _planejar_fifo_produtos(
+    cursor: sqlite3.Cursor,
+    quantidades: dict[int, int],
+) -> dict[int, list[tuple[int, int, int]]]:
+    """Seleciona em uma consulta apenas os lotes PEPS necessários às saídas."""
+    if not quantidades:
+        return {}
+    valores = ",".join("(?, ?)" for _ in quantidades)
+    lotes = cursor.execute(
+        f"""
+        WITH saida(produto_id, quantidade) AS (VALUES {valores})
+        SELECT lote.produto_id, lote.lote_id, lote.custo_unitario_centavos,
+               MIN(
+                   lote.disponivel, saida.quantidade - lote.acumulado_anterior
+               ) AS retirada
+        FROM (
+            SELECT produto_id, lote_id, recebido_em, custo_unitario_centavos,
+                   quantidade_disponivel AS disponivel,
+                   SUM(quantidade_disponivel) OVER (
+                       PARTITION BY produto_id
+                       ORDER BY recebido_em, lote_id
+                   ) - quantidade_disponivel AS acumulado_anterior
+            FROM estoque_lotes_saldo
+            WHERE produto_id IN (SELECT produto_id FROM saida)
+              AND {database.SALDO_LOTE_POSITIVO}
+        ) lote
+        JOIN saida ON saida.produto_id = lote.produto_id
+        WHERE lote.acumulado_anterior < saida.quantidade
+        ORDER BY lote.produto_id, lote.recebido_em, lote.lote_id
+        """,
+        [valor for item in quantidades.items() for valor in item],
+    ).fetchall()
+    parcelas: dict[int, list[tuple[int, int, int]]] = {
+        int(produto_id): [] for produto_id in quantidades
+    }
+    for lote in lotes:
+        parcelas[int(lote["produto_id"])].append(
+            (
+                int(lote["lote_id"]),
+                int(lote["retirada"]),
+                int(lote["custo_unitario_centavos"]),
+            )
+        )
+    for produto_id, quantidade in quantidades.items():
+        if sum(retirada for _, retirada, _ in parcelas[int(produto_id)]) < quantidade:
+            raise ValueError("Estoque insuficiente para a saída FIFO")
+    return parcelas
+
+
+def _planejar_fifo(
+    cursor: sqlite3.Cursor,
+    produto_id: int,
+    quantidade: int,
+) -> list[tuple[int, int, int]]:
+    return _planejar_fifo_produtos(cursor, {produto_id: quantidade})[produto_id]
+
+
+def _dividir_parcelas(
+    parcelas: list[tuple[int, int, int]],
+    quantidade: int,
+) -> list[tuple[int, int, int]]:
+    """Retira do início da fila PEPS planejada as parcelas de um item."""
+    retiradas = []
+    while quantidade > 0:
+        lote_id, disponivel, custo = parcelas[0]
+        retirada = min(disponivel, quantidade)
+        retiradas.append((lote_id, retirada, custo))
+        quantidade -= retirada
+        if retirada == disponivel:
+            parcelas.pop(0)
+        else:
+            parcelas[0] = (lote_id, disponivel - retirada, custo)
+    return retiradas
+
+
 def _consumir_fifo(
     cursor: sqlite3.Cursor,
     produto_id: int,
@@ -215,46 +336,32 @@ def _consumir_fifo(
     quantidade = int(quantidade)
     if quantidade <= 0 or tipo not in {"venda", "perda", "ajuste"}:
         raise ValueError("Saída FIFO inválida")
-    restante = quantidade
-    custo_total = 0
-    movimentos = []
+    parcelas = _planejar_fifo(cursor, produto_id, quantidade)
     agora = ocorrido_em or _agora()
-
-    for lote in _lotes_fifo_disponiveis(cursor, produto_id):
-        if restante <= 0:
-            break
-        retirada = min(restante, int(lote["disponivel"]))
-        custo = int(lote["custo_unitario_centavos"])
-        cursor.execute(
-            """
-            INSERT INTO estoque_movimentacoes(
-                produto_id, pedido_id, pedido_item_id, lote_id,
-                tipo, quantidade, custo_unitario_centavos,
-                impacta_relatorio, observacao, created_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
+    movimentos = _inserir_retornando_ids(
+        cursor,
+        SQL_INSERIR_MOVIMENTACAO,
+        [
             (
                 produto_id,
                 pedido_id,
                 pedido_item_id,
-                lote["id"],
+                lote_id,
                 tipo,
                 -retirada,
                 custo,
                 1 if impacta_relatorio else 0,
                 observacao,
                 agora,
-            ),
-        )
-        movimentos.append(int(cursor.lastrowid))
-        custo_total += retirada * custo
-        restante -= retirada
-
-    if restante:
-        raise ValueError("Estoque insuficiente para a saída FIFO")
+            )
+            for lote_id, retirada, custo in parcelas
+        ],
+    )
     return {
         "quantidade": quantidade,
-        "custo_total_centavos": custo_total,
+        "custo_total_centavos": sum(
+            retirada * custo for _, retirada, custo in parcelas
+        ),
         "movimentos": movimentos,
     }
 
@@ -331,6 +438,7 @@ def adicionar_nova_categoria(nome_categoria):
     try:
         with _conexao() as conn:
             conn.execute("INSERT INTO categorias(nome) VALUES (?)", (nome,))
+        _cadastro_alterado()
         return True
     except sqlite3.IntegrityError:
         return False
@@ -348,6 +456,7 @@ def excluir_categoria(id_categoria):
     try:
         with _conexao() as conn:
             cursor = conn.execute("DELETE FROM categorias WHERE id = ?", (id_categoria,))
+        _cadastro_alterado()
         return cursor.rowcount > 0
     except sqlite3.IntegrityError:
         return False
@@ -401,6 +510,7 @@ def adicionar_novo_produto(
                     tipo="saldo_inicial",
                     observacao="Estoque inicial na criação do produto",
                 )
+        _cadastro_alterado()
         return int(produto_id)
     except (sqlite3.Error, ValueError, TypeError):
         return False
@@ -413,63 +523,35 @@ def _consulta_produtos_base(apenas_disponiveis: bool) -> tuple[str, list]:
         SELECT *
         FROM (
             SELECT p.*, c.nome AS categoria_nome, c.ordem AS categoria_ordem,
-                   COALESCE((
-                       SELECT SUM(
-                           l.quantidade_inicial + COALESCE((
-                               SELECT SUM(m.quantidade)
-                               FROM estoque_movimentacoes m
-                               WHERE m.lote_id = l.id
-                           ), 0)
-                       )
-                       FROM estoque_lotes l
-                       WHERE l.produto_id = p.id
-                   ), 0) AS saldo,
+                   COALESCE(s.saldo, 0) AS saldo,
                    COALESCE((
                        SELECT SUM(r.quantidade_reservada)
                        FROM reservas_carrinho r
                        WHERE r.produto_id = p.id AND r.expires_at > ?
                    ), 0) AS reservado,
-                   COALESCE((
-                       SELECT SUM(
-                           (
-                               l.quantidade_inicial + COALESCE((
-                                   SELECT SUM(m.quantidade)
-                                   FROM estoque_movimentacoes m
-                                   WHERE m.lote_id = l.id
-                               ), 0)
-                           ) * l.custo_unitario_centavos
-                       )
-                       FROM estoque_lotes l
-                       WHERE l.produto_id = p.id
-                   ), 0) AS valor_estoque,
+                   COALESCE(s.valor_estoque, 0) AS valor_estoque,
                    (
-                       SELECT l.custo_unitario_centavos
-                       FROM estoque_lotes l
-                       WHERE l.produto_id = p.id
-                         AND (
-                             l.quantidade_inicial + COALESCE((
-                                 SELECT SUM(m.quantidade)
-                                 FROM estoque_movimentacoes m
-                                 WHERE m.lote_id = l.id
-                             ), 0)
-                         ) > 0
-                       ORDER BY l.recebido_em, l.id
+                       SELECT ls.custo_unitario_centavos
+                       FROM estoque_lotes_saldo ls
+                       WHERE ls.produto_id = p.id
+                         AND {database.SALDO_LOTE_POSITIVO}
+                       ORDER BY ls.recebido_em, ls.lote_id
                        LIMIT 1
                    ) AS proximo_custo,
-                   (
-                       SELECT COUNT(*)
-                       FROM estoque_lotes l
-                       WHERE l.produto_id = p.id
-                         AND (
-                             l.quantidade_inicial + COALESCE((
-                                 SELECT SUM(m.quantidade)
-                                 FROM estoque_movimentacoes m
-                                 WHERE m.lote_id = l.id
-                             ), 0)
-                         ) > 0
-                   ) AS lotes_ativos
+                   COALESCE(s.lotes_ativos, 0) AS lotes_ativos
             FROM produtos p
             LEFT JOIN categorias c ON c.id = p.categoria_id
+            LEFT JOIN (
+                SELECT produto_id,
+                       SUM(quantidade_disponivel) AS saldo,
+                       SUM(
+                           quantidade_disponivel * custo_unitario_centavos
+                       ) AS valor_estoque,
+                       SUM(quantidade_disponivel > 0) AS lotes_ativos
+                FROM estoque_lotes_saldo
+                WHERE {database.SALDO_LOTE_NAO_ZERO}
+                GROUP BY produto_id
+            ) s ON s.produto_id = p.id
             WHERE p.ativo = 1
         )
         {filtro}
@@ -566,6 +648,7 @@ def excluir_produto(id_produto):
     """Produtos com histórico são arquivados, nunca removidos fisicamente."""
     with _conexao() as conn:
         cursor = conn.execute("UPDATE produtos SET ativo = 0 WHERE id = ?", (id_produto,))
+    _cadastro_alterado()
     return cursor.rowcount > 0
 
 
@@ -816,20 +899,14 @@ def obter_lotes_produto(id_produto):
     with _conexao() as conn:
         rows = conn.execute(
             """
-            SELECT *
-            FROM (
-                SELECT l.id, l.quantidade_inicial,
-                       l.custo_unitario_centavos, l.tipo,
-                       l.observacao, l.recebido_em,
-                       l.quantidade_inicial + COALESCE((
-                           SELECT SUM(m.quantidade)
-                           FROM estoque_movimentacoes m
-                           WHERE m.lote_id = l.id
-                       ), 0) AS quantidade_disponivel
-                FROM estoque_lotes l
-                WHERE l.produto_id = ?
-            )
-            ORDER BY recebido_em, id
+            SELECT l.id, l.quantidade_inicial,
+                   l.custo_unitario_centavos, l.tipo,
+                   l.observacao, l.recebido_em,
+                   s.quantidade_disponivel
+            FROM estoque_lotes l
+            JOIN estoque_lotes_saldo s ON s.lote_id = l.id
+            WHERE l.produto_id = ?
+            ORDER BY l.recebido_em, l.id
             """,
             (int(id_produto),),
         ).fetchall()
@@ -853,6 +930,40 @@ def obter_lotes_produto(id_produto):
     ]
 
 
+def reconciliar_saldos_lotes(*, corrigir=True):
+    """Confere o saldo derivado com o razão e, se preciso, o reconstrói."""
+    try:
+        with _conexao() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            divergencias = database.divergencias_saldos_lotes(conn)
+            if divergencias and corrigir:
+                database.reconstruir_saldos_lotes(conn)
+        return {
+            "sucesso": True,
+            "divergencias": divergencias,
+            "corrigido": bool(divergencias and corrigir),
+        }
+    except sqlite3.Error:
+        return {
+            "sucesso": False,
+            "mensagem": "Não foi possível conferir os saldos dos lotes.",
+        }
+
+
+def reconstruir_resumos_vendas():
+    """Refaz os resumos de venda por intervalo a partir de todo o histórico."""
+    try:
+        with _conexao() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            eventos = database.reconstruir_resumos_vendas(conn)
+        return {"sucesso": True, "eventos": eventos}
+    except (sqlite3.Error, ValueError, TypeError):
+        return {
+            "sucesso": False,
+            "mensagem": "Não foi possível reconstruir os resumos de venda.",
+        }
+
+
 def atualizar_preco_venda_produto(id_produto, novo_preco_venda):
     try:
         with _conexao() as conn:
@@ -860,6 +971,7 @@ def atualizar_preco_venda_produto(id_produto, novo_preco_venda):
                 "UPDATE produtos SET preco_centavos = ? WHERE id = ? AND ativo = 1",
                 (_para_centavos(novo_preco_venda), id_produto),
             )
+        _cadastro_alterado()
         return cursor.rowcount > 0
     except sqlite3.Error:
         return False
@@ -893,6 +1005,7 @@ def atualizar_dados_produto(
                     id_produto,
                 ),
             )
+        _cadastro_alterado()
         return cursor.rowcount > 0
     except sqlite3.Error:
         return False
@@ -943,6 +1056,7 @@ def atualizar_produto(
             )
             if atualizado.rowcount == 0:
                 return {"sucesso": False, "mensagem": "Produto não encontrado."}
+        _cadastro_alterado()
         return {"sucesso": True}
     except sqlite3.IntegrityError:
         return {
@@ -960,6 +1074,7 @@ def atualizar_categoria_produto(id_produto, nova_categoria_id):
                 "UPDATE produtos SET categoria_id = ? WHERE id = ? AND ativo = 1",
                 (nova_categoria_id, id_produto),
             )
+        _cadastro_alterado()
         return cursor.rowcount > 0
     except sqlite3.Error:
         return False
@@ -974,6 +1089,7 @@ def atualizar_ordem_itens(tabela, ids_ordenados):
                 conn.execute(
                     f"UPDATE {tabela} SET ordem = ? WHERE id = ?", (ordem, item_id)
                 )
+        _cadastro_alterado()
         return True
     except sqlite3.Error:
         return False
@@ -1035,7 +1151,6 @@ def salvar_novo_pedido(dados_do_pedido, local_id, operacao_id=None):
         conn = _conectar()
         cursor = conn.cursor()
         cursor.execute("BEGIN IMMEDIATE")
-        _limpar_reservas(cursor)
 
         if not cursor.execute("SELECT 1 FROM locais WHERE id = ?", (local_id,)).fetchone():
             conn.rollback()
@@ -1064,47 +1179,48 @@ def salvar_novo_pedido(dados_do_pedido, local_id, operacao_id=None):
                     cursor, int(operacao_id), encerramento=False
                 )
 
+        # Saldo e reservas de outros carrinhos chegam na mesma leitura do
+        # cadastro; sem carrinho, todas as reservas ativas são descontadas.
+        carrinho_id = str(dados_do_pedido.get("carrinho_id") or "")
+        agora = _agora()
         placeholders = ",".join("?" for _ in quantidades)
         produtos_rows = cursor.execute(
             f"""
             SELECT p.*, COALESCE(c.ordem, 0) AS categoria_ordem,
-                   COALESCE(c.nome, 'Sem categoria') AS categoria_nome
+                   COALESCE(c.nome, 'Sem categoria') AS categoria_nome,
+                   COALESCE(s.saldo, 0) AS saldo,
+                   COALESCE(r.reservado, 0) AS reservado_outros
             FROM produtos p
             LEFT JOIN categorias c ON c.id = p.categoria_id
+            LEFT JOIN (
+                SELECT produto_id, SUM(quantidade_disponivel) AS saldo
+                FROM estoque_lotes_saldo
+                WHERE produto_id IN ({placeholders})
+                  AND {database.SALDO_LOTE_NAO_ZERO}
+                GROUP BY produto_id
+            ) s ON s.produto_id = p.id
+            LEFT JOIN (
+                SELECT produto_id, SUM(quantidade_reservada) AS reservado
+                FROM reservas_carrinho
+                WHERE produto_id IN ({placeholders})
+                  AND carrinho_id != ? AND expires_at > ?
+                GROUP BY produto_id
+            ) r ON r.produto_id = p.id
             WHERE p.id IN ({placeholders}) AND p.ativo = 1
             """,
-            list(quantidades),
+            [*quantidades, *quantidades, carrinho_id, agora, *quantidades],
         ).fetchall()
         produtos = {row["id"]: row for row in produtos_rows}
         if len(produtos) != len(quantidades):
             conn.rollback()
             return None
-
-        carrinho_id = str(dados_do_pedido.get("carrinho_id") or "")
         for produto_id, desejado in quantidades.items():
-            saldo = _saldo_produto(cursor, produto_id)
-            if carrinho_id:
-                reservado_outros = cursor.execute(
-                    """
-                    SELECT COALESCE(SUM(quantidade_reservada), 0)
-                    FROM reservas_carrinho
-                    WHERE produto_id = ? AND carrinho_id != ?
-                    """,
-                    (produto_id, carrinho_id),
-                ).fetchone()[0]
-            else:
-                reservado_outros = cursor.execute(
-                    """
-                    SELECT COALESCE(SUM(quantidade_reservada), 0)
-                    FROM reservas_carrinho WHERE produto_id = ?
-                    """,
-                    (produto_id,),
-                ).fetchone()[0]
-            if saldo - int(reservado_outros or 0) < desejado:
+            produto = produtos[produto_id]
+            if int(produto["saldo"]) - int(produto["reservado_outros"]) < desejado:
                 conn.rollback()
                 return None
 
-        agora = _agora()
+        parcelas_por_produto = _planejar_fifo_produtos(cursor, dict(quantidades))
         inicio = _inicio_dia_operacional().isoformat()
         senha = int(
             cursor.execute(
@@ -1141,7 +1257,7 @@ def salvar_novo_pedido(dados_do_pedido, local_id, operacao_id=None):
                 int(operacao_id) if operacao_id is not None else None,
             ),
         )
-        pedido_id = cursor.lastrowid
+        pedido_id = int(cursor.lastrowid)
 
         itens_ordenados = sorted(
             itens_recebidos,
@@ -1152,26 +1268,31 @@ def salvar_novo_pedido(dados_do_pedido, local_id, operacao_id=None):
                 str(item.get("uid") or ""),
             ),
         )
+        # Os custos PEPS são distribuídos antes da gravação, na mesma ordem
+        # em que os itens consumiriam os lotes um a um.
+        linhas_itens = []
+        parcelas_itens = []
         for item in itens_ordenados:
             pid = int(item["id"])
             produto = produtos[pid]
+            quantidade_item = int(item["quantidade"])
+            parcelas = _dividir_parcelas(parcelas_por_produto[pid], quantidade_item)
+            custo_total = sum(retirada * custo for _, retirada, custo in parcelas)
+            custo_unitario = int(
+                (Decimal(custo_total) / Decimal(quantidade_item)).quantize(
+                    Decimal("1"), rounding=ROUND_HALF_UP
+                )
+            )
             customizacao = item.get("customizacao")
-            cursor.execute(
-                """
-                INSERT INTO pedido_itens(
-                    pedido_id, produto_id, nome_produto,
-                    preco_unitario_centavos, custo_unitario_centavos,
-                    custo_total_centavos,
-                    quantidade, categoria_nome, customizacao_json, requer_preparo,
-                    categoria_ordem, produto_ordem, uid
-                ) VALUES (?, ?, ?, ?, 0, 0, ?, ?, ?, ?, ?, ?, ?)
-                """,
+            linhas_itens.append(
                 (
                     pedido_id,
                     pid,
                     produto["nome"],
                     produto["preco_centavos"],
-                    int(item["quantidade"]),
+                    custo_unitario,
+                    custo_total,
+                    quantidade_item,
                     produto["categoria_nome"],
                     json.dumps(customizacao, ensure_ascii=False)
                     if customizacao is not None
@@ -1180,34 +1301,42 @@ def salvar_novo_pedido(dados_do_pedido, local_id, operacao_id=None):
                     produto["categoria_ordem"],
                     produto["ordem"],
                     str(item.get("uid") or uuid.uuid4()),
-                ),
-            )
-            pedido_item_id = int(cursor.lastrowid)
-            quantidade_item = int(item["quantidade"])
-            consumo = _consumir_fifo(
-                cursor,
-                pid,
-                quantidade_item,
-                tipo="venda",
-                observacao=f"Consumo FIFO do pedido #{pedido_id}",
-                pedido_id=int(pedido_id),
-                pedido_item_id=pedido_item_id,
-                ocorrido_em=agora,
-            )
-            custo_total = int(consumo["custo_total_centavos"])
-            custo_unitario = int(
-                (Decimal(custo_total) / Decimal(quantidade_item)).quantize(
-                    Decimal("1"), rounding=ROUND_HALF_UP
                 )
             )
-            cursor.execute(
-                """
-                UPDATE pedido_itens
-                SET custo_unitario_centavos = ?, custo_total_centavos = ?
-                WHERE id = ?
-                """,
-                (custo_unitario, custo_total, pedido_item_id),
-            )
+            parcelas_itens.append((pid, parcelas))
+        itens_ids = _inserir_retornando_ids(
+            cursor,
+            """
+            INSERT INTO pedido_itens(
+                pedido_id, produto_id, nome_produto,
+                preco_unitario_centavos, custo_unitario_centavos,
+                custo_total_centavos,
+                quantidade, categoria_nome, customizacao_json, requer_preparo,
+                categoria_ordem, produto_ordem, uid
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            linhas_itens,
+        )
+        observacao = f"Consumo FIFO do pedido #{pedido_id}"
+        cursor.executemany(
+            SQL_INSERIR_MOVIMENTACAO,
+            [
+                (
+                    pid,
+                    pedido_id,
+                    itens_ids[indice],
+                    lote_id,
+                    "venda",
+                    -retirada,
+                    custo,
+                    1,
+                    observacao,
+                    agora,
+                )
+                for indice, (pid, parcelas) in enumerate(parcelas_itens)
+                for lote_id, retirada, custo in parcelas
+            ],
+        )
         if carrinho_id:
             cursor.execute(
                 "DELETE FROM reservas_carrinho WHERE carrinho_id = ?", (carrinho_id,)
@@ -1279,6 +1408,7 @@ def confirmar_pagamento_pedido(id_do_pedido, metodo_confirmado=None):
                 agora,
             ),
         )
+        database.acumular_resumo_vendas(conn, cursor.lastrowid)
         cursor.execute(
             """
             UPDATE pedidos
@@ -1288,6 +1418,7 @@ def confirmar_pagamento_pedido(id_do_pedido, metodo_confirmado=None):
             """,
             (agora, metodo, id_do_pedido),
         )
+        _gravar_resumo_visita(conn, pedido["operacao_id"])
         conn.commit()
         return True
     except sqlite3.Error:
@@ -1466,6 +1597,8 @@ def cancelar_pedido(id_do_pedido):
                     agora,
                 ),
             )
+            if cursor.rowcount:
+                database.acumular_resumo_vendas(conn, cursor.lastrowid)
         cursor.execute(
             """
             UPDATE pedidos
@@ -1474,6 +1607,7 @@ def cancelar_pedido(id_do_pedido):
             """,
             (agora, id_do_pedido),
         )
+        _gravar_resumo_visita(conn, pedido["operacao_id"])
         conn.commit()
         return True
     except sqlite3.Error:
@@ -1486,12 +1620,7 @@ def cancelar_pedido(id_do_pedido):
 
 
 def obter_pedidos_ativos():
-    status = (
-        "aguardando_pagamento",
-        "aguardando_producao",
-        "em_producao",
-        "aguardando_retirada",
-    )
+    status = STATUS_PEDIDOS_ATIVOS
     with _conexao() as conn:
         cursor = conn.cursor()
         placeholders = ",".join("?" for _ in status)
@@ -1553,31 +1682,54 @@ def obter_proxima_senha_diaria():
 # ---------------------------------------------------------------------------
 
 
-def obter_disponibilidade_para_produtos(produto_ids):
-    ids = [int(pid) for pid in produto_ids]
+def _disponibilidade_produtos(
+    cursor: sqlite3.Cursor, produto_ids: list[int], vigente: str
+) -> dict[int, int]:
+    """Saldo menos reservas vigentes de vários produtos em uma única consulta."""
+    ids = list(dict.fromkeys(int(pid) for pid in produto_ids))
     if not ids:
         return {}
-    with _conexao() as conn:
-        cursor = conn.cursor()
-        cursor.execute("BEGIN IMMEDIATE")
-        _limpar_reservas(cursor)
-        placeholders = ",".join("?" for _ in ids)
-        saldos = {pid: _saldo_produto(cursor, pid) for pid in ids}
-        reservas = {
-            row["produto_id"]: int(row["reservado"])
-            for row in cursor.execute(
-                f"""
-                SELECT produto_id, COALESCE(SUM(quantidade_reservada), 0) AS reservado
+    valores = ",".join("(?)" for _ in ids)
+    return {
+        int(row["produto_id"]): int(row["disponivel"])
+        for row in cursor.execute(
+            f"""
+            WITH solicitados(produto_id) AS (VALUES {valores}),
+            saldos AS (
+                SELECT produto_id, SUM(quantidade_disponivel) AS saldo
+                FROM estoque_lotes_saldo
+                WHERE produto_id IN (SELECT produto_id FROM solicitados)
+                  AND {database.SALDO_LOTE_NAO_ZERO}
+                GROUP BY produto_id
+            ),
+            reservas AS (
+                SELECT produto_id, SUM(quantidade_reservada) AS reservado
                 FROM reservas_carrinho
-                WHERE produto_id IN ({placeholders})
+                WHERE produto_id IN (SELECT produto_id FROM solicitados)
+                  AND expires_at > ?
                 GROUP BY produto_id
-                """,
-                ids,
             )
-        }
-        resultado = {pid: saldos.get(pid, 0) - reservas.get(pid, 0) for pid in ids}
-        conn.commit()
-        return resultado
+            SELECT solicitados.produto_id,
+                   COALESCE(saldos.saldo, 0) - COALESCE(reservas.reservado, 0)
+                       AS disponivel
+            FROM solicitados
+            LEFT JOIN saldos ON saldos.produto_id = solicitados.produto_id
+            LEFT JOIN reservas ON reservas.produto_id = solicitados.produto_id
+            """,
+            [*ids, vigente],
+        )
+    }
+
+
+def obter_disponibilidade_para_produtos(produto_ids):
+    ids = [int(pid) for pid in produto_ids]
+    if not ids:
+        return {}
+    # Leitura sem trava de escrita: em WAL a consulta única enxerga um retrato
+    # consistente, e reservas vencidas são apenas ignoradas até a varredura.
+    with _conexao() as conn:
+        disponiveis = _disponibilidade_produtos(conn.cursor(), ids, _agora())
+    return {pid: disponiveis.get(pid, 0) for pid in ids}
 
 
 def _aplicar_quantidade_reservada(
@@ -1588,15 +1740,17 @@ def _aplicar_quantidade_reservada(
     *,
     ajustar_ao_disponivel: bool,
 ):
+    # Reservas vencidas são ignoradas aqui e removidas pela varredura periódica.
+    vigente = _agora()
     produto = cursor.execute(
         "SELECT ativo FROM produtos WHERE id = ?", (produto_id,)
     ).fetchone()
     atual_row = cursor.execute(
         """
         SELECT quantidade_reservada FROM reservas_carrinho
-        WHERE carrinho_id = ? AND produto_id = ?
+        WHERE carrinho_id = ? AND produto_id = ? AND expires_at > ?
         """,
-        (carrinho_id, produto_id),
+        (carrinho_id, produto_id, vigente),
     ).fetchone()
     atual = int(atual_row[0]) if atual_row else 0
 
@@ -1621,9 +1775,9 @@ def _aplicar_quantidade_reservada(
             """
             SELECT COALESCE(SUM(quantidade_reservada), 0)
             FROM reservas_carrinho
-            WHERE produto_id = ? AND carrinho_id != ?
+            WHERE produto_id = ? AND carrinho_id != ? AND expires_at > ?
             """,
-            (produto_id, carrinho_id),
+            (produto_id, carrinho_id, vigente),
         ).fetchone()[0]
     )
     maximo_para_carrinho = max(saldo - reservado_outros, 0)
@@ -1680,9 +1834,10 @@ def _aplicar_quantidade_reservada(
         cursor.execute(
             """
             SELECT COALESCE(SUM(quantidade_reservada), 0)
-            FROM reservas_carrinho WHERE produto_id = ?
+            FROM reservas_carrinho
+            WHERE produto_id = ? AND expires_at > ?
             """,
-            (produto_id,),
+            (produto_id, vigente),
         ).fetchone()[0]
     )
     ajustada = quantidade_aplicada != quantidade_desejada
@@ -1716,7 +1871,6 @@ def definir_reserva(carrinho_id, produto_id, quantidade_desejada):
         conn = _conectar()
         cursor = conn.cursor()
         cursor.execute("BEGIN IMMEDIATE")
-        _limpar_reservas(cursor)
         resultado = _aplicar_quantidade_reservada(
             cursor,
             carrinho_id,
@@ -1735,6 +1889,53 @@ def definir_reserva(carrinho_id, produto_id, quantidade_desejada):
             conn.close()
 
 
+def definir_reservas(carrinho_id, quantidades):
+    """Define as reservas de vários produtos do carrinho em uma só transação."""
+    conn = None
+    try:
+        carrinho_id = str(carrinho_id or "").strip()
+        desejadas = {
+            int(produto_id): int(quantidade)
+            for produto_id, quantidade in dict(quantidades or {}).items()
+        }
+        if (
+            not carrinho_id
+            or not desejadas
+            or any(quantidade < 0 for quantidade in desejadas.values())
+        ):
+            return {"sucesso": False, "mensagem": "Dados de reserva inválidos."}
+
+        conn = _conectar()
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        reservas = []
+        afetados = {}
+        for produto_id, desejada in desejadas.items():
+            resultado = _aplicar_quantidade_reservada(
+                cursor,
+                carrinho_id,
+                produto_id,
+                desejada,
+                ajustar_ao_disponivel=True,
+            )
+            for afetado in resultado.pop("produtos_afetados", []):
+                afetados[afetado["produto_id"]] = afetado
+            reservas.append({"produto_id": produto_id, **resultado})
+        conn.commit()
+        return {
+            "sucesso": all(reserva["sucesso"] for reserva in reservas),
+            "reservas": reservas,
+            "produtos_afetados": list(afetados.values()),
+        }
+    except (sqlite3.Error, ValueError, TypeError):
+        if conn:
+            conn.rollback()
+        return {"sucesso": False, "mensagem": "Erro no servidor."}
+    finally:
+        if conn:
+            conn.close()
+
+
 def gerenciar_reserva(carrinho_id, produto_id, quantidade_delta):
     """Compatibilidade com clientes antigos que ainda enviam deltas."""
     conn = None
@@ -1747,13 +1948,12 @@ def gerenciar_reserva(carrinho_id, produto_id, quantidade_delta):
         conn = _conectar()
         cursor = conn.cursor()
         cursor.execute("BEGIN IMMEDIATE")
-        _limpar_reservas(cursor)
         atual_row = cursor.execute(
             """
             SELECT quantidade_reservada FROM reservas_carrinho
-            WHERE carrinho_id = ? AND produto_id = ?
+            WHERE carrinho_id = ? AND produto_id = ? AND expires_at > ?
             """,
-            (carrinho_id, produto_id),
+            (carrinho_id, produto_id, _agora()),
         ).fetchone()
         atual = int(atual_row[0]) if atual_row else 0
         nova = atual + delta
@@ -1824,6 +2024,46 @@ def forcar_expirar_carrinho(carrinho_id):
         return {"sucesso": False, "mensagem": "Erro ao expirar carrinho."}
 
 
+def expirar_reservas_vencidas():
+    """Remove reservas vencidas e devolve a disponibilidade dos produtos liberados."""
+    try:
+        agora = _agora()
+        with _conexao() as conn:
+            # A conferência sem trava evita disputar a escrita quando não há
+            # nada vencido, que é o caso comum entre duas varreduras.
+            if not conn.execute(
+                "SELECT 1 FROM reservas_carrinho WHERE expires_at <= ? LIMIT 1",
+                (agora,),
+            ).fetchone():
+                return {"sucesso": True, "reservas_expiradas": 0, "produtos_afetados": []}
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            ids = [
+                int(row["produto_id"])
+                for row in cursor.execute(
+                    """
+                    SELECT DISTINCT produto_id FROM reservas_carrinho
+                    WHERE expires_at <= ?
+                    """,
+                    (agora,),
+                )
+            ]
+            expiradas = cursor.execute(
+                "DELETE FROM reservas_carrinho WHERE expires_at <= ?", (agora,)
+            ).rowcount
+            disponiveis = _disponibilidade_produtos(cursor, ids, agora)
+        return {
+            "sucesso": True,
+            "reservas_expiradas": int(expiradas),
+            "produtos_afetados": [
+                {"produto_id": pid, "disponivel": disponiveis.get(pid, 0)}
+                for pid in ids
+            ],
+        }
+    except sqlite3.Error:
+        return {"sucesso": False, "mensagem": "Erro ao expirar reservas."}
+
+
 # ---------------------------------------------------------------------------
 # Configurações auxiliares
 # ---------------------------------------------------------------------------
@@ -1970,16 +2210,14 @@ def obter_resumo_novo_ciclo():
     """Resume o alcance do reset sem alterar nenhum dado."""
     with _conexao() as conn:
         saldo = conn.execute(
-            """
+            f"""
             SELECT COALESCE(SUM(saldo), 0) AS quantidade,
                    COALESCE(SUM(saldo * custo_unitario_centavos), 0) AS valor
             FROM (
-                SELECT l.custo_unitario_centavos,
-                       l.quantidade_inicial + COALESCE(SUM(m.quantidade), 0) AS saldo
-                FROM estoque_lotes l
-                LEFT JOIN estoque_movimentacoes m ON m.lote_id = l.id
-                GROUP BY l.id
-                HAVING saldo > 0
+                SELECT custo_unitario_centavos,
+                       quantidade_disponivel AS saldo
+                FROM estoque_lotes_saldo
+                WHERE {database.SALDO_LOTE_POSITIVO}
             )
             """
         ).fetchone()
@@ -2022,23 +2260,22 @@ def iniciar_novo_ciclo(*, manter_estoque=True, manter_locais=True):
     conn = None
     try:
         resumo = obter_resumo_novo_ciclo()
+        # A manutenção usa uma conexão exclusiva e não devolve nada ao pool.
+        database.drenar_pool()
         backup_path = database.criar_backup_novo_ciclo()
-        conn = _conectar()
+        conn = database.conectar()
         cursor = conn.cursor()
         cursor.execute("BEGIN IMMEDIATE")
 
         lotes_abertura = []
         if manter_estoque:
             lotes_abertura = cursor.execute(
-                """
-                SELECT l.produto_id, l.custo_unitario_centavos,
-                       l.quantidade_inicial
-                           + COALESCE(SUM(m.quantidade), 0) AS saldo
-                FROM estoque_lotes l
-                LEFT JOIN estoque_movimentacoes m ON m.lote_id = l.id
-                GROUP BY l.id
-                HAVING saldo > 0
-                ORDER BY l.recebido_em, l.id
+                f"""
+                SELECT produto_id, custo_unitario_centavos,
+                       quantidade_disponivel AS saldo
+                FROM estoque_lotes_saldo
+                WHERE {database.SALDO_LOTE_POSITIVO}
+                ORDER BY recebido_em, lote_id
                 """
             ).fetchall()
 
@@ -2048,6 +2285,8 @@ def iniciar_novo_ciclo(*, manter_estoque=True, manter_locais=True):
         )
         cursor.execute("DELETE FROM estoque_movimentacoes")
         cursor.execute("DELETE FROM pagamentos")
+        cursor.execute("DELETE FROM vendas_resumo_periodo")
+        cursor.execute("DELETE FROM vendas_resumo_produto")
         cursor.execute("DELETE FROM pedido_itens")
         cursor.execute("DELETE FROM pedidos")
         cursor.execute("DELETE FROM operacao_estoque")
@@ -2189,6 +2428,7 @@ def iniciar_operacao(local_id):
                     """,
                     (agora, operacao_aberta),
                 )
+                _gravar_resumo_visita(conn, operacao_aberta)
 
             operacao = cursor.execute(
                 """
@@ -2274,6 +2514,7 @@ def retomar_operacao(operacao_id, local_id):
                     """,
                     (agora, aberta_id),
                 )
+                _gravar_resumo_visita(conn, aberta_id)
 
             cursor.execute(
                 """
@@ -2331,6 +2572,7 @@ def encerrar_operacao(operacao_id):
                 """,
                 (_agora(), operacao_id),
             )
+            _gravar_resumo_visita(conn, operacao_id)
         return True
     except (sqlite3.Error, ValueError, TypeError):
         return False
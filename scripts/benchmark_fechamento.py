@@ -0,0 +1,185 @@
+"""Compara o fechamento por evento em Python com o motor colunar (NumPy)."""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+RAIZ_PROJETO = Path(__file__).resolve().parent.parent
+if str(RAIZ_PROJETO) not in sys.path:
+    sys.path.insert(0, str(RAIZ_PROJETO))
+
+import analytics
+import database
+import gerenciador_db as db
+
+METODOS = ("pix", "cartao_credito", "cartao_debito", "dinheiro")
+
+
+def _preparar_catalogo(produtos: int) -> list[tuple[int, str, int]]:
+    if not db.adicionar_local("Benchmark"):
+        raise RuntimeError("Não foi possível criar o local do benchmark.")
+    catalogo = []
+    for indice in range(produtos):
+        preco = 800 + 150 * indice
+        produto_id = db.adicionar_novo_produto(
+            f"Produto {indice + 1}", None, None, preco / 100, 0, 3.00, 1, 0
+        )
+        catalogo.append((int(produto_id), f"Produto {indice + 1}", preco))
+    return catalogo
+
+
+def _gerar_pedidos(
+    pedidos: int, dias: int, catalogo: list, local_id: int, inicio: datetime
+) -> None:
+    """Grava pedidos pagos direto nas tabelas, sem passar pelo fluxo de venda."""
+    gerador = random.Random(7)
+    linhas_pedidos = []
+    linhas_itens = []
+    linhas_pagamentos = []
+    for pedido_id in range(1, pedidos + 1):
+        instante = inicio + timedelta(seconds=gerador.randrange(dias * 86400))
+        horario = instante.isoformat()
+        metodo = METODOS[pedido_id % len(METODOS)]
+        itens = gerador.sample(catalogo, gerador.randint(1, min(3, len(catalogo))))
+        total = 0
+        for ordem, (produto_id, nome, preco) in enumerate(itens):
+            quantidade = gerador.randint(1, 4)
+            total += preco * quantidade
+            linhas_itens.append(
+                (
+                    pedido_id, produto_id, nome, preco, 300, 300 * quantidade,
+                    quantidade, "Benchmark", ordem, f"{pedido_id}-{ordem}",
+                )
+            )
+        linhas_pedidos.append(
+            (
+                pedido_id, f"Cliente {pedido_id}", metodo, total, horario,
+                horario, 1 + pedido_id % 999, local_id,
+            )
+        )
+        linhas_pagamentos.append(
+            (pedido_id, "pagamento", metodo, total, total // 100, horario)
+        )
+        if pedido_id % 50 == 0:
+            estorno = (instante + timedelta(minutes=5)).isoformat()
+            linhas_pagamentos.append(
+                (pedido_id, "estorno", metodo, total, total // 100, estorno)
+            )
+
+    with closing(database.conectar()) as conn:
+        with conn:
+            conn.executemany(
+                """
+                INSERT INTO pedidos (
+                    id, nome_cliente, status, metodo_pagamento, modalidade,
+                    valor_total_centavos, timestamp_criacao, timestamp_pagamento,
+                    senha_diaria, local_id
+                )
+                VALUES (?, ?, 'finalizado', ?, 'local', ?, ?, ?, ?, ?)
+                """,
+                linhas_pedidos,
+            )
+            conn.executemany(
+                """
+                INSERT INTO pedido_itens (
+                    pedido_id, produto_id, nome_produto, preco_unitario_centavos,
+                    custo_unitario_centavos, custo_total_centavos, quantidade,
+                    categoria_nome, produto_ordem, uid
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                linhas_itens,
+            )
+            conn.executemany(
+                """
+                INSERT INTO pagamentos (
+                    pedido_id, tipo, metodo, valor_centavos, taxa_centavos,
+                    ocorrido_em
+                )
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                linhas_pagamentos,
+            )
+
+
+def _medir(funcao, repeticoes: int):
+    melhor = None
+    resultado = None
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        duracao = time.perf_counter() - inicio
+        melhor = duracao if melhor is None else min(melhor, duracao)
+    return melhor, resultado
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Mede o fechamento de um período longo nos dois motores."
+    )
+    parser.add_argument("--pedidos", type=int, default=100_000)
+    parser.add_argument("--dias", type=int, default=90)
+    parser.add_argument("--produtos", type=int, default=12)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    args = parser.parse_args()
+
+    # Sete minutos fora do alinhamento dos resumos de 15 minutos obrigam o
+    # fechamento a ler os eventos.
+    inicio_dt = datetime(2025, 1, 1, 3, 7, tzinfo=timezone.utc)
+    inicio = inicio_dt.isoformat()
+    fim = (inicio_dt + timedelta(days=args.dias)).isoformat()
+    grade = analytics._grade_serie(inicio, fim)
+
+    with tempfile.TemporaryDirectory() as pasta:
+        os.environ["ESPETAO_DB_PATH"] = os.path.join(pasta, "benchmark.db")
+        try:
+            database.inicializar_banco()
+            catalogo = _preparar_catalogo(args.produtos)
+            local_id = db.obter_todos_locais()[0]["id"]
+            gravacao = time.perf_counter()
+            _gerar_pedidos(args.pedidos, args.dias, catalogo, local_id, inicio_dt)
+            gravacao = time.perf_counter() - gravacao
+
+            with closing(database.conectar()) as conn:
+                tempo_python, por_evento = _medir(
+                    lambda: analytics._vendas_eventos(
+                        conn, inicio, fim, "todos", grade, None
+                    ),
+                    args.repeticoes,
+                )
+                tempo_colunar = None
+                if analytics.np is not None:
+                    tempo_colunar, colunar = _medir(
+                        lambda: analytics._vendas_colunar(
+                            conn, inicio, fim, "todos", grade
+                        ),
+                        args.repeticoes,
+                    )
+                    if colunar != por_evento:
+                        raise RuntimeError("Os dois motores divergiram.")
+        finally:
+            database.drenar_pool()
+            os.environ.pop("ESPETAO_DB_PATH", None)
+
+    print(
+        f"{args.pedidos} pedidos em {args.dias} dias, {args.produtos} produtos "
+        f"(gravados em {gravacao:.1f} s)"
+    )
+    print(f"Agregação por evento (ms):        {1000 * tempo_python:10.1f}")
+    if tempo_colunar is None:
+        print("Motor colunar:                    NumPy não instalado")
+    else:
+        print(f"Agregação colunar (ms):           {1000 * tempo_colunar:10.1f}")
+        print(f"Ganho:                            {tempo_python / tempo_colunar:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""Mede comandos SQL e tempo de trava de escrita por pedido gravado."""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+RAIZ_PROJETO = Path(__file__).resolve().parent.parent
+if str(RAIZ_PROJETO) not in sys.path:
+    sys.path.insert(0, str(RAIZ_PROJETO))
+
+import database
+import gerenciador_db as db
+
+
+class _Rastreador:
+    """Conta os comandos enviados ao SQLite e o tempo com a trava de escrita."""
+
+    def __init__(self) -> None:
+        self.comandos = 0
+        self.comandos_na_transacao = 0
+        self.tempo_trava = 0.0
+        self._inicio_trava: float | None = None
+
+    def __call__(self, sql: str) -> None:
+        comando = sql.strip().upper()
+        if comando.startswith("--"):
+            return
+        self.comandos += 1
+        if comando.startswith("BEGIN IMMEDIATE"):
+            self._inicio_trava = time.perf_counter()
+        if self._inicio_trava is not None:
+            self.comandos_na_transacao += 1
+            if comando.startswith(("COMMIT", "ROLLBACK")):
+                self.tempo_trava += time.perf_counter() - self._inicio_trava
+                self._inicio_trava = None
+
+
+def _preparar_catalogo(produtos: int, lotes: int) -> list[int]:
+    local_ok = db.adicionar_local("Benchmark")
+    if not local_ok:
+        raise RuntimeError("Não foi possível criar o local do benchmark.")
+    ids = []
+    for indice in range(produtos):
+        produto_id = db.adicionar_novo_produto(
+            f"Produto {indice + 1}", None, None, 10.00, 0, 0, 1, indice % 2
+        )
+        for lote in range(lotes):
+            db.adicionar_estoque(produto_id, 2_000, 3.00 + lote * 0.25)
+        ids.append(int(produto_id))
+    return ids
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Compara o custo de gravação de pedidos no banco do PDV."
+    )
+    parser.add_argument("--pedidos", type=int, default=200)
+    parser.add_argument("--produtos", type=int, default=6)
+    parser.add_argument("--lotes", type=int, default=3)
+    parser.add_argument(
+        "--itens-por-produto",
+        type=int,
+        default=2,
+        help="Itens do mesmo produto com personalizações diferentes.",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        os.environ["ESPETAO_DB_PATH"] = os.path.join(pasta, "benchmark.db")
+        database.inicializar_banco()
+        ids = _preparar_catalogo(args.produtos, args.lotes)
+        local_id = db.obter_todos_locais()[0]["id"]
+
+        rastreador = _Rastreador()
+        obter_original = database.obter_conexao
+
+        def obter_rastreada(db_path=None):
+            conn = obter_original(db_path)
+            conn.set_trace_callback(rastreador)
+            return conn
+
+        database.obter_conexao = obter_rastreada
+        inicio = time.perf_counter()
+        try:
+            for numero in range(args.pedidos):
+                pedido = db.salvar_novo_pedido(
+                    {
+                        "nome_cliente": f"Cliente {numero}",
+                        "itens": [
+                            {
+                                "id": produto_id,
+                                "quantidade": 1 + (numero + item) % 3,
+                                "uid": f"{numero}-{produto_id}-{item}",
+                            }
+                            for produto_id in ids
+                            for item in range(args.itens_por_produto)
+                        ],
+                        "metodo_pagamento": "pix",
+                        "modalidade": "local",
+                        "carrinho_id": f"benchmark-{numero}",
+                    },
+                    local_id,
+                )
+                if pedido is None:
+                    raise RuntimeError("O benchmark esgotou o estoque preparado.")
+        finally:
+            database.obter_conexao = obter_original
+            pool = database.pool_conexoes.estatisticas()
+            database.drenar_pool()
+            os.environ.pop("ESPETAO_DB_PATH", None)
+        duracao = time.perf_counter() - inicio
+
+    pedidos = args.pedidos
+    print(
+        f"{pedidos} pedidos, {args.produtos} produtos x "
+        f"{args.itens_por_produto} itens, {args.lotes} lotes por produto"
+    )
+    print(f"Comandos SQL por pedido:          {rastreador.comandos / pedidos:8.1f}")
+    print(
+        "Comandos com trava de escrita:    "
+        f"{rastreador.comandos_na_transacao / pedidos:8.1f}"
+    )
+    print(
+        "Tempo médio com trava (ms):       "
+        f"{1000 * rastreador.tempo_trava / pedidos:8.3f}"
+    )
+    print(f"Tempo médio por pedido (ms):      {1000 * duracao / pedidos:8.3f}")
+    print(
+        f"Conexões criadas/reutilizadas:    {pool['criadas']}/{pool['reutilizadas']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Reconstrói os resumos de venda por intervalo a partir do histórico."""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+RAIZ_PROJETO = Path(__file__).resolve().parent.parent
+if str(RAIZ_PROJETO) not in sys.path:
+    sys.path.insert(0, str(RAIZ_PROJETO))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Apaga e recalcula vendas_resumo_periodo e vendas_resumo_produto "
+            "a partir de pagamentos, estornos e itens dos pedidos."
+        )
+    )
+    parser.add_argument(
+        "banco",
+        nargs="?",
+        help="Caminho do banco SQLite (padrão: banco da aplicação).",
+    )
+    args = parser.parse_args()
+    if args.banco:
+        os.environ["ESPETAO_DB_PATH"] = str(Path(args.banco).resolve())
+
+    import database
+    import gerenciador_db
+
+    database.inicializar_banco()
+    resultado = gerenciador_db.reconstruir_resumos_vendas()
+    if not resultado["sucesso"]:
+        print(resultado["mensagem"], file=sys.stderr)
+        raise SystemExit(1)
+    print(
+        f"{resultado['eventos']} pagamento(s) e estorno(s) resumidos em "
+        f"{database.caminho_banco()}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -70,9 +70,9 @@ export function ehErroConexaoServidor(erro) {
     return erro instanceof ErroConexaoServidor;
 }
 
-async function enviarReserva(payload) {
+async function enviarReserva(payload, url = '/api/carrinho/item') {
     try {
-        const response = await fetch('/api/carrinho/item', {
+        const response = await fetch(url, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(payload)
@@ -104,6 +104,19 @@ export async function definirReservaAPI(produtoId, quantidadeDesejada) {
     });
 }
 
+/**
+ * Define de uma só vez as reservas de vários produtos. O servidor aplica todas
+ * na mesma transação, ajustando cada uma ao disponível, e avisa os totens uma
+ * única vez.
+ * @param {Map<number, number>} quantidadesPorProduto - Total desejado por produto.
+ */
+export async function definirReservasAPI(quantidadesPorProduto) {
+    return enviarReserva({
+        carrinho_id: carrinhoId,
+        itens: Object.fromEntries(quantidadesPorProduto)
+    }, '/api/carrinho/itens');
+}
+
 /**
  * Consulta a API para obter a disponibilidade real de uma lista de produtos.
  * @param {Array<object>} itens - A lista de itens do pedido.
@@ -422,23 +435,19 @@ export async function processarPedidoDecodificado(pedidoDecodificado) {
     });
 
     const reservadoPorProduto = new Map();
-    const produtosReservados = [];
     try {
-        for (const [produtoId, quantidadeDesejada] of desejadoPorProduto) {
-            const resultado = await definirReservaAPI(
-                produtoId,
-                quantidadeDesejada
-            );
+        const resultado = await definirReservasAPI(desejadoPorProduto);
+        (resultado.reservas || []).forEach(reserva => {
             reservadoPorProduto.set(
-                produtoId,
-                Number(resultado.quantidade_reservada || 0)
+                Number(reserva.produto_id),
+                Number(reserva.quantidade_reservada || 0)
             );
-            produtosReservados.push(produtoId);
-        }
+        });
     } catch (erro) {
-        await Promise.allSettled(
-            produtosReservados.map(produtoId => definirReservaAPI(produtoId, 0))
+        const liberacao = new Map(
+            [...desejadoPorProduto.keys()].map(produtoId => [produtoId, 0])
         );
+        await definirReservasAPI(liberacao).catch(() => {});
         throw erro;
     }
 
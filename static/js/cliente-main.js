@@ -297,6 +297,7 @@ function criarControleReserva({
 let socket = null;
 if (socketSuportado) {
   socket = io({
+      auth: { papel: 'cliente' },
       reconnection: true,
       reconnectionDelay: 800,
       reconnectionDelayMax: 5000,
@@ -3,9 +3,9 @@
 
     const DURACAO_ANIMACAO_MS = 7200;
     const TEMPO_LIMITE_ANIMACAO_MS = DURACAO_ANIMACAO_MS + 700;
-    const INTERVALO_ATUALIZACAO_MS = 15000;
     const MAX_PEDIDOS_PREPARANDO = 8;
     const MAX_PEDIDOS_PRONTOS = 6;
+    const INTERVALO_CONFERENCIA_MS = 45000;
 
     const listaPreparando = document.getElementById("lista-preparando");
     const listaPronto = document.getElementById("lista-pronto");
@@ -29,8 +29,6 @@
     }
 
     let monitorInicializado = false;
-    let carregamentoEmAndamento = false;
-    let atualizacaoPendente = false;
     let animacaoEmAndamento = false;
     let idsProntosConhecidos = new Set();
     let idsRenderizados = new Set();
@@ -289,63 +287,34 @@
         statusConexao.dataset.state = online ? "online" : "offline";
     }
 
-    async function buscarPedidos() {
-        const resposta = await fetch("/api/pedidos_ativos", {
-            cache: "no-store",
-            headers: { Accept: "application/json" },
-        });
-
-        if (!resposta.ok) {
-            throw new Error(`Servidor respondeu com status ${resposta.status}.`);
-        }
-
-        const pedidos = await resposta.json();
-        if (!Array.isArray(pedidos)) {
-            throw new Error("A resposta de pedidos ativos é inválida.");
-        }
-
-        return pedidos;
-    }
-
-    async function carregarEAtualizarMonitor() {
-        if (carregamentoEmAndamento) {
-            atualizacaoPendente = true;
-            return;
-        }
-
-        carregamentoEmAndamento = true;
-
-        try {
-            do {
-                atualizacaoPendente = false;
-
-                try {
-                    const pedidos = await buscarPedidos();
-                    aplicarPedidos(pedidos);
-                    definirStatusConexao(true);
-                } catch (erro) {
-                    definirStatusConexao(false);
-                    console.error("Erro ao atualizar o monitor:", erro);
-                }
-            } while (atualizacaoPendente);
-        } finally {
-            carregamentoEmAndamento = false;
-        }
-    }
-
     const socket = window.io({
+        auth: { papel: "monitor" },
         reconnection: true,
         reconnectionDelay: 800,
         reconnectionDelayMax: 5000,
     });
 
-    socket.on("connect", () => {
-        definirStatusConexao(true);
-        void carregarEAtualizarMonitor();
+    // A lista completa só é buscada na conexão ou quando falta alguma versão;
+    // cada mudança de status chega como um delta do pedido alterado. Uma
+    // conferência lenta da versão cobre o último delta perdido.
+    const sincronizador = window.criarSincronizadorPedidos({
+        socket,
+        aoAtualizar: (pedidos) => {
+            aplicarPedidos(pedidos);
+            definirStatusConexao(true);
+        },
+        aoFalhar: (erro) => {
+            definirStatusConexao(false);
+            console.error("Erro ao atualizar o monitor:", erro);
+        },
     });
 
-    socket.on("novo_pedido", () => {
-        void carregarEAtualizarMonitor();
+    function carregarEAtualizarMonitor() {
+        return sincronizador.recarregar();
+    }
+
+    socket.on("connect", () => {
+        definirStatusConexao(true);
     });
 
     socket.on("disconnect", () => {
@@ -356,13 +325,13 @@
         definirStatusConexao(false);
     });
 
-    window.setInterval(() => {
-        void carregarEAtualizarMonitor();
-    }, INTERVALO_ATUALIZACAO_MS);
-
     document.addEventListener("visibilitychange", () => {
         if (!document.hidden) void carregarEAtualizarMonitor();
     });
 
+    setInterval(() => {
+        if (!document.hidden) void sincronizador.conferir();
+    }, INTERVALO_CONFERENCIA_MS);
+
     void carregarEAtualizarMonitor();
 })();
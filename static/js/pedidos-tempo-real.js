@@ -0,0 +1,152 @@
+// static/js/pedidos-tempo-real.js
+
+/**
+ * Mantém a lista de pedidos ativos sincronizada com o servidor aplicando os
+ * eventos 'pedido_delta' em vez de recarregar tudo a cada alteração.
+ *
+ * A lista completa só é buscada na conexão, em uma reconexão, quando o
+ * servidor reinicia (sessão diferente) ou quando falta alguma versão. Os
+ * deltas que chegam durante uma recarga ficam guardados e são reaplicados
+ * depois dela, pois cada um traz o estado completo do pedido.
+ *
+ * `conferir()` pede só a versão ao servidor e recarrega se ela passou da
+ * local: cobre o último delta perdido, que nenhum delta seguinte denunciaria.
+ */
+(() => {
+    "use strict";
+
+    const ORDEM_STATUS = {
+        aguardando_pagamento: 1,
+        aguardando_producao: 2,
+        aguardando_retirada: 3,
+        em_producao: 4,
+    };
+
+    // Mesma ordem de gerenciador_db.obter_pedidos_ativos.
+    function compararPedidos(a, b) {
+        const porStatus = (ORDEM_STATUS[a.status] || 9) - (ORDEM_STATUS[b.status] || 9);
+        if (porStatus) return porStatus;
+        const instanteA = a.timestamp_pagamento || a.timestamp_criacao || "";
+        const instanteB = b.timestamp_pagamento || b.timestamp_criacao || "";
+        if (instanteA !== instanteB) return instanteA < instanteB ? -1 : 1;
+        return Number(a.id) - Number(b.id);
+    }
+
+    function criarSincronizadorPedidos({ socket, aoAtualizar, aoFalhar = () => {} }) {
+        const pedidos = new Map();
+        let versao = null;
+        let sessao = null;
+        let carregando = false;
+        let recargaPendente = false;
+        let deltasDuranteRecarga = [];
+
+        const listaOrdenada = () => [...pedidos.values()].sort(compararPedidos);
+
+        function aplicarDelta(delta) {
+            if (delta.tipo === "pedido_removido" || !delta.pedido) {
+                pedidos.delete(String(delta.pedido_id));
+            } else {
+                pedidos.set(String(delta.pedido.id), delta.pedido);
+            }
+            versao = delta.versao;
+        }
+
+        async function buscarTudo() {
+            const resposta = await fetch("/api/pedidos_ativos", {
+                cache: "no-store",
+                headers: { Accept: "application/json" },
+            });
+            if (!resposta.ok) {
+                throw new Error(`Servidor respondeu com status ${resposta.status}.`);
+            }
+            const lista = await resposta.json();
+            if (!Array.isArray(lista)) {
+                throw new Error("A resposta de pedidos ativos é inválida.");
+            }
+
+            pedidos.clear();
+            lista.forEach((pedido) => pedidos.set(String(pedido.id), pedido));
+            versao = Number(resposta.headers.get("X-Pedidos-Versao") || 0);
+            sessao = resposta.headers.get("X-Pedidos-Sessao");
+        }
+
+        async function recarregar() {
+            if (carregando) {
+                recargaPendente = true;
+                return;
+            }
+            carregando = true;
+
+            try {
+                do {
+                    recargaPendente = false;
+                    deltasDuranteRecarga = [];
+                    try {
+                        await buscarTudo();
+                        deltasDuranteRecarga
+                            .filter((delta) => delta.sessao === sessao && delta.versao > versao)
+                            .sort((a, b) => a.versao - b.versao)
+                            .forEach(aplicarDelta);
+                        aoAtualizar(listaOrdenada());
+                    } catch (erro) {
+                        versao = null;
+                        aoFalhar(erro);
+                    }
+                } while (recargaPendente);
+            } finally {
+                deltasDuranteRecarga = [];
+                carregando = false;
+            }
+        }
+
+        async function conferir() {
+            if (carregando) return;
+            try {
+                const resposta = await fetch("/api/pedidos_ativos/versao", {
+                    cache: "no-store",
+                    headers: { Accept: "application/json" },
+                });
+                if (!resposta.ok) {
+                    throw new Error(`Servidor respondeu com status ${resposta.status}.`);
+                }
+                const servidor = await resposta.json();
+                if (
+                    versao === null ||
+                    servidor.sessao !== sessao ||
+                    Number(servidor.versao) > versao
+                ) {
+                    await recarregar();
+                }
+            } catch (erro) {
+                aoFalhar(erro);
+            }
+        }
+
+        socket.on("connect", () => {
+            void recarregar();
+        });
+
+        socket.on("pedido_delta", (delta) => {
+            if (carregando) {
+                deltasDuranteRecarga.push(delta);
+                return;
+            }
+            if (versao === null || delta.sessao !== sessao || delta.versao > versao + 1) {
+                void recarregar();
+                return;
+            }
+            if (delta.versao <= versao) return;
+
+            aplicarDelta(delta);
+            aoAtualizar(listaOrdenada());
+        });
+
+        return {
+            recarregar,
+            conferir,
+            obterPedidos: listaOrdenada,
+        };
+    }
+
+    window.criarSincronizadorPedidos = criarSincronizadorPedidos;
+})();
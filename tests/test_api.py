@@ -1,9 +1,13 @@
+import gzip
 import importlib
 import os
 import re
 import tempfile
+import threading
 import unittest
+from contextlib import closing
 from datetime import datetime
+from unittest.mock import patch
 from zoneinfo import ZoneInfo
 
 import database
@@ -28,6 +32,7 @@ class APITestCase(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
+        database.drenar_pool()
         os.environ.pop("ESPETAO_DB_PATH", None)
         cls.temp_dir.cleanup()
 
@@ -45,6 +50,49 @@ class APITestCase(unittest.TestCase):
         self.assertIn('data-method="cartao_credito"', cozinha)
         self.assertIn('id="pagamento-modal-confirmar"', cozinha)
 
+    def test_fechamento_calcula_apenas_as_secoes_pedidas(self):
+        analytics = self.modulo_app.analytics
+        with patch.object(
+            analytics,
+            "_movimentacao_estoque_produtos",
+            side_effect=AssertionError("estoque não pedido"),
+        ), patch.object(
+            analytics,
+            "_resumos_operacoes",
+            side_effect=AssertionError("frequência não pedida"),
+        ):
+            resposta = self.client.get(
+                "/api/fechamento_dia_v2?data=2001-02-03&secoes=kpis"
+            )
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json["secoes"], ["kpis"])
+        self.assertIn("desempenhoPorHora", resposta.json)
+        for chave in ("estoque", "analiseProdutos", "historico_pedidos", "itens_top"):
+            self.assertNotIn(chave, resposta.json)
+
+        resposta = self.client.get(
+            "/api/fechamento_dia_v2?data=2001-02-03&campos=estoque,historico"
+        )
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(resposta.json["secoes"], ["estoque", "historico"])
+        self.assertIn("estoque", resposta.json)
+        self.assertEqual(resposta.json["historico_pedidos"]["total"], 0)
+        self.assertNotIn("kpis", resposta.json)
+
+        resposta = self.client.get(
+            "/api/fechamento_dia_v2?data=2001-02-03&secoes=kpis,inexistente"
+        )
+        self.assertEqual(resposta.status_code, 400)
+        self.assertIn("inexistente", resposta.json["erro"])
+
+        resposta = self.client.get(
+            "/api/fechamento_dia_v2?data=2001-02-03&secoes=kpis&pontos=10"
+        )
+        self.assertEqual(resposta.status_code, 200)
+        serie = resposta.json["vendasPorPeriodo"]
+        self.assertEqual(len(serie["labels"]), 10)
+        self.assertEqual(serie["pontosOriginais"], 96)
+
     def test_fluxo_http_usa_valores_do_servidor(self):
         resposta = self.client.post(
             "/salvar_pedido",
@@ -100,6 +148,29 @@ class APITestCase(unittest.TestCase):
         )
         self.assertTrue(fechamento.json["resumoExecutivo"]["insights"])
         self.assertEqual(len(fechamento.json["desempenhoPorHora"]), 24)
+        historico = self.client.get(
+            f"/api/historico_eventos?data={dia}&metodo=pix&limit=1"
+        )
+        self.assertEqual(historico.status_code, 200)
+        self.assertEqual(historico.json["items"][0]["id"], pedido["id"])
+        self.assertEqual(
+            historico.json["items"][0]["itens"][0]["nome"], "Produto API"
+        )
+        self.assertEqual(
+            self.client.get(
+                f"/api/historico_eventos?data={dia}&cursor=invalido"
+            ).status_code,
+            400,
+        )
+        exportado = self.client.get(f"/api/exportar/itens?data={dia}&gzip=1")
+        self.assertEqual(exportado.status_code, 200)
+        self.assertIn("attachment", exportado.headers["Content-Disposition"])
+        conteudo = gzip.decompress(exportado.get_data()).decode()
+        self.assertIn("Produto API", conteudo)
+        self.assertEqual(
+            self.client.get(f"/api/exportar/clientes?data={dia}").status_code,
+            400,
+        )
         locais = self.client.get(
             f"/api/insights/locais?local_ids={self.local_id}&amostra=historico"
         )
@@ -317,6 +388,273 @@ class APITestCase(unittest.TestCase):
             5,
         )
 
+    def test_api_reserva_varios_itens_com_um_unico_aviso(self):
+        primeiro_id = db.adicionar_novo_produto(
+            "Produto Lote A", None, None, 7.00, 4, 2.00, 1, 0
+        )
+        segundo_id = db.adicionar_novo_produto(
+            "Produto Lote B", None, None, 7.00, 2, 2.00, 1, 0
+        )
+        self.modulo_app.agregador_disponibilidade.descarregar()
+        socket = self.modulo_app.socketio.test_client(self.modulo_app.app)
+        socket.get_received()
+
+        resposta = self.client.post(
+            "/api/carrinho/itens",
+            json={
+                "carrinho_id": "reserva-lote-api",
+                "itens": {str(primeiro_id): 3, str(segundo_id): 5},
+            },
+        )
+        self.modulo_app.agregador_disponibilidade.descarregar()
+        eventos = [
+            evento
+            for evento in socket.get_received()
+            if evento["name"] == "atualizacao_disponibilidade"
+        ]
+        socket.disconnect()
+
+        self.assertEqual(resposta.status_code, 200)
+        reservas = {
+            item["produto_id"]: item["quantidade_reservada"]
+            for item in resposta.json["reservas"]
+        }
+        self.assertEqual(reservas, {primeiro_id: 3, segundo_id: 2})
+        self.assertEqual(len(eventos), 1)
+        self.assertEqual(eventos[0]["args"][0]["origem"], "reserva_itens")
+        self.assertEqual(len(eventos[0]["args"][0]["updates"]), 2)
+        self.assertEqual(
+            self.client.post(
+                "/api/carrinho/itens", json={"carrinho_id": "reserva-lote-api"}
+            ).status_code,
+            400,
+        )
+        self.client.post(
+            "/api/carrinho/itens",
+            json={
+                "carrinho_id": "reserva-lote-api",
+                "itens": {str(primeiro_id): 0, str(segundo_id): 0},
+            },
+        )
+
+    def test_agregador_emite_um_lote_com_o_valor_mais_recente(self):
+        agregador = self.modulo_app.AgregadorDisponibilidade(janela_ms=50)
+        socket = self.modulo_app.socketio.test_client(self.modulo_app.app)
+        socket.get_received()
+
+        agregador.adicionar([{"produto_id": 1, "disponivel": 5}], "reserva_item")
+        agregador.adicionar([{"produto_id": 1, "disponivel": 4}], "reserva_item")
+        agregador.adicionar(
+            [{"produto_id": 1, "disponivel": 3}, {"produto_id": 2, "disponivel": 9}],
+            "novo_pedido",
+        )
+        primeiro = agregador.descarregar()
+        agregador.adicionar([{"produto_id": 2, "disponivel": 8}], "reserva_item")
+        segundo = agregador.descarregar()
+        self.assertIsNone(agregador.descarregar())
+        eventos = [
+            evento["args"][0]
+            for evento in socket.get_received()
+            if evento["name"] == "atualizacao_disponibilidade"
+        ]
+        socket.disconnect()
+
+        self.assertEqual(eventos, [primeiro, segundo])
+        self.assertEqual(primeiro["origem"], "agrupado")
+        self.assertEqual(primeiro["origens"], ["reserva_item", "novo_pedido"])
+        self.assertEqual(
+            primeiro["updates"],
+            [{"produto_id": 1, "disponivel": 3}, {"produto_id": 2, "disponivel": 9}],
+        )
+        self.assertGreater(segundo["version"], primeiro["version"])
+        estatisticas = agregador.estatisticas()
+        self.assertEqual(estatisticas["atualizacoes_recebidas"], 4)
+        self.assertEqual(estatisticas["lotes_emitidos"], 2)
+        self.assertEqual(estatisticas["mensagens_economizadas"], 2)
+        self.assertEqual(estatisticas["valores_substituidos"], 2)
+        diagnostico = self.client.get("/api/diagnostico/tempo_real")
+        self.assertEqual(diagnostico.status_code, 200)
+        self.assertIn("mensagens_economizadas", diagnostico.json["disponibilidade"])
+
+    def test_pedidos_emitem_deltas_versionados_em_vez_de_recarga(self):
+        produto_id = db.adicionar_novo_produto(
+            "Produto Delta", None, None, 6.00, 3, 2.00, 1, 0
+        )
+        socket = self.modulo_app.socketio.test_client(self.modulo_app.app)
+        socket.get_received()
+        lista = self.client.get("/api/pedidos_ativos")
+        versao_inicial = int(lista.headers["X-Pedidos-Versao"])
+        sessao = lista.headers["X-Pedidos-Sessao"]
+
+        criacao = self.client.post(
+            "/salvar_pedido",
+            json={
+                "nome_cliente": "Cliente Delta",
+                "itens": [{"id": produto_id, "quantidade": 1}],
+                "metodo_pagamento": "pix",
+                "modalidade": "local",
+            },
+        )
+        self.assertEqual(criacao.status_code, 200)
+        pedido_id = next(
+            pedido["id"]
+            for pedido in db.obter_pedidos_ativos()
+            if pedido["nome_cliente"] == "Cliente Delta"
+        )
+        self.client.post(f"/pedido/confirmar_pagamento/{pedido_id}")
+        self.client.post(f"/pedido/cancelar/{pedido_id}")
+        deltas = [
+            evento["args"][0]
+            for evento in socket.get_received()
+            if evento["name"] == "pedido_delta"
+        ]
+        socket.disconnect()
+
+        self.assertEqual(
+            [delta["tipo"] for delta in deltas],
+            ["pedido_criado", "status_alterado", "pedido_removido"],
+        )
+        self.assertEqual(
+            [delta["versao"] for delta in deltas],
+            [versao_inicial + 1, versao_inicial + 2, versao_inicial + 3],
+        )
+        self.assertTrue(all(delta["sessao"] == sessao for delta in deltas))
+        self.assertEqual(deltas[0]["pedido"]["status"], "aguardando_pagamento")
+        self.assertEqual(deltas[0]["pedido"]["itens"][0]["id"], produto_id)
+        self.assertEqual(deltas[1]["pedido"]["status"], "aguardando_retirada")
+        self.assertIsNone(deltas[2]["pedido"])
+        self.assertEqual(deltas[2]["pedido_id"], pedido_id)
+        self.assertEqual(
+            int(
+                self.client.get("/api/pedidos_ativos").headers["X-Pedidos-Versao"]
+            ),
+            versao_inicial + 3,
+        )
+        conferencia = self.client.get("/api/pedidos_ativos/versao")
+        self.assertEqual(
+            conferencia.json, {"versao": versao_inicial + 3, "sessao": sessao}
+        )
+
+    def test_delta_de_versao_maior_nunca_traz_estado_mais_antigo(self):
+        app_modulo = self.modulo_app
+        leitura_a_comecou = threading.Event()
+        liberar_a = threading.Event()
+        estados = iter(["em_producao", "aguardando_retirada"])
+
+        def ler_pedido(pedido_id):
+            estado = next(estados)
+            if estado == "em_producao":
+                leitura_a_comecou.set()
+                liberar_a.wait(5)
+            return {"id": pedido_id, "status": estado}
+
+        deltas = {}
+        with patch.object(app_modulo.gerenciador_db, "obter_pedido_por_id", ler_pedido):
+            primeiro = threading.Thread(
+                target=lambda: deltas.update(a=app_modulo.emitir_delta_pedido(1))
+            )
+            primeiro.start()
+            self.assertTrue(leitura_a_comecou.wait(5))
+            segundo = threading.Thread(
+                target=lambda: deltas.update(b=app_modulo.emitir_delta_pedido(1))
+            )
+            segundo.start()
+            # O segundo delta espera a leitura do primeiro terminar.
+            segundo.join(0.2)
+            self.assertTrue(segundo.is_alive())
+            liberar_a.set()
+            primeiro.join(5)
+            segundo.join(5)
+
+        self.assertEqual(deltas["b"]["versao"], deltas["a"]["versao"] + 1)
+        self.assertEqual(deltas["a"]["pedido"]["status"], "em_producao")
+        self.assertEqual(deltas["b"]["pedido"]["status"], "aguardando_retirada")
+
+    def test_eventos_chegam_apenas_as_salas_que_os_consomem(self):
+        app_modulo = self.modulo_app
+        app_modulo.agregador_disponibilidade.descarregar()
+        totem = app_modulo.socketio.test_client(
+            app_modulo.app, auth={"papel": "cliente"}
+        )
+        cozinha = app_modulo.socketio.test_client(
+            app_modulo.app, auth={"papel": "cozinha"}
+        )
+        monitor = app_modulo.socketio.test_client(
+            app_modulo.app, auth={"papel": "monitor"}
+        )
+        diagnostico = self.client.get("/api/diagnostico/tempo_real").json["socket"]
+        self.assertGreaterEqual(diagnostico["salas"]["cliente"], 1)
+        self.assertGreaterEqual(diagnostico["salas"]["cozinha"], 1)
+        self.assertGreaterEqual(diagnostico["salas"]["monitor"], 1)
+        self.assertEqual(
+            diagnostico["destinatarios_por_evento"]["pedido_delta"],
+            diagnostico["salas"]["cozinha"] + diagnostico["salas"]["monitor"],
+        )
+        for cliente in (totem, cozinha, monitor):
+            cliente.get_received()
+
+        app_modulo.emit_estoque_atualizado(
+            [{"produto_id": self.produto_id, "disponivel": 1}], "teste_salas"
+        )
+        app_modulo.agregador_disponibilidade.descarregar()
+        app_modulo.emitir_delta_pedido(999_999)
+
+        recebidos = {
+            nome: sorted({evento["name"] for evento in cliente.get_received()})
+            for nome, cliente in (
+                ("cliente", totem),
+                ("cozinha", cozinha),
+                ("monitor", monitor),
+            )
+        }
+        conexoes = diagnostico["conexoes"]
+        for cliente in (totem, cozinha, monitor):
+            cliente.disconnect()
+
+        self.assertEqual(recebidos["cliente"], ["atualizacao_disponibilidade"])
+        self.assertEqual(recebidos["cozinha"], ["pedido_delta"])
+        self.assertEqual(recebidos["monitor"], ["pedido_delta"])
+        self.assertEqual(
+            self.client.get("/api/diagnostico/tempo_real").json["socket"]["conexoes"],
+            conexoes - 3,
+        )
+
+    def test_varredura_emite_estoque_liberado_por_reserva_vencida(self):
+        produto_id = db.adicionar_novo_produto(
+            "Produto Varredura", None, None, 7.00, 4, 2.00, 1, 0
+        )
+        self.assertEqual(
+            db.definir_reserva("varredura-api", produto_id, 3)[
+                "quantidade_reservada"
+            ],
+            3,
+        )
+        with closing(database.conectar()) as conn:
+            conn.execute(
+                "UPDATE reservas_carrinho SET expires_at = ? WHERE carrinho_id = ?",
+                ("2000-01-01T00:00:00+00:00", "varredura-api"),
+            )
+            conn.commit()
+
+        self.modulo_app.agregador_disponibilidade.descarregar()
+        socket = self.modulo_app.socketio.test_client(self.modulo_app.app)
+        socket.get_received()
+        resultado = self.modulo_app.varrer_reservas_expiradas()
+        self.assertEqual(resultado["reservas_expiradas"], 1)
+        self.modulo_app.agregador_disponibilidade.descarregar()
+        eventos = [
+            evento
+            for evento in socket.get_received()
+            if evento["name"] == "atualizacao_disponibilidade"
+        ]
+        socket.disconnect()
+        self.assertEqual(len(eventos), 1)
+        self.assertEqual(eventos[0]["args"][0]["origem"], "reserva_expirada")
+        self.assertEqual(
+            eventos[0]["args"][0]["updates"],
+            [{"produto_id": produto_id, "disponivel": 4}],
+        )
+
     def test_zeragem_http_individual_e_global(self):
         produto_id = db.adicionar_novo_produto(
             "Produto Zeragem HTTP", None, None, 9.00, 6, 3.00, 1, 0
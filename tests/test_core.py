@@ -1,15 +1,24 @@
+import csv
+import gzip
+import io
+import json
 import os
+import random
 import sqlite3
 import tempfile
+import threading
+import time
 import unittest
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from unittest.mock import patch
 
 import analytics
 import database
+import exportacao
 import gerenciador_db as db
 
 
@@ -29,6 +38,7 @@ class PDVTestCase(unittest.TestCase):
         self.produto_id = db.obter_todos_produtos_para_gestao()[0]["id"]
 
     def tearDown(self):
+        database.drenar_pool()
         os.environ.pop("ESPETAO_DB_PATH", None)
         self.temp_dir.cleanup()
 
@@ -116,6 +126,82 @@ class PDVTestCase(unittest.TestCase):
                 <= colunas_movimento
             )
 
+    def test_pool_reaproveita_conexoes_configuradas_e_drena(self):
+        pool = database.PoolConexoes(maximo_ociosas=1)
+        primeira = pool.obter(self.db_path)
+        primeira.execute("BEGIN IMMEDIATE")
+        primeira.close()
+        segunda = pool.obter(self.db_path)
+        self.assertIs(segunda, primeira)
+        self.assertFalse(segunda.in_transaction)
+        self.assertEqual(segunda.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+        self.assertEqual(segunda.execute("PRAGMA busy_timeout").fetchone()[0], 15000)
+
+        terceira = pool.obter(self.db_path)
+        self.assertIsNot(terceira, segunda)
+        segunda.close()
+        terceira.close()
+        self.assertEqual(pool.estatisticas()["livres"], 1)
+        self.assertEqual(pool.estatisticas()["em_uso"], 0)
+
+        emprestada = pool.obter(self.db_path)
+        self.assertEqual(pool.drenar(), 0)
+        emprestada.close()
+        self.assertEqual(pool.estatisticas()["livres"], 0)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            emprestada.execute("SELECT 1")
+
+        self.assertTrue(db.adicionar_local("Loja Pool"))
+        self.assertIn(
+            "Loja Pool", {local["nome"] for local in db.obter_todos_locais()}
+        )
+
+    def test_conexao_analitica_so_le_e_usa_perfil_proprio(self):
+        with closing(database.obter_conexao_analitica()) as conn:
+            pragmas = {
+                nome: conn.execute(f"PRAGMA {nome}").fetchone()[0]
+                for nome in ("query_only", "mmap_size", "cache_size", "temp_store")
+            }
+            self.assertEqual(conn.execute("PRAGMA foreign_keys").fetchone()[0], 1)
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("INSERT INTO locais (nome) VALUES ('Relatório')")
+        self.assertEqual(
+            pragmas,
+            {
+                "query_only": 1,
+                "mmap_size": 268435456,
+                "cache_size": -16384,
+                "temp_store": 2,
+            },
+        )
+        with closing(database.obter_conexao()) as conn:
+            self.assertEqual(conn.execute("PRAGMA query_only").fetchone()[0], 0)
+
+        # Sem resumo gravado, a leitura pela conexão analítica calcula a visita
+        # sem liberar escrita.
+        operacao_id = db.iniciar_operacao(self.local_id)
+        self.assertTrue(db.encerrar_operacao(operacao_id))
+        with closing(database.conectar()) as conn:
+            with conn:
+                conn.execute(
+                    "DELETE FROM operacao_resumo WHERE operacao_id = ?",
+                    (operacao_id,),
+                )
+        with analytics._conexao() as conn:
+            operacao = conn.execute(
+                "SELECT * FROM operacoes WHERE id = ?", (operacao_id,)
+            ).fetchone()
+            self.assertIn(operacao_id, analytics._resumos_operacoes(conn, [operacao]))
+            self.assertEqual(conn.execute("PRAGMA query_only").fetchone()[0], 1)
+        with closing(database.conectar()) as conn:
+            self.assertEqual(
+                conn.execute(
+                    "SELECT COUNT(*) FROM operacao_resumo WHERE operacao_id = ?",
+                    (operacao_id,),
+                ).fetchone()[0],
+                0,
+            )
+
     def test_extensao_de_visibilidade_preserva_banco_v2_existente(self):
         caminho_v2 = os.path.join(self.temp_dir.name, "schema-v2.db")
         conn = sqlite3.connect(caminho_v2)
@@ -265,10 +351,538 @@ class PDVTestCase(unittest.TestCase):
                 ),
                 (-2, 350, 1),
             )
+            tempo = migrado.execute(
+                """
+                SELECT created_epoch, dia_operacional
+                FROM estoque_movimentacoes WHERE id = 1
+                """
+            ).fetchone()
+            self.assertEqual(tuple(tempo), (1767225600, "2025-12-31"))
+            self.assertEqual(
+                migrado.execute("SELECT MAX(version) FROM schema_version").fetchone()[0],
+                database.SCHEMA_VERSION,
+            )
+
+    def test_migracao_v5_ate_v9_preserva_historico_e_preenche_derivados(self):
+        caminho_v5 = os.path.join(self.temp_dir.name, "schema-v5.db")
+        conn = sqlite3.connect(caminho_v5)
+        try:
+            conn.executescript(
+                """
+                CREATE TABLE schema_version(
+                    version INTEGER PRIMARY KEY, applied_at TEXT NOT NULL
+                );
+                CREATE TABLE locais(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    nome TEXT NOT NULL UNIQUE
+                );
+                CREATE TABLE categorias(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    nome TEXT NOT NULL UNIQUE,
+                    ordem INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE produtos(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    nome TEXT NOT NULL UNIQUE,
+                    descricao TEXT,
+                    foto_url TEXT,
+                    preco_centavos INTEGER NOT NULL,
+                    categoria_id INTEGER REFERENCES categorias(id),
+                    ordem INTEGER NOT NULL DEFAULT 0,
+                    requer_preparo INTEGER NOT NULL DEFAULT 0,
+                    ativo INTEGER NOT NULL DEFAULT 1,
+                    ocultar_quando_esgotado INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE operacoes(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    local_id INTEGER NOT NULL REFERENCES locais(id),
+                    iniciada_em TEXT NOT NULL,
+                    encerrada_em TEXT,
+                    status TEXT NOT NULL DEFAULT 'aberta',
+                    origem TEXT NOT NULL DEFAULT 'real'
+                );
+                CREATE TABLE operacao_estoque(
+                    operacao_id INTEGER NOT NULL REFERENCES operacoes(id),
+                    produto_id INTEGER NOT NULL REFERENCES produtos(id),
+                    quantidade_inicial INTEGER NOT NULL DEFAULT 0,
+                    quantidade_final INTEGER,
+                    ativo_no_inicio INTEGER NOT NULL DEFAULT 1,
+                    PRIMARY KEY (operacao_id, produto_id)
+                );
+                CREATE TABLE pedidos(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    nome_cliente TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    metodo_pagamento TEXT NOT NULL,
+                    modalidade TEXT NOT NULL,
+                    valor_total_centavos INTEGER NOT NULL,
+                    timestamp_criacao TEXT NOT NULL,
+                    timestamp_pagamento TEXT,
+                    timestamp_finalizacao TEXT,
+                    timestamp_cancelamento TEXT,
+                    senha_diaria INTEGER NOT NULL,
+                    fluxo_simples INTEGER NOT NULL DEFAULT 0,
+                    local_id INTEGER NOT NULL REFERENCES locais(id),
+                    operacao_id INTEGER REFERENCES operacoes(id)
+                );
+                CREATE TABLE pedido_itens(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    pedido_id INTEGER NOT NULL REFERENCES pedidos(id),
+                    produto_id INTEGER NOT NULL REFERENCES produtos(id),
+                    nome_produto TEXT NOT NULL,
+                    preco_unitario_centavos INTEGER NOT NULL,
+                    custo_unitario_centavos INTEGER NOT NULL,
+                    quantidade INTEGER NOT NULL,
+                    categoria_nome TEXT NOT NULL,
+                    customizacao_json TEXT,
+                    requer_preparo INTEGER NOT NULL DEFAULT 0,
+                    timestamp_inicio_item TEXT,
+                    categoria_ordem INTEGER NOT NULL DEFAULT 0,
+                    produto_ordem INTEGER NOT NULL DEFAULT 0,
+                    uid TEXT NOT NULL,
+                    custo_total_centavos INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE pagamentos(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    pedido_id INTEGER NOT NULL REFERENCES pedidos(id),
+                    tipo TEXT NOT NULL,
+                    metodo TEXT NOT NULL,
+                    valor_centavos INTEGER NOT NULL,
+                    taxa_centavos INTEGER NOT NULL DEFAULT 0,
+                    ocorrido_em TEXT NOT NULL,
+                    UNIQUE (pedido_id, tipo)
+                );
+                CREATE TABLE estoque_lotes(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    produto_id INTEGER NOT NULL REFERENCES produtos(id),
+                    quantidade_inicial INTEGER NOT NULL,
+                    custo_unitario_centavos INTEGER NOT NULL,
+                    tipo TEXT NOT NULL,
+                    observacao TEXT,
+                    recebido_em TEXT NOT NULL
+                );
+                CREATE TABLE estoque_movimentacoes(
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    produto_id INTEGER NOT NULL REFERENCES produtos(id),
+                    pedido_id INTEGER REFERENCES pedidos(id),
+                    tipo TEXT NOT NULL,
+                    quantidade INTEGER NOT NULL,
+                    custo_unitario_centavos INTEGER NOT NULL,
+                    observacao TEXT,
+                    created_at TEXT NOT NULL,
+                    pedido_item_id INTEGER REFERENCES pedido_itens(id),
+                    lote_id INTEGER REFERENCES estoque_lotes(id),
+                    movimento_origem_id INTEGER
+                        REFERENCES estoque_movimentacoes(id),
+                    impacta_relatorio INTEGER NOT NULL DEFAULT 1
+                );
+                INSERT INTO schema_version(version, applied_at)
+                VALUES (5, '2026-03-01T00:00:00+00:00');
+                INSERT INTO locais(id, nome) VALUES (1, 'Loja Antiga');
+                INSERT INTO categorias(id, nome, ordem) VALUES (1, 'Espetos', 0);
+                INSERT INTO produtos(id, nome, preco_centavos, categoria_id)
+                VALUES (1, 'Espeto Antigo', 1000, 1);
+                INSERT INTO estoque_lotes(
+                    id, produto_id, quantidade_inicial,
+                    custo_unitario_centavos, tipo, recebido_em
+                ) VALUES (1, 1, 10, 400, 'compra', '2026-03-10T18:00:00+00:00');
+                INSERT INTO operacoes(
+                    id, local_id, iniciada_em, encerrada_em, status
+                ) VALUES (
+                    1, 1, '2026-03-10T20:00:00+00:00',
+                    '2026-03-11T02:00:00+00:00', 'encerrada'
+                );
+                INSERT INTO operacao_estoque(
+                    operacao_id, produto_id, quantidade_inicial, quantidade_final
+                ) VALUES (1, 1, 10, 7);
+                INSERT INTO pedidos(
+                    id, nome_cliente, status, metodo_pagamento, modalidade,
+                    valor_total_centavos, timestamp_criacao, timestamp_pagamento,
+                    senha_diaria, local_id, operacao_id
+                ) VALUES (
+                    1, 'Cliente Antigo', 'finalizado', 'pix', 'local', 2000,
+                    '2026-03-10T21:10:00+00:00', '2026-03-10T21:11:00+00:00',
+                    1, 1, 1
+                );
+                INSERT INTO pedido_itens(
+                    id, pedido_id, produto_id, nome_produto,
+                    preco_unitario_centavos, custo_unitario_centavos, quantidade,
+                    categoria_nome, uid, custo_total_centavos
+                ) VALUES (
+                    1, 1, 1, 'Espeto Antigo', 1000, 400, 2, 'Espetos', 'item-1', 800
+                );
+                INSERT INTO pagamentos(
+                    id, pedido_id, tipo, metodo, valor_centavos, taxa_centavos,
+                    ocorrido_em
+                ) VALUES (
+                    1, 1, 'pagamento', 'pix', 2000, 20, '2026-03-10T21:11:00+00:00'
+                );
+                INSERT INTO estoque_movimentacoes(
+                    id, produto_id, pedido_id, tipo, quantidade,
+                    custo_unitario_centavos, created_at, pedido_item_id, lote_id
+                ) VALUES (
+                    1, 1, 1, 'venda', -2, 400, '2026-03-10T21:11:00+00:00', 1, 1
+                );
+                INSERT INTO estoque_movimentacoes(
+                    id, produto_id, tipo, quantidade, custo_unitario_centavos,
+                    created_at, lote_id
+                ) VALUES (2, 1, 'perda', -1, 400, '2026-03-11T01:30:00+00:00', 1);
+                """
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+        database.inicializar_banco(caminho_v5)
+
+        def epoch(instante):
+            return int(datetime.fromisoformat(instante).timestamp())
+
+        with closing(database.conectar(caminho_v5)) as migrado:
             self.assertEqual(
                 migrado.execute("SELECT MAX(version) FROM schema_version").fetchone()[0],
                 database.SCHEMA_VERSION,
             )
+            self.assertEqual(
+                [
+                    migrado.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+                    for tabela in (
+                        "pedidos",
+                        "pedido_itens",
+                        "pagamentos",
+                        "estoque_movimentacoes",
+                        "operacoes",
+                    )
+                ],
+                [1, 1, 1, 2, 1],
+            )
+            pedido = migrado.execute(
+                "SELECT criado_epoch, dia_operacional FROM pedidos WHERE id = 1"
+            ).fetchone()
+            self.assertEqual(
+                tuple(pedido), (epoch("2026-03-10T21:10:00+00:00"), "2026-03-10")
+            )
+            pagamento = migrado.execute(
+                """
+                SELECT valor_centavos, ocorrido_epoch, dia_operacional,
+                       hora_local, dia_semana_local
+                FROM pagamentos WHERE id = 1
+                """
+            ).fetchone()
+            self.assertEqual(
+                tuple(pagamento),
+                (2000, epoch("2026-03-10T21:11:00+00:00"), "2026-03-10", 18, 1),
+            )
+            movimentos = migrado.execute(
+                """
+                SELECT created_epoch, dia_operacional
+                FROM estoque_movimentacoes ORDER BY id
+                """
+            ).fetchall()
+            self.assertEqual(
+                [tuple(row) for row in movimentos],
+                [
+                    (epoch("2026-03-10T21:11:00+00:00"), "2026-03-10"),
+                    (epoch("2026-03-11T01:30:00+00:00"), "2026-03-10"),
+                ],
+            )
+            self.assertEqual(
+                migrado.execute(
+                    "SELECT quantidade_disponivel FROM estoque_lotes_saldo "
+                    "WHERE lote_id = 1"
+                ).fetchone()[0],
+                7,
+            )
+            periodo = migrado.execute(
+                """
+                SELECT bucket_inicio, dia_operacional, local_id, metodo,
+                       pagamentos, valor_pago_centavos, taxa_centavos,
+                       custo_centavos, unidades_pagas, unidades_liquidas
+                FROM vendas_resumo_periodo
+                """
+            ).fetchall()
+            self.assertEqual(
+                [tuple(row) for row in periodo],
+                [
+                    (
+                        "2026-03-10T21:00:00+00:00",
+                        "2026-03-10",
+                        1,
+                        "pix",
+                        1,
+                        2000,
+                        20,
+                        800,
+                        2,
+                        2,
+                    )
+                ],
+            )
+            produto = migrado.execute(
+                """
+                SELECT produto_id, nome_produto, quantidade,
+                       receita_centavos, custo_centavos
+                FROM vendas_resumo_produto
+                """
+            ).fetchall()
+            self.assertEqual(
+                [tuple(row) for row in produto], [(1, "Espeto Antigo", 2, 2000, 800)]
+            )
+            resumo = migrado.execute(
+                """
+                SELECT receita_centavos, taxas_centavos, custo_centavos, pedidos,
+                       estornos_centavos, unidades
+                FROM operacao_resumo WHERE operacao_id = 1
+                """
+            ).fetchone()
+            self.assertEqual(tuple(resumo), (2000, 20, 800, 1, 0, 2))
+            resumo_produto = migrado.execute(
+                """
+                SELECT vendidas, levadas, restantes, esgotou
+                FROM operacao_resumo_produtos
+                WHERE operacao_id = 1 AND produto_id = 1
+                """
+            ).fetchone()
+            self.assertEqual(tuple(resumo_produto), (2, 10, 7, 0))
+
+            # Os gatilhos instalados pela cadeia seguem valendo para escritas novas.
+            with migrado:
+                migrado.execute(
+                    """
+                    INSERT INTO pagamentos(
+                        pedido_id, tipo, metodo, valor_centavos, ocorrido_em
+                    ) VALUES (1, 'estorno', 'pix', 2000, '2026-03-12T15:00:00+00:00')
+                    """
+                )
+                migrado.execute(
+                    """
+                    INSERT INTO estoque_movimentacoes(
+                        produto_id, tipo, quantidade, custo_unitario_centavos,
+                        created_at, lote_id
+                    ) VALUES (1, 'perda', -1, 400, '2026-03-12T15:00:00+00:00', 1)
+                    """
+                )
+            estorno = migrado.execute(
+                """
+                SELECT ocorrido_epoch, dia_operacional, hora_local
+                FROM pagamentos WHERE tipo = 'estorno'
+                """
+            ).fetchone()
+            self.assertEqual(
+                tuple(estorno), (epoch("2026-03-12T15:00:00+00:00"), "2026-03-12", 12)
+            )
+            self.assertEqual(
+                migrado.execute(
+                    "SELECT quantidade_disponivel FROM estoque_lotes_saldo "
+                    "WHERE lote_id = 1"
+                ).fetchone()[0],
+                6,
+            )
+            self.assertEqual(
+                migrado.execute(
+                    "SELECT COUNT(*) FROM operacao_resumo WHERE operacao_id = 1"
+                ).fetchone()[0],
+                0,
+            )
+
+    def test_colunas_de_tempo_seguem_o_fuso_historico(self):
+        pedido = self.novo_pedido()
+        self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+        # Em torno do início e do fim do horário de verão de 2018/2019 e de
+        # um dia comum depois do fim do horário de verão.
+        instantes = [
+            "2018-11-04T02:59:59.999999+00:00",
+            "2018-11-04T03:00:00+00:00",
+            "2018-11-04T07:30:00+00:00",
+            "2019-02-17T01:59:59+00:00",
+            "2019-02-17T02:00:00.5+00:00",
+            "2019-02-17T07:59:00+00:00",
+            "2024-03-10T07:59:59.999+00:00",
+            "2024-03-10T05:00:00-03:00",
+        ]
+        with closing(database.conectar()) as conn:
+            for instante in instantes:
+                with conn:
+                    conn.execute(
+                        "UPDATE pagamentos SET ocorrido_em = ? WHERE pedido_id = ?",
+                        (instante, pedido["id"]),
+                    )
+                row = conn.execute(
+                    """
+                    SELECT ocorrido_epoch, dia_operacional, hora_local,
+                           dia_semana_local
+                    FROM pagamentos WHERE pedido_id = ?
+                    """,
+                    (pedido["id"],),
+                ).fetchone()
+                horario = datetime.fromisoformat(instante)
+                local = horario.astimezone(analytics.TZ_LOCAL)
+                self.assertEqual(
+                    tuple(row),
+                    (
+                        int(horario.timestamp()),
+                        (local - timedelta(hours=5)).date().isoformat(),
+                        local.hour,
+                        local.weekday(),
+                    ),
+                    instante,
+                )
+            pedido_salvo = conn.execute(
+                "SELECT timestamp_criacao, criado_epoch FROM pedidos WHERE id = ?",
+                (pedido["id"],),
+            ).fetchone()
+        self.assertEqual(
+            pedido_salvo["criado_epoch"],
+            int(datetime.fromisoformat(pedido_salvo["timestamp_criacao"]).timestamp()),
+        )
+
+    def test_mapa_de_calor_em_sql_iguala_conversao_em_python(self):
+        self.assertTrue(db.adicionar_estoque(self.produto_id, 40, 4.0))
+        self.assertTrue(db.adicionar_local("Loja Calor"))
+        outro_local_id = max(local["id"] for local in db.obter_todos_locais())
+        gerador = random.Random(20)
+        inicio_utc = datetime(2018, 10, 1, tzinfo=timezone.utc)
+        pedidos = []
+        for indice in range(40):
+            pedido = db.salvar_novo_pedido(
+                {
+                    "nome_cliente": f"Cliente {indice}",
+                    "itens": [{"id": self.produto_id, "quantidade": 1}],
+                    "metodo_pagamento": "pix",
+                    "modalidade": "local",
+                },
+                outro_local_id if indice % 4 == 0 else self.local_id,
+            )
+            self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+            if indice % 7 == 0:
+                self.assertTrue(db.cancelar_pedido(pedido["id"]))
+            pedidos.append(pedido["id"])
+        # Horários espalhados pelo horário de verão de 2018/2019, incluindo
+        # as madrugadas em que o relógio mudou.
+        instantes = [
+            datetime(2018, 11, 4, 2, 30, tzinfo=timezone.utc),
+            datetime(2018, 11, 4, 3, 15, tzinfo=timezone.utc),
+            datetime(2019, 2, 17, 1, 45, tzinfo=timezone.utc),
+            datetime(2019, 2, 17, 2, 10, tzinfo=timezone.utc),
+        ] + [
+            inicio_utc + timedelta(minutes=gerador.randrange(0, 180 * 24 * 60))
+            for _ in range(36)
+        ]
+        with closing(database.conectar()) as conn:
+            with conn:
+                for pedido_id, instante in zip(pedidos, instantes):
+                    conn.execute(
+                        "UPDATE pagamentos SET ocorrido_em = ? WHERE pedido_id = ?",
+                        (instante.isoformat(), pedido_id),
+                    )
+                database.reconstruir_resumos_vendas(conn)
+            eventos = conn.execute(
+                """
+                SELECT pg.tipo, pg.valor_centavos, pg.ocorrido_em, o.local_id
+                FROM pagamentos pg JOIN pedidos o ON o.id = pg.pedido_id
+                """
+            ).fetchall()
+
+        inicio = inicio_utc.isoformat()
+        fim = datetime(2019, 4, 1, tzinfo=timezone.utc).isoformat()
+        for local_id in ("todos", outro_local_id):
+            esperado = defaultdict(lambda: [0, 0])
+            for evento in eventos:
+                if local_id != "todos" and evento["local_id"] != local_id:
+                    continue
+                sinal = 1 if evento["tipo"] == "pagamento" else -1
+                local = datetime.fromisoformat(evento["ocorrido_em"]).astimezone(
+                    analytics.TZ_LOCAL
+                )
+                bucket = esperado[(local.weekday(), local.hour)]
+                bucket[0] += sinal
+                bucket[1] += sinal * evento["valor_centavos"]
+            esperado = [
+                {
+                    "dia_semana": chave[0],
+                    "hora": chave[1],
+                    "qtd": qtd,
+                    "faturamento": faturamento / 100,
+                }
+                for chave, (qtd, faturamento) in sorted(esperado.items())
+            ]
+            self.assertIsNotNone(analytics._limites_resumo(inicio, fim))
+            resumido = analytics.insights_heatmap.__wrapped__(
+                inicio, fim, {"local_id": local_id}
+            )
+            with patch.object(analytics, "_limites_resumo", return_value=None):
+                por_evento = analytics.insights_heatmap.__wrapped__(
+                    inicio, fim, {"local_id": local_id}
+                )
+            self.assertEqual(resumido["buckets"], esperado)
+            self.assertEqual(por_evento["buckets"], esperado)
+
+    @unittest.skipIf(analytics.np is None, "NumPy não instalado")
+    def test_motor_colunar_iguala_agregacao_por_evento(self):
+        self.assertTrue(db.adicionar_estoque(self.produto_id, 80, 4.0))
+        bebida_id = db.adicionar_novo_produto(
+            "Bebida Teste", None, None, 6.0, 40, 2.5, 1, 0
+        )
+        self.assertTrue(db.adicionar_local("Loja Colunar"))
+        outro_local_id = max(local["id"] for local in db.obter_todos_locais())
+        gerador = random.Random(23)
+        inicio_utc = datetime(2025, 3, 1, 3, 7, tzinfo=timezone.utc)
+        metodos = ("pix", "dinheiro", "cartao_credito")
+        with closing(database.conectar()) as conn:
+            for indice in range(30):
+                itens = [{"id": self.produto_id, "quantidade": 1 + indice % 3}]
+                if indice % 2:
+                    itens.insert(0, {"id": bebida_id, "quantidade": 1})
+                pedido = db.salvar_novo_pedido(
+                    {
+                        "nome_cliente": f"Cliente {indice}",
+                        "itens": itens,
+                        "metodo_pagamento": metodos[indice % 3],
+                        "modalidade": "local",
+                    },
+                    outro_local_id if indice % 4 == 0 else self.local_id,
+                )
+                self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+                if indice % 6 == 0:
+                    self.assertTrue(db.cancelar_pedido(pedido["id"]))
+                instante = inicio_utc + timedelta(
+                    minutes=gerador.randrange(-600, 20 * 24 * 60)
+                )
+                with conn:
+                    conn.execute(
+                        "UPDATE pagamentos SET ocorrido_em = ? WHERE pedido_id = ?",
+                        (instante.isoformat(), pedido["id"]),
+                    )
+
+        inicio = inicio_utc.isoformat()
+        fim = (inicio_utc + timedelta(days=14, minutes=11)).isoformat()
+        self.assertIsNone(analytics._limites_resumo(inicio, fim))
+        grade = analytics._grade_serie(inicio, fim)
+        self.assertTrue(analytics._motor_colunar_ativo(grade))
+        for local_id in ("todos", outro_local_id):
+            with closing(database.conectar()) as conn:
+                por_evento = analytics._vendas_eventos(
+                    conn, inicio, fim, local_id, grade, None
+                )
+                colunar = analytics._vendas_colunar(
+                    conn, inicio, fim, local_id, grade
+                )
+            self.assertEqual(colunar, por_evento)
+            self.assertEqual(list(colunar["itens"]), list(por_evento["itens"]))
+            self.assertGreater(colunar["pedidos_estornados"], 0)
+
+            with patch.dict(os.environ, {"ESPETAO_MOTOR_COLUNAR": "0"}):
+                esperado = analytics._calcular_fechamento.__wrapped__(
+                    inicio, fim, local_id
+                )
+            with patch.object(
+                analytics, "_vendas_eventos", side_effect=AssertionError
+            ):
+                obtido = analytics._calcular_fechamento.__wrapped__(
+                    inicio, fim, local_id, ("kpis", "itens")
+                )
+            for chave in obtido:
+                self.assertEqual(obtido[chave], esperado[chave], chave)
 
     def test_servidor_recalcula_preco_nome_custo_e_total(self):
         pedido = self.novo_pedido(2)
@@ -335,6 +949,48 @@ class PDVTestCase(unittest.TestCase):
         self.assertEqual(item["custo"], 32.00)
         self.assertEqual(item["lucro"], 23.00)
 
+    def test_itens_do_mesmo_produto_dividem_lotes_na_ordem_do_pedido(self):
+        produto_id = db.adicionar_novo_produto(
+            "Produto Dividido", None, None, 6.00, 3, 3.00, 1, 0
+        )
+        self.assertTrue(db.adicionar_estoque(produto_id, 5, 2.00))
+        pedido = db.salvar_novo_pedido(
+            {
+                "nome_cliente": "Cliente Dividido",
+                "itens": [
+                    {"id": produto_id, "quantidade": 3, "uid": "b"},
+                    {"id": produto_id, "quantidade": 2, "uid": "a"},
+                ],
+                "metodo_pagamento": "pix",
+                "modalidade": "local",
+                "carrinho_id": "dividido",
+            },
+            self.local_id,
+        )
+        self.assertIsNotNone(pedido)
+        with closing(database.conectar()) as conn:
+            itens = conn.execute(
+                """
+                SELECT pi.uid, pi.custo_unitario_centavos, pi.custo_total_centavos,
+                       SUM(m.quantidade * m.custo_unitario_centavos) AS custo_baixado,
+                       COUNT(m.id) AS parcelas
+                FROM pedido_itens pi
+                JOIN estoque_movimentacoes m ON m.pedido_item_id = pi.id
+                WHERE pi.pedido_id = ?
+                GROUP BY pi.id
+                ORDER BY pi.id
+                """,
+                (pedido["id"],),
+            ).fetchall()
+        self.assertEqual(
+            [tuple(row) for row in itens],
+            [("a", 300, 600, -600, 1), ("b", 233, 700, -700, 2)],
+        )
+        self.assertEqual(
+            [lote["quantidade_disponivel"] for lote in db.obter_lotes_produto(produto_id)],
+            [0, 3],
+        )
+
     def test_estorno_fifo_restaura_exatamente_os_lotes_consumidos(self):
         produto_id = db.adicionar_novo_produto(
             "Produto Estorno FIFO", None, None, 5.00, 2, 3.00, 1, 0
@@ -387,6 +1043,88 @@ class PDVTestCase(unittest.TestCase):
             [0, 1],
         )
 
+    def test_fifo_atravessa_varios_lotes_pequenos_em_uma_selecao(self):
+        produto_id = db.adicionar_novo_produto(
+            "Produto Lotes Pequenos", None, None, 9.00, 1, 1.00, 1, 0
+        )
+        for custo in (2.00, 3.00):
+            self.assertTrue(db.adicionar_estoque(produto_id, 1, custo))
+        self.assertTrue(db.adicionar_estoque(produto_id, 5, 4.00))
+
+        # Duas parcelas por INSERT: os ids vêm do RETURNING de cada lote.
+        with closing(database.conectar()) as conn, patch.object(
+            db, "MAXIMO_PARAMETROS_SQL", 20
+        ):
+            consumo = db._consumir_fifo(
+                conn.cursor(),
+                produto_id,
+                4,
+                tipo="perda",
+                observacao="Teste de lotes pequenos",
+            )
+            movimentos = conn.execute(
+                """
+                SELECT id, quantidade, custo_unitario_centavos
+                FROM estoque_movimentacoes
+                WHERE produto_id = ?
+                ORDER BY id
+                """,
+                (produto_id,),
+            ).fetchall()
+            conn.commit()
+
+        self.assertEqual(consumo["custo_total_centavos"], 1000)
+        self.assertEqual(consumo["movimentos"], [row["id"] for row in movimentos])
+        self.assertEqual(
+            [(row["quantidade"], row["custo_unitario_centavos"]) for row in movimentos],
+            [(-1, 100), (-1, 200), (-1, 300), (-1, 400)],
+        )
+        self.assertEqual(
+            [lote["quantidade_disponivel"] for lote in db.obter_lotes_produto(produto_id)],
+            [0, 0, 0, 4],
+        )
+
+    def test_saldo_materializado_acompanha_razao_e_reconcilia(self):
+        self.assertTrue(db.adicionar_estoque(self.produto_id, 5, 3.00))
+        pedido = self.novo_pedido(12)
+        self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+        self.assertTrue(db.registrar_perda_estoque(self.produto_id, 1)["sucesso"])
+        self.assertTrue(db.cancelar_pedido(pedido["id"]))
+        self.assertTrue(db.zerar_estoque_produto(self.produto_id)["sucesso"])
+        self.assertTrue(db.adicionar_estoque(self.produto_id, 4, 5.00))
+
+        conferencia = db.reconciliar_saldos_lotes(corrigir=False)
+        self.assertTrue(conferencia["sucesso"])
+        self.assertEqual(conferencia["divergencias"], [])
+        self.assertEqual(
+            db.obter_disponibilidade_para_produtos([self.produto_id])[
+                self.produto_id
+            ],
+            4,
+        )
+
+        with closing(database.conectar()) as conn:
+            conn.execute(
+                "UPDATE estoque_lotes_saldo SET quantidade_disponivel = 99"
+            )
+            conn.execute(
+                "DELETE FROM estoque_lotes_saldo WHERE lote_id = ("
+                "SELECT MAX(lote_id) FROM estoque_lotes_saldo)"
+            )
+            conn.commit()
+        conferencia = db.reconciliar_saldos_lotes()
+        self.assertEqual(len(conferencia["divergencias"]), 3)
+        self.assertTrue(conferencia["corrigido"])
+        self.assertEqual(
+            db.reconciliar_saldos_lotes(corrigir=False)["divergencias"], []
+        )
+        self.assertEqual(
+            [lote["quantidade_disponivel"] for lote in db.obter_lotes_produto(
+                self.produto_id
+            )],
+            [0, 0, 4],
+        )
+
     def test_pedido_sem_estoque_falha_sem_gravacao_parcial(self):
         self.assertIsNone(self.novo_pedido(11))
         with closing(database.conectar()) as conn:
@@ -446,6 +1184,121 @@ class PDVTestCase(unittest.TestCase):
             0,
         )
 
+    def test_reserva_vencida_e_ignorada_e_removida_pela_varredura(self):
+        self.assertEqual(
+            db.definir_reserva("carrinho-vencido", self.produto_id, 8)[
+                "quantidade_reservada"
+            ],
+            8,
+        )
+        self.assertEqual(
+            db.expirar_reservas_vencidas(),
+            {"sucesso": True, "reservas_expiradas": 0, "produtos_afetados": []},
+        )
+        with closing(database.conectar()) as conn:
+            conn.execute(
+                "UPDATE reservas_carrinho SET expires_at = ?",
+                ((datetime.now(timezone.utc) - timedelta(seconds=1)).isoformat(),),
+            )
+            conn.commit()
+
+        nova = db.definir_reserva("carrinho-novo", self.produto_id, 6)
+        self.assertTrue(nova["sucesso"])
+        self.assertEqual(nova["produtos_afetados"][0]["disponivel"], 4)
+        pedido = db.salvar_novo_pedido(
+            {
+                "nome_cliente": "Cliente Sem Carrinho",
+                "itens": [{"id": self.produto_id, "quantidade": 4}],
+                "metodo_pagamento": "pix",
+                "modalidade": "local",
+            },
+            self.local_id,
+        )
+        self.assertIsNotNone(pedido)
+
+        varredura = db.expirar_reservas_vencidas()
+        self.assertEqual(varredura["reservas_expiradas"], 1)
+        self.assertEqual(
+            varredura["produtos_afetados"],
+            [{"produto_id": self.produto_id, "disponivel": 0}],
+        )
+        with closing(database.conectar()) as conn:
+            self.assertEqual(
+                conn.execute(
+                    "SELECT carrinho_id FROM reservas_carrinho"
+                ).fetchall()[0][0],
+                "carrinho-novo",
+            )
+
+    def test_disponibilidade_le_sem_trava_e_ignora_reservas_vencidas(self):
+        segundo_id = db.adicionar_novo_produto(
+            "Espeto Leitura", None, None, 8.00, 5, 3.00, 1, 0
+        )
+        db.definir_reserva("carrinho-vigente", self.produto_id, 2)
+        db.definir_reserva("carrinho-expira", segundo_id, 3)
+        with closing(database.conectar()) as conn:
+            conn.execute(
+                "UPDATE reservas_carrinho SET expires_at = ? WHERE carrinho_id = ?",
+                ("2000-01-01T00:00:00+00:00", "carrinho-expira"),
+            )
+            conn.commit()
+
+        escritor = database.conectar()
+        try:
+            escritor.execute("BEGIN IMMEDIATE")
+            disponibilidade = db.obter_disponibilidade_para_produtos(
+                [self.produto_id, segundo_id, self.produto_id, 999_999]
+            )
+        finally:
+            escritor.rollback()
+            escritor.close()
+
+        self.assertEqual(
+            disponibilidade,
+            {self.produto_id: 8, segundo_id: 5, 999_999: 0},
+        )
+        with closing(database.conectar()) as conn:
+            self.assertEqual(
+                conn.execute("SELECT COUNT(*) FROM reservas_carrinho").fetchone()[0],
+                2,
+            )
+
+    def test_reservas_em_lote_ajustam_cada_produto_na_mesma_transacao(self):
+        segundo_id = db.adicionar_novo_produto(
+            "Espeto Lote", None, None, 8.00, 3, 3.00, 1, 0
+        )
+        db.definir_reserva("outro-carrinho", self.produto_id, 4)
+
+        resultado = db.definir_reservas(
+            "carrinho-lote", {str(self.produto_id): 9, segundo_id: 2}
+        )
+        self.assertFalse(resultado["sucesso"])
+        reservas = {item["produto_id"]: item for item in resultado["reservas"]}
+        self.assertEqual(reservas[self.produto_id]["quantidade_reservada"], 6)
+        self.assertTrue(reservas[self.produto_id]["ajustada"])
+        self.assertEqual(reservas[segundo_id]["quantidade_reservada"], 2)
+        self.assertFalse(reservas[segundo_id]["ajustada"])
+        self.assertEqual(
+            sorted(
+                (item["produto_id"], item["disponivel"])
+                for item in resultado["produtos_afetados"]
+            ),
+            sorted([(self.produto_id, 0), (segundo_id, 1)]),
+        )
+
+        liberacao = db.definir_reservas(
+            "carrinho-lote", {self.produto_id: 0, segundo_id: 0}
+        )
+        self.assertTrue(liberacao["sucesso"])
+        self.assertEqual(
+            db.obter_disponibilidade_para_produtos([self.produto_id, segundo_id]),
+            {self.produto_id: 6, segundo_id: 3},
+        )
+        self.assertFalse(
+            db.definir_reservas("carrinho-lote", {self.produto_id: -1})["sucesso"]
+        )
+        self.assertFalse(db.definir_reservas("carrinho-lote", {})["sucesso"])
+
     def test_reservas_concorrentes_nao_ultrapassam_o_saldo(self):
         def reservar(indice):
             return db.definir_reserva(
@@ -920,6 +1773,497 @@ class PDVTestCase(unittest.TestCase):
         self.assertEqual(categoria["itens"][0]["nome"], "Espeto Teste")
         self.assertEqual(categoria["itens"][0]["quantidade"], 7)
 
+    def test_fechamento_carrega_itens_em_lote_com_mesmo_resultado(self):
+        gerador = random.Random(11)
+        produtos = [self.produto_id] + [
+            db.adicionar_novo_produto(
+                f"Sintético {indice}", None, None, 7.0 + indice, 0, 0, 1, indice % 2
+            )
+            for indice in range(4)
+        ]
+        for produto_id in produtos:
+            for lote in range(3):
+                self.assertTrue(db.adicionar_estoque(produto_id, 400, 2.0 + lote))
+
+        pedidos = []
+        for visita in range(3):
+            operacao_id = db.iniciar_operacao(self.local_id)
+            for numero in range(60):
+                escolhidos = gerador.sample(produtos, gerador.randint(1, 3))
+                pedido = db.salvar_novo_pedido(
+                    {
+                        "nome_cliente": f"Cliente {visita}-{numero}",
+                        "itens": [
+                            {"id": produto_id, "quantidade": gerador.randint(1, 3)}
+                            for produto_id in escolhidos
+                        ],
+                        "metodo_pagamento": gerador.choice(["pix", "dinheiro"]),
+                        "modalidade": "local",
+                    },
+                    self.local_id,
+                    operacao_id,
+                )
+                self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+                pedidos.append(pedido["id"])
+            self.assertTrue(db.encerrar_operacao(operacao_id))
+        for pedido_id in gerador.sample(pedidos, 25):
+            self.assertTrue(db.cancelar_pedido(pedido_id))
+
+        agora = datetime.now(timezone.utc)
+        inicio = (agora - timedelta(days=1)).isoformat()
+        fim = (agora + timedelta(days=1)).isoformat()
+
+        # A primeira leitura grava os resumos das visitas encerradas; as
+        # seguintes ignoram o cache de resultados para recalcular de fato.
+        analytics._calcular_fechamento(inicio, fim, "todos")
+        calcular = analytics._calcular_fechamento.__wrapped__
+        comandos = []
+        obter_original = database.obter_conexao
+
+        def obter_rastreada(db_path=None):
+            conn = obter_original(db_path)
+            conn.set_trace_callback(comandos.append)
+            return conn
+
+        with patch.object(database, "obter_conexao", obter_rastreada):
+            em_lote = calcular(inicio, fim, "todos")
+        self.assertLess(len(comandos), 40)
+
+        def itens_um_a_um(conn, *_args):
+            ids = [row[0] for row in conn.execute("SELECT id FROM pedidos")]
+            return {
+                pedido_id: conn.execute(
+                    """
+                    SELECT pi.*, pi.categoria_nome AS categoria
+                    FROM pedido_itens pi
+                    WHERE pi.pedido_id = ?
+                    ORDER BY pi.categoria_ordem, pi.produto_ordem, pi.id
+                    """,
+                    (pedido_id,),
+                ).fetchall()
+                for pedido_id in ids
+            }
+
+        with patch.object(
+            analytics, "_itens_eventos_pagamento", itens_um_a_um
+        ), patch.object(analytics, "_itens_pedidos_operacoes", itens_um_a_um):
+            um_a_um = calcular(inicio, fim, "todos")
+
+        self.assertEqual(em_lote, um_a_um)
+        self.assertEqual(em_lote["kpis"]["pedidosPagos"], 180)
+        self.assertEqual(em_lote["kpis"]["pedidosEstornados"], 25)
+        self.assertEqual(len(em_lote["historico"]), 205)
+
+    def test_historico_de_eventos_pagina_por_cursor(self):
+        self.assertTrue(db.adicionar_estoque(self.produto_id, 20, 4.0))
+        pedidos = []
+        for indice in range(12):
+            pedido = self.novo_pedido(metodo="dinheiro" if indice % 3 else "pix")
+            self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+            pedidos.append(pedido["id"])
+        for pedido_id in pedidos[1:8:3]:
+            self.assertTrue(db.cancelar_pedido(pedido_id))
+        agora = datetime.now(timezone.utc)
+        inicio = (agora - timedelta(days=1)).isoformat()
+        fim = (agora + timedelta(days=1)).isoformat()
+
+        completo = analytics._calcular_fechamento.__wrapped__(
+            inicio, fim, "todos", ("historico",)
+        )["historico"]
+        paginas = []
+        cursor = None
+        with patch.object(
+            analytics, "_itens_por_pedido", wraps=analytics._itens_por_pedido
+        ) as itens_por_pedido:
+            while True:
+                pagina = analytics.historico_eventos(
+                    inicio, fim, cursor=cursor, limit=5
+                )
+                paginas.append(pagina["items"])
+                cursor = pagina["proximo"]
+                if cursor is None:
+                    break
+        self.assertEqual([len(items) for items in paginas], [5, 5, 5])
+        for chamada in itens_por_pedido.call_args_list:
+            self.assertLessEqual(len(chamada.args[2]), 5)
+        eventos = [evento for items in paginas for evento in items]
+        self.assertEqual(
+            [(e["id"], e["tipo"], e["valor_total"]) for e in eventos],
+            [(e["id"], e["tipo"], e["valor_total"]) for e in completo],
+        )
+        self.assertEqual(
+            eventos[0]["itens"], json.loads(completo[0]["itens_json"])
+        )
+
+        estornos = analytics.historico_eventos(inicio, fim, tipo="estorno")
+        self.assertEqual(
+            [evento["id"] for evento in estornos["items"]], pedidos[1:8:3]
+        )
+        self.assertIsNone(estornos["proximo"])
+        pix = analytics.historico_eventos(
+            inicio, fim, self.local_id, metodo="pix", tipo="pagamento"
+        )
+        self.assertEqual(len(pix["items"]), 4)
+        with self.assertRaises(ValueError):
+            analytics.historico_eventos(inicio, fim, cursor="invalido")
+        with self.assertRaises(ValueError):
+            analytics.historico_eventos(inicio, fim, metodo="cheque")
+
+    def test_exportacoes_seguem_o_indice_sem_ordenacao_temporaria(self):
+        inicio = "2025-01-01T03:00:00+00:00"
+        fim = "2026-01-01T03:00:00+00:00"
+        with closing(database.conectar()) as conn:
+            for tipo, consulta in exportacao.EXPORTACOES.items():
+                for local_id in ("todos", self.local_id):
+                    query, params = consulta(inicio, fim, local_id)
+                    plano = " | ".join(
+                        row["detail"]
+                        for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)
+                    )
+                    self.assertNotIn("TEMP B-TREE", plano, (tipo, local_id))
+
+    @unittest.skipUnless(hasattr(time, "tzset"), "requer time.tzset")
+    def test_exportacao_le_limites_sem_fuso_como_utc_em_maquina_fora_de_utc(self):
+        self.assertIsNotNone(self.novo_pedido(1))
+        with closing(database.conectar()) as conn:
+            criado_em = conn.execute(
+                "SELECT MAX(created_at) FROM estoque_movimentacoes"
+            ).fetchone()[0]
+        instante = datetime.fromisoformat(criado_em).replace(tzinfo=None)
+        inicio = (instante - timedelta(minutes=1)).isoformat()
+        fim = (instante + timedelta(minutes=1)).isoformat()
+
+        fuso_original = os.environ.get("TZ")
+        os.environ["TZ"] = "America/Sao_Paulo"
+        time.tzset()
+        try:
+            linhas = list(
+                csv.DictReader(
+                    io.StringIO("".join(exportacao.exportar("estoque", "csv", inicio, fim)))
+                )
+            )
+        finally:
+            if fuso_original is None:
+                os.environ.pop("TZ", None)
+            else:
+                os.environ["TZ"] = fuso_original
+            time.tzset()
+        self.assertEqual([linha["created_at"] for linha in linhas], [criado_em])
+        with self.assertRaises(ValueError):
+            exportacao.exportar("estoque", "csv", "ontem", fim)
+
+    def test_exportacoes_leem_sem_o_perfil_analitico_em_memoria(self):
+        conexoes = []
+        conectar = database.conectar
+
+        def registrar(*args, **kwargs):
+            conn = conectar(*args, **kwargs)
+            conexoes.append(
+                (
+                    conn.execute("PRAGMA query_only").fetchone()[0],
+                    conn.execute("PRAGMA temp_store").fetchone()[0],
+                )
+            )
+            return conn
+
+        agora = datetime.now(timezone.utc)
+        with patch.object(database, "conectar", side_effect=registrar):
+            list(
+                exportacao.exportar(
+                    "pagamentos",
+                    "csv",
+                    (agora - timedelta(days=1)).isoformat(),
+                    agora.isoformat(),
+                )
+            )
+        # Só leitura, com as tabelas temporárias no padrão do SQLite.
+        self.assertEqual(conexoes, [(1, 0)])
+
+    def test_exportacoes_saem_em_lotes_csv_ndjson_e_gzip(self):
+        self.assertTrue(db.adicionar_estoque(self.produto_id, 10, 4.0))
+        pedidos = []
+        for _ in range(5):
+            pedido = self.novo_pedido(quantidade=2)
+            self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+            pedidos.append(pedido["id"])
+        self.assertTrue(db.cancelar_pedido(pedidos[0]))
+        agora = datetime.now(timezone.utc)
+        inicio = (agora - timedelta(days=1)).isoformat()
+        fim = (agora + timedelta(days=1)).isoformat()
+
+        with patch.object(exportacao, "LINHAS_POR_LOTE", 2):
+            partes = list(exportacao.exportar("itens", "csv", inicio, fim))
+        # Cabeçalho mais três lotes de até duas linhas.
+        self.assertEqual(len(partes), 4)
+        linhas = list(csv.DictReader(io.StringIO("".join(partes))))
+        self.assertEqual([int(linha["pedido_id"]) for linha in linhas], pedidos)
+        self.assertTrue(linhas[0]["estornado_em"])
+        self.assertEqual(linhas[1]["estornado_em"], "")
+        self.assertEqual(linhas[1]["custo_total_centavos"], "800")
+
+        ndjson = "".join(exportacao.exportar("pagamentos", "ndjson", inicio, fim))
+        eventos = [json.loads(linha) for linha in ndjson.splitlines()]
+        self.assertEqual(len(eventos), 6)
+        self.assertEqual(eventos[-1]["tipo"], "estorno")
+        self.assertEqual(eventos[-1]["local_nome"], "Loja Teste")
+
+        comprimido = b"".join(
+            exportacao.comprimir_gzip(
+                exportacao.exportar("estoque", "csv", inicio, fim, self.local_id)
+            )
+        )
+        movimentos = list(
+            csv.DictReader(io.StringIO(gzip.decompress(comprimido).decode()))
+        )
+        self.assertEqual(
+            {movimento["tipo"] for movimento in movimentos}, {"venda", "estorno"}
+        )
+        self.assertTrue(all(movimento["lote_recebido_em"] for movimento in movimentos))
+        with self.assertRaises(ValueError):
+            exportacao.exportar("clientes", "csv", inicio, fim)
+        with self.assertRaises(ValueError):
+            exportacao.exportar("itens", "xlsx", inicio, fim)
+
+    def test_comparativo_calcula_periodos_em_paralelo_com_dados_compartilhados(self):
+        self.assertTrue(db.adicionar_estoque(self.produto_id, 20, 4.0))
+        for visita in range(2):
+            operacao_id = db.iniciar_operacao(self.local_id)
+            for _ in range(3 + visita):
+                pedido = db.salvar_novo_pedido(
+                    {
+                        "nome_cliente": "Cliente Comparativo",
+                        "itens": [{"id": self.produto_id, "quantidade": 1}],
+                        "metodo_pagamento": "pix",
+                        "modalidade": "local",
+                    },
+                    self.local_id,
+                    operacao_id,
+                )
+                self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+            self.assertTrue(db.encerrar_operacao(operacao_id))
+        agora = datetime.now(timezone.utc)
+        periodo_a = (
+            (agora - timedelta(hours=1)).isoformat(),
+            (agora + timedelta(hours=1)).isoformat(),
+        )
+        periodo_b = (
+            (agora - timedelta(days=1)).isoformat(),
+            (agora + timedelta(days=1)).isoformat(),
+        )
+        secoes = ("kpis", "analiseProdutos")
+        esperados = [
+            analytics._calcular_fechamento.__wrapped__(*periodo, "todos", secoes)
+            for periodo in (periodo_a, periodo_b)
+        ]
+
+        threads = []
+        montar_original = analytics._montar_fechamento
+
+        def montar_rastreado(conn, *args, **kwargs):
+            threads.append(threading.get_ident())
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("DELETE FROM operacao_resumo")
+            return montar_original(conn, *args, **kwargs)
+
+        with patch.object(
+            analytics, "_montar_fechamento", montar_rastreado
+        ), patch.object(
+            analytics, "_resumos_operacoes", wraps=analytics._resumos_operacoes
+        ) as resumos, patch.object(
+            analytics, "_catalogo_produtos", wraps=analytics._catalogo_produtos
+        ) as catalogo:
+            obtidos = analytics._fechamentos_comparados(
+                (periodo_a, periodo_b), "todos", secoes
+            )
+        self.assertEqual(obtidos, esperados)
+        self.assertEqual(resumos.call_count, 1)
+        self.assertEqual(len(resumos.call_args.args[1]), 2)
+        self.assertEqual(catalogo.call_count, 1)
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+        self.assertEqual(
+            obtidos[1]["analiseProdutos"][0]["visitasComVenda"], 2
+        )
+
+    def test_estoque_do_fechamento_em_lote_preserva_ajustes_neutros(self):
+        outro_id = db.adicionar_novo_produto(
+            "Espeto Arquivado", None, None, 9.0, 6, 3.0, 1, 0
+        )
+        parado_id = db.adicionar_novo_produto(
+            "Espeto Parado", None, None, 9.0, 2, 3.0, 1, 0
+        )
+        self.assertIsNotNone(self.novo_pedido(quantidade=3))
+        inicio = datetime.now(timezone.utc).isoformat()
+
+        self.assertTrue(db.adicionar_estoque(self.produto_id, 5, 5.0))
+        self.assertIsNotNone(self.novo_pedido(quantidade=4))
+        self.assertTrue(db.registrar_perda_estoque(self.produto_id, 1))
+        self.assertTrue(db.zerar_estoque_produto(self.produto_id)["sucesso"])
+        self.assertTrue(db.adicionar_estoque(self.produto_id, 2, 5.0))
+        pedido_outro = db.salvar_novo_pedido(
+            {
+                "nome_cliente": "Cliente Arquivado",
+                "itens": [{"id": outro_id, "quantidade": 2}],
+                "metodo_pagamento": "pix",
+                "modalidade": "local",
+            },
+            self.local_id,
+        )
+        self.assertTrue(db.confirmar_pagamento_pedido(pedido_outro["id"]))
+        self.assertTrue(db.cancelar_pedido(pedido_outro["id"]))
+        self.assertTrue(db.zerar_estoque_produto(outro_id)["sucesso"])
+        with closing(database.conectar()) as conn:
+            conn.execute("UPDATE produtos SET ativo = 0 WHERE id = ?", (outro_id,))
+            conn.commit()
+        fim = (datetime.now(timezone.utc) + timedelta(minutes=1)).isoformat()
+
+        def esperado(conn, produto_id):
+            inicial = entradas = saidas = 0
+            linhas = []
+            for lote in conn.execute(
+                "SELECT * FROM estoque_lotes WHERE produto_id = ?", (produto_id,)
+            ):
+                neutros = sum(
+                    row["quantidade"]
+                    for row in conn.execute(
+                        """
+                        SELECT quantidade, created_at FROM estoque_movimentacoes
+                        WHERE lote_id = ? AND impacta_relatorio = 0
+                        """,
+                        (lote["id"],),
+                    )
+                    if row["created_at"] < fim
+                )
+                linhas.append(
+                    (lote["quantidade_inicial"] + neutros, lote["recebido_em"])
+                )
+            linhas.extend(
+                (row["quantidade"], row["created_at"])
+                for row in conn.execute(
+                    """
+                    SELECT quantidade, created_at FROM estoque_movimentacoes
+                    WHERE produto_id = ? AND lote_id IS NOT NULL
+                      AND impacta_relatorio = 1
+                    """,
+                    (produto_id,),
+                )
+            )
+            for quantidade, ocorrido_em in linhas:
+                if ocorrido_em < inicio:
+                    inicial += quantidade
+                elif ocorrido_em < fim:
+                    entradas += max(quantidade, 0)
+                    saidas += max(-quantidade, 0)
+            return inicial, entradas, saidas
+
+        with closing(database.conectar()) as conn:
+            linhas = {
+                row["id"]: (row["inicial"], row["entradas"], row["saidas"])
+                for row in analytics._movimentacao_estoque_produtos(conn, inicio, fim)
+            }
+            for produto_id in (self.produto_id, outro_id, parado_id):
+                self.assertEqual(linhas[produto_id], esperado(conn, produto_id))
+
+        self.assertEqual(linhas[self.produto_id], (5, 2, 5))
+        self.assertEqual(linhas[parado_id], (2, 0, 0))
+        estoque = {
+            item["produtoId"]: item
+            for item in analytics._calcular_fechamento(inicio, fim)["estoque"]
+        }
+        self.assertEqual(estoque[self.produto_id]["final"], 2)
+        self.assertFalse(estoque[outro_id]["ativo"])
+        self.assertEqual(estoque[outro_id]["status"], "arquivado")
+
+    def test_resumos_de_venda_acompanham_pagamentos_e_igualam_eventos(self):
+        gerador = random.Random(13)
+        self.assertTrue(db.adicionar_local("Loja Resumo"))
+        outro_local_id = max(local["id"] for local in db.obter_todos_locais())
+        produtos = [
+            db.adicionar_novo_produto(
+                f"Resumo {indice}", None, None, 6.0 + indice, 300, 2.5, 1, 0
+            )
+            for indice in range(4)
+        ]
+        pedidos = []
+        for numero in range(60):
+            escolhidos = gerador.sample(produtos, gerador.randint(1, 3))
+            pedido = db.salvar_novo_pedido(
+                {
+                    "nome_cliente": f"Cliente {numero}",
+                    "itens": [
+                        {"id": produto_id, "quantidade": gerador.randint(1, 2)}
+                        for produto_id in escolhidos
+                    ],
+                    "metodo_pagamento": gerador.choice(
+                        ["pix", "dinheiro", "cartao_credito"]
+                    ),
+                    "modalidade": "local",
+                },
+                gerador.choice([self.local_id, outro_local_id]),
+            )
+            self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+            pedidos.append(pedido["id"])
+        for pedido_id in gerador.sample(pedidos, 12):
+            self.assertTrue(db.cancelar_pedido(pedido_id))
+
+        consultas = (
+            "SELECT * FROM vendas_resumo_periodo ORDER BY 1, 3, 4",
+            "SELECT * FROM vendas_resumo_produto ORDER BY 1, 3, 4",
+        )
+        with closing(database.conectar()) as conn:
+            incrementais = [
+                [tuple(row) for row in conn.execute(sql)] for sql in consultas
+            ]
+        self.assertEqual(db.reconstruir_resumos_vendas()["eventos"], 72)
+        with closing(database.conectar()) as conn:
+            reconstruidos = [
+                [tuple(row) for row in conn.execute(sql)] for sql in consultas
+            ]
+        self.assertEqual(incrementais, reconstruidos)
+
+        # Espalha os eventos por três dias para cruzar intervalos e dias.
+        base = datetime(2024, 3, 10, 8, 0, tzinfo=timezone.utc)
+        with closing(database.conectar()) as conn:
+            for (pagamento_id,) in conn.execute(
+                "SELECT id FROM pagamentos ORDER BY id"
+            ).fetchall():
+                instante = base + timedelta(seconds=gerador.randint(0, 3 * 86400))
+                conn.execute(
+                    "UPDATE pagamentos SET ocorrido_em = ? WHERE id = ?",
+                    (instante.isoformat(), pagamento_id),
+                )
+            conn.commit()
+        self.assertTrue(db.reconstruir_resumos_vendas()["sucesso"])
+
+        periodos = [
+            analytics.periodo_operacional("2024-03-11"),
+            (base.isoformat(), (base + timedelta(days=3)).isoformat()),
+            ("2024-03-10T09:00:00+00:00", "2024-03-12T00:45:00+00:00"),
+        ]
+        secoes_sem_historico = set(analytics.SECOES_FECHAMENTO) - {"historico"}
+        for inicio, fim in periodos:
+            self.assertIsNotNone(analytics._limites_resumo(inicio, fim))
+            for local_id in ("todos", outro_local_id):
+                resumido = analytics._calcular_fechamento(
+                    inicio, fim, local_id, secoes_sem_historico
+                )
+                calor_resumido = analytics.insights_heatmap(
+                    inicio, fim, {"local_id": local_id}
+                )
+                with patch.object(analytics, "_limites_resumo", return_value=None):
+                    por_evento = analytics._calcular_fechamento.__wrapped__(
+                        inicio, fim, local_id, secoes_sem_historico
+                    )
+                    calor_por_evento = analytics.insights_heatmap.__wrapped__(
+                        inicio, fim, {"local_id": local_id}
+                    )
+                self.assertEqual(resumido, por_evento)
+                self.assertEqual(calor_resumido, calor_por_evento)
+        self.assertGreater(resumido["kpis"]["pedidosPagos"], 0)
+        self.assertIsNone(
+            analytics._limites_resumo(*self.periodo_do_pagamento(pedidos[0]))
+        )
+
     def test_operacao_do_mesmo_dia_pode_ser_retomada_sem_nova_visita(self):
         operacao_id = db.iniciar_operacao(self.local_id)
         self.assertIsNotNone(operacao_id)
@@ -942,6 +2286,232 @@ class PDVTestCase(unittest.TestCase):
         anterior = next(item for item in operacoes if item["id"] == operacao_id)
         self.assertEqual(anterior["status"], "encerrada")
 
+    def test_visita_encerrada_por_outra_abertura_tambem_grava_resumo(self):
+        self.assertTrue(db.adicionar_local("Loja Vizinha"))
+        vizinha_id = max(local["id"] for local in db.obter_todos_locais())
+        operacao_id = db.iniciar_operacao(self.local_id)
+        pedido = db.salvar_novo_pedido(
+            {
+                "nome_cliente": "Encerramento implícito",
+                "itens": [{"id": self.produto_id, "quantidade": 2}],
+                "metodo_pagamento": "pix",
+                "modalidade": "local",
+            },
+            self.local_id,
+            operacao_id,
+        )
+        self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+
+        def resumo_gravado(operacao):
+            with closing(database.conectar()) as conn:
+                return conn.execute(
+                    "SELECT receita_centavos, pedidos FROM operacao_resumo "
+                    "WHERE operacao_id = ?",
+                    (operacao,),
+                ).fetchone()
+
+        # Abrir outra visita encerra a primeira, que já sai com resumo.
+        vizinha_operacao = db.iniciar_operacao(vizinha_id)
+        self.assertEqual(tuple(resumo_gravado(operacao_id)), (2000, 1))
+        self.assertIsNone(resumo_gravado(vizinha_operacao))
+
+        # Retomar a primeira encerra a da vizinha, também com resumo.
+        self.assertEqual(db.retomar_operacao(operacao_id, self.local_id), operacao_id)
+        self.assertEqual(tuple(resumo_gravado(vizinha_operacao)), (0, 0))
+        self.assertIsNone(resumo_gravado(operacao_id))
+
+    def test_cache_analitico_reaproveita_ate_os_dados_mudarem(self):
+        pedido = self.novo_pedido(2)
+        self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+        inicio, fim = self.periodo_do_pagamento(pedido["id"])
+        cache = analytics.CacheAnalitico(2)
+        with patch.object(analytics, "cache_analitico", cache):
+            primeiro = analytics._calcular_fechamento(inicio, fim, "todos")
+            with patch.object(analytics, "_vendas_eventos", side_effect=AssertionError):
+                self.assertIs(analytics._calcular_fechamento(inicio, fim), primeiro)
+            self.assertEqual(cache.estatisticas()["acertos"], 1)
+
+            outro = self.novo_pedido(1)
+            self.assertTrue(db.confirmar_pagamento_pedido(outro["id"]))
+            atualizado = analytics._calcular_fechamento(inicio, fim)
+            self.assertEqual(atualizado["kpis"]["pedidosPagos"], 2)
+
+            analytics.insights_heatmap(inicio, fim, {"local_id": "todos"})
+            estatisticas = cache.estatisticas()
+        self.assertEqual(estatisticas["falhas"], 3)
+        self.assertEqual(estatisticas["descartes"], 1)
+        self.assertEqual(estatisticas["entradas"], 2)
+        self.assertEqual(estatisticas["taxa_acerto_pct"], 25.0)
+
+    def test_edicao_do_cadastro_descarta_relatorios_em_cache(self):
+        operacao_id = db.iniciar_operacao(self.local_id)
+        pedido = db.salvar_novo_pedido(
+            {
+                "nome_cliente": "Cadastro",
+                "itens": [{"id": self.produto_id, "quantidade": 1}],
+                "metodo_pagamento": "pix",
+                "modalidade": "local",
+            },
+            self.local_id,
+            operacao_id,
+        )
+        self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+        self.assertTrue(db.encerrar_operacao(operacao_id))
+
+        def nome_no_relatorio():
+            local = analytics.desempenho_locais([self.local_id])["locais"][0]
+            return local["produtos"][0]["nome"]
+
+        cache = analytics.CacheAnalitico(4)
+        with patch.object(analytics, "cache_analitico", cache):
+            self.assertEqual(nome_no_relatorio(), "Espeto Teste")
+            self.assertTrue(
+                db.atualizar_dados_produto(
+                    self.produto_id, "Espeto Renomeado", None, None, 1, 0
+                )
+            )
+            self.assertEqual(nome_no_relatorio(), "Espeto Renomeado")
+        self.assertEqual(cache.estatisticas()["acertos"], 0)
+
+    def test_resumo_de_visita_e_gravado_no_encerramento_e_lido_sem_escrita(self):
+        operacao_id = db.iniciar_operacao(self.local_id)
+        pedidos = []
+        for quantidade in (2, 3):
+            pedido = db.salvar_novo_pedido(
+                {
+                    "nome_cliente": "Visita gravada",
+                    "itens": [{"id": self.produto_id, "quantidade": quantidade}],
+                    "metodo_pagamento": "pix",
+                    "modalidade": "local",
+                },
+                self.local_id,
+                operacao_id,
+            )
+            pedidos.append(pedido["id"])
+        self.assertTrue(db.confirmar_pagamento_pedido(pedidos[0]))
+        self.assertTrue(db.encerrar_operacao(operacao_id))
+
+        def resumo_gravado():
+            with closing(database.conectar()) as conn:
+                return conn.execute(
+                    "SELECT receita_centavos, pedidos, unidades FROM operacao_resumo "
+                    "WHERE operacao_id = ?",
+                    (operacao_id,),
+                ).fetchone()
+
+        def resumos():
+            with closing(database.conectar()) as conn:
+                operacao = conn.execute(
+                    "SELECT * FROM operacoes WHERE id = ?", (operacao_id,)
+                ).fetchone()
+                calculado = analytics._analisar_operacao_local(conn, operacao)
+                lido = analytics._resumos_operacoes(conn, [operacao])[operacao_id]
+            return calculado, lido
+
+        # O encerramento grava o resumo na mesma transação, e o pagamento
+        # tardio do segundo pedido o regrava na dele.
+        self.assertEqual(tuple(resumo_gravado()), (2000, 1, 2))
+        self.assertTrue(db.confirmar_pagamento_pedido(pedidos[1]))
+        self.assertEqual(tuple(resumo_gravado()), (5000, 2, 5))
+        calculado, lido = resumos()
+        self.assertEqual(lido, calculado)
+        with patch.object(
+            analytics, "_analisar_operacoes_locais", side_effect=AssertionError
+        ):
+            historico = analytics.desempenho_locais([self.local_id])
+        self.assertEqual(historico["locais"][0]["kpis"]["unidadesTotal"], 5)
+        produto = historico["locais"][0]["produtos"][0]
+        self.assertEqual(produto["totalVendido"], 5)
+        self.assertEqual(produto["mediaRestante"], 5)
+
+        # Um cancelamento tardio regrava o resumo na própria transação.
+        self.assertTrue(db.cancelar_pedido(pedidos[0]))
+        self.assertEqual(tuple(resumo_gravado()), (3000, 1, 3))
+        calculado, lido = resumos()
+        self.assertEqual(lido, calculado)
+
+        # Sem resumo gravado, a leitura calcula e não grava nada.
+        with closing(database.conectar()) as conn:
+            with conn:
+                conn.execute(
+                    "DELETE FROM operacao_resumo WHERE operacao_id = ?",
+                    (operacao_id,),
+                )
+        calculado, lido = resumos()
+        self.assertEqual(lido, calculado)
+        self.assertIsNone(resumo_gravado())
+        with closing(database.conectar()) as conn:
+            with conn:
+                self.assertEqual(database.preencher_resumos_operacoes(conn), 1)
+        self.assertEqual(tuple(resumo_gravado()), (3000, 1, 3))
+
+        self.assertEqual(db.retomar_operacao(operacao_id, self.local_id), operacao_id)
+        self.assertIsNone(resumo_gravado())
+        with closing(database.conectar()) as conn:
+            operacao = conn.execute(
+                "SELECT * FROM operacoes WHERE id = ?", (operacao_id,)
+            ).fetchone()
+            analytics._resumos_operacoes(conn, [operacao])
+        self.assertIsNone(resumo_gravado())
+
+    def test_visitas_sao_resumidas_em_lote_com_consultas_fixas(self):
+        def vender(operacao_id, quantidade, metodo="pix"):
+            pedido = db.salvar_novo_pedido(
+                {
+                    "nome_cliente": "Visita em lote",
+                    "itens": [{"id": self.produto_id, "quantidade": quantidade}],
+                    "metodo_pagamento": metodo,
+                    "modalidade": "local",
+                },
+                self.local_id,
+                operacao_id,
+            )
+            self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+            return pedido["id"]
+
+        primeira = db.iniciar_operacao(self.local_id)
+        vender(primeira, 2)
+        self.assertTrue(db.cancelar_pedido(vender(primeira, 1, "dinheiro")))
+        self.assertTrue(db.encerrar_operacao(primeira))
+        segunda = db.iniciar_operacao(self.local_id)
+        self.assertTrue(db.adicionar_estoque(self.produto_id, 5, 4.0))
+        vender(segunda, 13)
+        self.assertTrue(db.encerrar_operacao(segunda))
+        self.assertTrue(db.adicionar_estoque(self.produto_id, 3, 4.0))
+        aberta = db.iniciar_operacao(self.local_id)
+        vender(aberta, 1)
+
+        def resumir(conn, operacoes):
+            consultas = []
+            conn.set_trace_callback(consultas.append)
+            try:
+                resumos = analytics._analisar_operacoes_locais(conn, operacoes)
+            finally:
+                conn.set_trace_callback(None)
+            return resumos, len(consultas)
+
+        with closing(database.conectar()) as conn:
+            operacoes = conn.execute(
+                "SELECT * FROM operacoes ORDER BY id"
+            ).fetchall()
+            em_lote, consultas_lote = resumir(conn, operacoes)
+            _, consultas_uma = resumir(conn, operacoes[-1:])
+            isolados = {
+                int(operacao["id"]): analytics._analisar_operacao_local(
+                    conn, operacao
+                )
+                for operacao in operacoes
+            }
+
+        self.assertEqual(em_lote, isolados)
+        self.assertEqual(consultas_lote, consultas_uma)
+        self.assertEqual(em_lote[primeira]["pedidos"], 1)
+        self.assertEqual(em_lote[primeira]["estornos_centavos"], 1000)
+        self.assertTrue(em_lote[segunda]["produtos"][self.produto_id]["esgotou"])
+        self.assertEqual(
+            em_lote[aberta]["produtos"][self.produto_id]["restantes"], 2
+        )
+
     def test_produto_com_historico_e_apenas_arquivado(self):
         pedido = self.novo_pedido(1)
         self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
@@ -1040,6 +2610,55 @@ class PDVTestCase(unittest.TestCase):
             sum(fechamento_semana["vendasPorPeriodo"]["data"]), 103.0
         )
 
+    def test_serie_de_vendas_escolhe_granularidade_pelo_periodo(self):
+        pedido = self.novo_pedido(2)
+        self.assertTrue(db.confirmar_pagamento_pedido(pedido["id"]))
+        pago_em = datetime.fromisoformat(
+            db.obter_pedido_por_id(pedido["id"])["timestamp_pagamento"]
+        )
+        inicio_dt = pago_em - timedelta(hours=30)
+        casos = (
+            (timedelta(hours=6), "15_minutos", 24),
+            (timedelta(hours=36), "hora", 36),
+            (timedelta(days=30), "dia_operacional", 30),
+            (timedelta(days=120), "semana", 18),
+        )
+        for duracao, granularidade, pontos in casos:
+            fechamento = analytics._calcular_fechamento.__wrapped__(
+                inicio_dt.isoformat(),
+                (inicio_dt + duracao).isoformat(),
+                "todos",
+                ("kpis",),
+            )
+            serie = fechamento["vendasPorPeriodo"]
+            self.assertEqual(serie["granularidade"], granularidade)
+            self.assertEqual(len(serie["labels"]), pontos)
+            self.assertEqual(len(serie["data"]), pontos)
+            esperado = 20.0 if duracao > timedelta(days=1) else 0
+            self.assertEqual(sum(serie["data"]), esperado)
+            self.assertEqual(
+                sum(hora["faturamento"] for hora in fechamento["desempenhoPorHora"]),
+                esperado,
+            )
+
+        fim = (inicio_dt + timedelta(days=120)).isoformat()
+        reduzido = analytics.fechamento_operacional_v2(
+            inicio_dt.isoformat(), fim, "todos", 1, 50, ("kpis",), pontos=5
+        )["vendasPorPeriodo"]
+        self.assertEqual(len(reduzido["data"]), 5)
+        self.assertEqual(reduzido["pontosOriginais"], 18)
+        self.assertEqual(max(reduzido["data"]), 20.0)
+
+    def test_lttb_preserva_extremos_e_picos(self):
+        valores = [0, 1, 0, 1, 0, 9, 0, 1, 0, -7, 0, 1, 0]
+        indices = analytics._indices_lttb(valores, 5)
+        self.assertEqual(len(indices), 5)
+        self.assertEqual((indices[0], indices[-1]), (0, len(valores) - 1))
+        self.assertIn(5, indices)
+        self.assertIn(9, indices)
+        self.assertEqual(indices, sorted(indices))
+        self.assertEqual(analytics._indices_lttb(valores, 50), list(range(13)))
+
     def test_frequencia_avalia_apenas_visitas_com_disponibilidade(self):
         nomes = (
             "Frequência 60",